@@ -1,3 +1,6 @@
+from latency import LatencyMonitor, StartupProfile
+STARTUP = StartupProfile()
+
 import sys
 import serial
 import numpy as np
@@ -5,26 +8,146 @@ from PyQt5 import QtWidgets, QtCore
 import serial.tools.list_ports
 import pyqtgraph as pg
 import time
-from scipy.signal import savgol_filter, find_peaks
-import ramanspy as rp
-import pickle
-from scipy.interpolate import interp1d
-import pandas as pd
 import warnings
 import copy
 import os
-import glob
-import re as re_module
-import inspect as inspect_module
-import matplotlib
-matplotlib.use('Agg')  # non-interactive backend for saving plots
-import matplotlib.pyplot as plt
+STARTUP.mark('import Qt, pyqtgraph, numpy')
+# ramanspy, pandas, scipy.signal/interpolate and pickle are imported on first
+# use (mostly inside analysis.py): together they add several seconds to start
+from acquisition import (
+    Frame, FrameReader, FrameRingBuffer, FrameRecorder, AcquisitionStats, CommandChannel, GapDetector,
+    CALIB_REPLY_LEN
+)
+from processing import (
+    SpectrumAccumulator, AutoExposure, SpikeFilter, ProcessingChain, spectrum_graph, set_spectrum_params
+)
+from virtual_device import VIRTUAL_PORT_PREFIX, VirtualSpectrometer, is_virtual_port
+from devices import DeviceManager, MultiRecorder
+from darks import DarkLibrary, dark_key
+from resultcache import ResultCache, content_key
+import analysis
+import applog
+STARTUP.mark('import engine modules')
 
 
 
 warnings.filterwarnings("ignore", category=RuntimeWarning)
 
 
+class AcquisitionWorker(QtCore.QThread):
+    frame_ready = QtCore.pyqtSignal()
+    message = QtCore.pyqtSignal(str)
+
+    def __init__(self, serial_port, ring, verify_crc=True, parent=None):
+        super().__init__(parent)
+        self.serial_port = serial_port
+        self.ring = ring
+        # Pool must outlive every frame the ring can still hold
+        self.reader = FrameReader(pool_size=ring.capacity + 4, verify_crc=verify_crc)
+        self.stats = AcquisitionStats()
+        self.recorder = None
+        self.record_params = (0, 0, 0, 1, 0)
+        # External trigger capture: waiting for a trigger is not an error,
+        # and missing frames are found from the frame timing
+        self.triggered = False
+        self.gaps = None
+        self._running = False
+
+    def run(self):
+        self._running = True
+        self.stats = AcquisitionStats()
+        index = 0
+        crc_reported = False
+        while self._running:
+            try:
+                data, error = self.reader.read(self.serial_port)
+            except Exception as e:
+                if self._running:
+                    self.message.emit(f"Acquisition worker read error: {e}")
+                break
+            if not self._running:
+                break
+            if data is None and self.triggered and self.reader.buffered() == 0:
+                continue
+            if data is None:
+                self.stats.dropped += 1
+                self.stats.last_error = error
+                self.message.emit(error)
+                continue
+            if self.reader.crc_auto_disabled and not crc_reported:
+                crc_reported = True
+                self.message.emit(
+                    "Frame checksum never matched on consecutive clean frames: "
+                    "checksum verification is OFF until the next connection"
+                )
+            self.stats.frames_read += 1
+            timestamp = self.reader.header_time
+            if self.gaps is not None:
+                self.gaps.update(timestamp)
+            recorder = self.recorder
+            if recorder is not None:
+                recorder.append(data, timestamp, self.record_params)
+            # Only the frame that makes the ring non-empty needs to wake the
+            # GUI; it drains everything queued behind it in one go
+            queued = self.ring.push(Frame(index, timestamp, data))
+            index += 1
+            if queued == 1:
+                self.frame_ready.emit()
+
+    def stop(self):
+        self._running = False
+        try:
+            self.serial_port.cancel_read()
+        except Exception:
+            pass
+
+
+class DatabaseLoader(QtCore.QThread):
+    # Unpickles a spectra database off the GUI thread; the Ramanbase dump
+    # holds ~85k spectra and takes seconds to load
+    loaded = QtCore.pyqtSignal(object, str, float)
+    failed = QtCore.pyqtSignal(str, str)
+
+    def __init__(self, path, parent=None):
+        super().__init__(parent)
+        self.path = path
+
+    def run(self):
+        t0 = time.perf_counter()
+        try:
+            specdict = analysis.load_database(self.path)
+        except Exception as e:
+            self.failed.emit(self.path, str(e))
+            return
+        self.loaded.emit(specdict, self.path, time.perf_counter() - t0)
+
+
+class PreviewWorker(QtCore.QThread):
+    # One auto-apply preview: runs the processing chain and peak finding
+    # off the GUI thread. Results carry the request's generation so the GUI
+    # can drop those overtaken by a newer edit, and the peak parameters the
+    # found peaks belong to.
+    ready = QtCore.pyqtSignal(int, str, object, object, object, str)
+
+    def __init__(self, generation, key, spectrum, axis, params, peaks, parent=None):
+        super().__init__(parent)
+        self.generation = generation
+        self.key = key
+        self.spectrum = spectrum
+        self.axis = axis
+        self.params = params
+        self.peaks = peaks
+
+    def run(self):
+        try:
+            robj = analysis.process_spectrum(self.spectrum, self.axis, self.params)
+            found = analysis.spectrum_peaks(robj, *self.peaks) if self.peaks is not None else None
+        except ValueError as e:
+            self.ready.emit(self.generation, self.key, None, self.peaks, None, str(e))
+            return
+        self.ready.emit(self.generation, self.key, robj, self.peaks, found, "")
+
+
 class SpectrometerApp(QtWidgets.QMainWindow):
     def __init__(self):
         super().__init__()
@@ -32,25 +155,88 @@ class SpectrometerApp(QtWidgets.QMainWindow):
         self.serial_port.timeout = 10
         self.continuous_mode = False
         self.background_spectrum = None
+        # Settings the current background was taken at (None: unknown)
+        self.background_key = None
+        self.dark_library = DarkLibrary(path="dark_library.npz")
         self.average_count = 1
 
         # Restored old defaults
         self.wavelength_min = 796 #from spectrometer sheet
         self.wavelength_max = 1119
         self.wavelengths = np.linspace(self.wavelength_min, self.wavelength_max, 2048)
+        self.wavelengths.setflags(write=False)
+        self.axis_cache = {}
 
         self.frame_count = 0
         self.start_time = time.time()
         self.collection_count = 0
+        self.frame_ring = FrameRingBuffer(capacity=64)
+        self.plot_refresh_hz = 30
+        self.latency = LatencyMonitor()
+        # Leveled log kept in a bounded ring; the widget is fed in batches
+        # by log_timer (see flush_log)
+        self.logger = applog.get_logger()
+        self.log_ring = applog.LogRing(capacity=2000)
+        self.logger.addHandler(self.log_ring)
+        self.log_file = None
+        self.frame_reader = FrameReader()
+        self.frame_reader.latency = self.latency
+        self.commands = CommandChannel(self.serial_port)
+        self.commands.latency = self.latency
+        self.accumulator = SpectrumAccumulator(2048)
+        self.accumulate_enabled = False
+        self.spike_filter = SpikeFilter()
+        self.spike_filter_enabled = False
+        # Compiled crop/SavGol/baseline/normalize chain for live processing,
+        # rebuilt when the axis or the Process Spectra settings change
+        self.live_chain = None
+        self.acq_worker = None
+        self.trigger_capture = 0
+        self.recorder = None
+        # Additional spectrometers, each with its own port, worker, background,
+        # axis and calibration (Spectrometers dock)
+        self.device_manager = DeviceManager()
         self.max_cache_size = 5
         self.smoothing_factor = 0.1
         self.current_spectrum_1 = None
         self.original_spectrum = None
+        # Axis of original_spectrum when it is not the device axis (DB
+        # spectra, scan means); Apply always starts from it
+        self.original_axis = None
         self.processed_spectrum = None
+        self.processed_axis = None
         self.peaks = None
         self.rspec = None
         self.cur_spectrum_is_db = False
         self.current_db_path = None
+        # Processed spectra, peaks and search results by content_key();
+        # db_generation is part of search keys and changes with the database
+        self.result_cache = ResultCache()
+        self.db_generation = 0
+        # Apply's crop/SavGol/baseline/normalize steps and the preprocessed
+        # database as memoized stages: a changed setting reruns only its
+        # stage and those after it
+        self.processing_graph = spectrum_graph()
+        self.processing_graph.add_stage('database_source')
+        self.processing_graph.add_stage(
+            'database', lambda params, specdict: analysis.preprocess_database(specdict, params, log=self.log),
+            ('database_source',)
+        )
+        # Auto-apply: edits restart preview_timer; when it fires one
+        # PreviewWorker runs the newest settings (a later edit makes the
+        # running one stale and queues a rerun). The database search waits
+        # for settle_timer, i.e. until the settings stop changing.
+        self.preview_generation = 0
+        self.preview_worker = None
+        self.preview_pending = False
+        self.preview_timer = QtCore.QTimer(self)
+        self.preview_timer.setSingleShot(True)
+        self.preview_timer.setInterval(150)
+        self.preview_timer.timeout.connect(self.start_preview)
+        self.settle_timer = QtCore.QTimer(self)
+        self.settle_timer.setSingleShot(True)
+        self.settle_timer.setInterval(1000)
+        self.settle_timer.timeout.connect(self.on_preview_settled)
         self.specdict = None
         self.searchres = None
         self.smoothing_level = 6  # default
@@ -75,25 +261,15 @@ class SpectrometerApp(QtWidgets.QMainWindow):
         self.use_raman = False
 
         self.init_ui()
+        STARTUP.mark('init_ui')
 
-        default_path = os.getcwd() + "/rbase_specdictcur.pkl"
-        if os.path.exists(default_path):
-            try:
-                with open(default_path, "rb") as f:
-                    self.specdict = pickle.load(f)
-                self.current_db_path = default_path
-                self.log(f"Auto-loaded current database: {default_path} (n={len(self.specdict)} spectra)")
-            except Exception as e:
-                self.log(f"Failed to auto-load default database '{default_path}': {e}")
-                self.specdict = {}
-        else:
-            self.log("Default database file not found. Please load one manually.")
-            self.specdict = {}
-
-        # Restored default software calibration loading
-        self.load_default_calibration()
+        # Default database and calibration are loaded once the window is
+        # shown (finish_startup)
+        self.db_loader = None
+        self._startup_pending = True
 
         self.searchres = None
+        # Pooled peak markers: shown/moved in place instead of recreated
         self.peak_lines = []
         self.peak_labels = []
 
@@ -110,6 +286,7 @@ class SpectrometerApp(QtWidgets.QMainWindow):
         self.stage_serial = None
         self._stage_abort_flag = False
         self.create_stage_panel()
+        self.create_devices_panel()
 
         self.setDockOptions(
             QtWidgets.QMainWindow.AnimatedDocks |
@@ -124,6 +301,91 @@ class SpectrometerApp(QtWidgets.QMainWindow):
         )
 
         self.stage_refresh_ports()
+        STARTUP.mark('panels')
+
+    def showEvent(self, event):
+        super().showEvent(event)
+        if self._startup_pending:
+            self._startup_pending = False
+            QtCore.QTimer.singleShot(0, self.finish_startup)
+
+    def closeEvent(self, event):
+        self.stop_devices()
+        if self.device_recorder is not None:
+            self.btn_devices_record.setChecked(False)
+        self.device_manager.close_all()
+        if self.db_loader is not None and self.db_loader.isRunning():
+            self.log("Waiting for database load to finish...")
+            self.db_loader.wait()
+        self.preview_timer.stop()
+        self.settle_timer.stop()
+        if self.preview_worker is not None:
+            self.preview_worker.wait()
+        self.log_timer.stop()
+        self.logger.removeHandler(self.log_ring)
+        applog.set_file_sink(self.logger, None)
+        super().closeEvent(event)
+
+    def finish_startup(self):
+        STARTUP.mark('show window')
+        # Restored default software calibration loading
+        self.load_default_calibration()
+        STARTUP.mark('default calibration')
+        self.load_dark_library()
+        STARTUP.mark('dark library')
+        self.load_default_database()
+        self.log(f"Window ready in {STARTUP.elapsed():.2f} s:")
+        for line in STARTUP.report():
+            self.log(f"  {line}")
+
+    def load_default_database(self):
+        default_path = os.getcwd() + "/rbase_specdictcur.pkl"
+        if not os.path.exists(default_path):
+            self.log("Default database file not found. Please load one manually.")
+            self.specdict = {}
+            return
+        self.log(f"Loading default database in the background: {default_path}")
+        self.lbl_current_db.setText("Loading database...")
+        # Adding before the default database lands would replace it
+        self.btn_add_to_db.setEnabled(False)
+        self.db_loader = DatabaseLoader(default_path, self)
+        self.db_loader.loaded.connect(self.on_default_database_loaded)
+        self.db_loader.failed.connect(self.on_default_database_failed)
+        self.db_loader.start()
+
+    def on_default_database_loaded(self, specdict, path, seconds):
+        STARTUP.add('default database (bg)', seconds)
+        self.btn_add_to_db.setEnabled(True)
+        if self.specdict is not None:
+            # Another database was loaded or created meanwhile; keep it
+            self.log(f"Default database loaded after another one was set, discarding: {path}")
+            return
+        self.specdict = specdict
+        self.current_db_path = path
+        self.lbl_current_db.setText(f"DB: {os.path.basename(path)}")
+        self.lbl_current_db.setStyleSheet("color: green;")
+        self.log(f"Auto-loaded current database: {path} (n={len(specdict)} spectra) in {seconds:.2f} s")
+
+    def on_default_database_failed(self, path, error):
+        self.log(f"Failed to auto-load default database '{path}': {error}", applog.ERROR)
+        self.btn_add_to_db.setEnabled(True)
+        if self.specdict is None:
+            self.specdict = {}
+            self.lbl_current_db.setText("No database loaded")
+            self.lbl_current_db.setStyleSheet("color: gray; font-style: italic;")
+
+    def database_loading(self):
+        return self.db_loader is not None and self.db_loader.isRunning()
+
+    @property
+    def specdict(self):
+        return self._specdict
+
+    @specdict.setter
+    def specdict(self, specdict):
+        # A new database never matches cached search results
+        self._specdict = specdict
+        self.db_generation += 1
 
     def init_ui(self):
         self.setWindowTitle('Line Spectra Viewer v2.0')
@@ -168,6 +430,25 @@ class SpectrometerApp(QtWidgets.QMainWindow):
         self.plot_curve_1 = self.plot_widget.plot(pen=pg.mkPen('b', width=2), name="Spectrum")
         self.plot_curve_ref = self.plot_widget.plot(pen=pg.mkPen('g', width=2), name="Reference")
         self.plot_curve_ref.setVisible(False)
+        for curve in (self.plot_curve_1, self.plot_curve_ref):
+            curve.setDownsampling(auto=True, method='peak')
+            curve.setClipToView(True)
+
+        # Continuous mode redraws at most plot_refresh_hz times per second,
+        # always with the newest frame
+        self.redraw_timer = QtCore.QTimer(self)
+        self.redraw_timer.setSingleShot(True)
+        self.redraw_timer.timeout.connect(self.on_worker_frame_ready)
+        self.last_redraw = 0.0
+
+        self.plot_curve_upper = pg.PlotDataItem(pen=pg.mkPen((0, 0, 255, 60)))
+        self.plot_curve_lower = pg.PlotDataItem(pen=pg.mkPen((0, 0, 255, 60)))
+        self.plot_band = pg.FillBetweenItem(
+            self.plot_curve_upper, self.plot_curve_lower, brush=pg.mkBrush(0, 0, 255, 50)
+        )
+        for item in (self.plot_curve_upper, self.plot_curve_lower, self.plot_band):
+            self.plot_widget.addItem(item)
+            item.setVisible(False)
 
         self.plot_widget.setLabel('left', 'Light Intensity')
         self.plot_widget.setLabel('bottom', 'Wavelength (nm) or Raman shift (cm<sup>-1</sup>)')
@@ -177,12 +458,25 @@ class SpectrometerApp(QtWidgets.QMainWindow):
         self.status_bar.addPermanentWidget(self.fps_label)
         self.collection_label = QtWidgets.QLabel("Acquisitions: 0")
         self.status_bar.addPermanentWidget(self.collection_label)
+        self.dropped_label = QtWidgets.QLabel("Dropped: 0 / Overwritten: 0 / Corrupt: 0 / Resyncs: 0")
+        self.status_bar.addPermanentWidget(self.dropped_label)
+        self.accum_label = QtWidgets.QLabel("")
+        self.status_bar.addPermanentWidget(self.accum_label)
+        self.latency_label = QtWidgets.QLabel("Latency: -")
+        self.status_bar.addPermanentWidget(self.latency_label)
+        self.latency_timer = QtCore.QTimer(self)
+        self.latency_timer.timeout.connect(self.update_latency_panel)
+        self.latency_timer.start(1000)
 
         self.log_widget = QtWidgets.QPlainTextEdit()
         self.log_widget.setReadOnly(True)
         self.log_widget.setMaximumHeight(120)
         self.log_widget.setPlaceholderText("Application log...")
+        self.log_widget.setMaximumBlockCount(self.log_ring.capacity)
         layout.addWidget(self.log_widget)
+        self.log_timer = QtCore.QTimer(self)
+        self.log_timer.timeout.connect(self.flush_log)
+        self.log_timer.start(200)
 
         self.process_dock = QtWidgets.QDockWidget("Process Spectra", self)
         self.process_dock.setAllowedAreas(
@@ -295,19 +589,22 @@ class SpectrometerApp(QtWidgets.QMainWindow):
         default_path = "calibration_cur.csv"
         if os.path.exists(default_path):
             try:
-                df = pd.read_csv(default_path, header=None)
-                self.calib_coeffs_soft = df.values.flatten()[:3].tolist()
+                self.calib_coeffs_soft = analysis.load_calibration(default_path)
+                self.invalidate_axis_cache()
                 self.current_calib_path = default_path
                 self.is_calibrated = True
                 self.use_raman = True
 
+                if hasattr(self, 'checkbox_to_raman'):
+                    self.checkbox_to_raman.setChecked(True)
+
                 if hasattr(self, 'lbl_current_calib'):
                     self.lbl_current_calib.setText(f"Calib: {os.path.basename(default_path)} (default)")
                     self.lbl_current_calib.setStyleSheet("color: green;")
 
                 self.log(f"Loaded default calibration: {self.calib_coeffs_soft}")
             except Exception as e:
-                self.log(f"Failed to load default calibration: {e}")
+                self.log(f"Failed to load default calibration: {e}", applog.ERROR)
                 self.calib_coeffs_soft = None
                 self.is_calibrated = False
                 self.use_raman = False
@@ -323,8 +620,8 @@ class SpectrometerApp(QtWidgets.QMainWindow):
         )
         if file_name:
             try:
-                df = pd.read_csv(file_name, header=None)
-                self.calib_coeffs_soft = df.values.flatten()[:3].tolist()
+                self.calib_coeffs_soft = analysis.load_calibration(file_name)
+                self.invalidate_axis_cache()
                 self.current_calib_path = file_name
                 self.is_calibrated = True
                 self.use_raman = True
@@ -340,7 +637,7 @@ class SpectrometerApp(QtWidgets.QMainWindow):
                     self.spectral_axis = self.get_current_axis()
                     self.update_plot(self.spectral_axis, self.current_spectrum_1)
             except Exception as e:
-                self.log(f"Failed to load calibration: {e}")
+                self.log(f"Failed to load calibration: {e}", applog.ERROR)
 
     def save_calibration_as(self):
         if self.calib_coeffs_soft is None:
@@ -351,11 +648,12 @@ class SpectrometerApp(QtWidgets.QMainWindow):
             self, "Save Calibration", "", "CSV Files (*.csv)"
         )
         if file_name:
+            import pandas as pd
             try:
                 pd.DataFrame(self.calib_coeffs_soft).to_csv(file_name, index=False, header=False)
                 self.log(f"Saved calibration to {file_name}")
             except Exception as e:
-                self.log(f"Failed to save calibration: {e}")
+                self.log(f"Failed to save calibration: {e}", applog.ERROR)
 
     def save_as_default_calib(self):
         if self.calib_coeffs_soft is None:
@@ -373,6 +671,7 @@ class SpectrometerApp(QtWidgets.QMainWindow):
             if reply != QtWidgets.QMessageBox.Yes:
                 return
 
+        import pandas as pd
         try:
             pd.DataFrame(self.calib_coeffs_soft).to_csv(default_path, index=False, header=False)
             self.current_calib_path = default_path
@@ -380,7 +679,7 @@ class SpectrometerApp(QtWidgets.QMainWindow):
             self.lbl_current_calib.setStyleSheet("color: green;")
             self.log(f"Saved as default calibration: {default_path}")
         except Exception as e:
-            self.log(f"Failed to save default calibration: {e}")
+            self.log(f"Failed to save default calibration: {e}", applog.ERROR)
 
     def fit_calibration(self):
         observed_shifts = []
@@ -406,6 +705,7 @@ class SpectrometerApp(QtWidgets.QMainWindow):
 
         coeffs = np.polyfit(observed_shifts, expected_shifts, 2)
         self.calib_coeffs_soft = coeffs.tolist()
+        self.invalidate_axis_cache()
         self.is_calibrated = True
         self.use_raman = True
 
@@ -421,16 +721,20 @@ class SpectrometerApp(QtWidgets.QMainWindow):
             self.update_plot(self.spectral_axis, self.current_spectrum_1)
 
     def get_current_axis(self):
-        if self.use_raman:
-            initial_shifts = rp.utils.wavelength_to_wavenumber(
-                self.wavelengths, self.exc_wlen_spin.value()
-            )
-            if self.is_calibrated and self.calib_coeffs_soft:
-                a, b, c = self.calib_coeffs_soft
-                calibrated_shifts = a * initial_shifts**2 + b * initial_shifts + c
-                return calibrated_shifts
-            return initial_shifts
-        return self.wavelengths
+        # Axes are read-only and shared between frames; copy before modifying
+        if not self.use_raman:
+            return self.wavelengths
+        coeffs = tuple(self.calib_coeffs_soft) if self.is_calibrated and self.calib_coeffs_soft else None
+        key = (self.wavelength_min, self.wavelength_max, self.exc_wlen_spin.value(), coeffs)
+        axis = self.axis_cache.get(key)
+        if axis is None:
+            axis = analysis.wavelength_to_raman(self.wavelengths, key[2], coeffs)
+            axis.setflags(write=False)
+            self.axis_cache[key] = axis
+        return axis
+
+    def invalidate_axis_cache(self, *args):
+        self.axis_cache.clear()
 
     def on_to_raman_changed(self, state):
         self.use_raman = state == QtCore.Qt.Checked
@@ -446,6 +750,8 @@ class SpectrometerApp(QtWidgets.QMainWindow):
         self.wavelength_min = self.spin_start_wl.value()
         self.wavelength_max = self.spin_end_wl.value()
         self.wavelengths = np.linspace(self.wavelength_min, self.wavelength_max, 2048)
+        self.wavelengths.setflags(write=False)
+        self.invalidate_axis_cache()
         self.log(f"Updated wavelength range: {self.wavelength_min} - {self.wavelength_max}")
         if self.current_spectrum_1 is not None:
             self.spectral_axis = self.get_current_axis()
@@ -480,13 +786,18 @@ class SpectrometerApp(QtWidgets.QMainWindow):
         control_layout.addWidget(self.btn_single)
 
         self.btn_continuous = QtWidgets.QPushButton('Continuous Acquire')
-        self.btn_continuous.clicked.connect(self.continuous_acquisition)
+        self.btn_continuous.clicked.connect(lambda: self.continuous_acquisition())
         control_layout.addWidget(self.btn_continuous)
 
         self.btn_pause = QtWidgets.QPushButton('Pause')
         self.btn_pause.clicked.connect(self.pause_acquisition)
         control_layout.addWidget(self.btn_pause)
 
+        self.btn_record = QtWidgets.QPushButton('Record')
+        self.btn_record.setCheckable(True)
+        self.btn_record.toggled.connect(self.toggle_recording)
+        control_layout.addWidget(self.btn_record)
+
         control_layout.addWidget(QtWidgets.QLabel('Integration Time (ms):'))
         self.spin_integration_time = QtWidgets.QSpinBox()
         self.spin_integration_time.setRange(1, 60000)
@@ -497,6 +808,10 @@ class SpectrometerApp(QtWidgets.QMainWindow):
         btn_set_time.clicked.connect(self.set_integration_time)
         control_layout.addWidget(btn_set_time)
 
+        btn_auto_exposure = QtWidgets.QPushButton('Auto Exposure')
+        btn_auto_exposure.clicked.connect(lambda: self.auto_exposure())
+        control_layout.addWidget(btn_auto_exposure)
+
         control_layout.addWidget(QtWidgets.QLabel('Average (1-255):'))
         self.spin_average_count = QtWidgets.QSpinBox()
         self.spin_average_count.setRange(1, 255)
@@ -548,6 +863,12 @@ class SpectrometerApp(QtWidgets.QMainWindow):
         btn_advanced.clicked.connect(lambda: self.advanced_dock.setVisible(not self.advanced_dock.isVisible()))
         control_layout.addWidget(btn_advanced)
 
+        btn_devices = QtWidgets.QPushButton('Spectrometers...')
+        btn_devices.clicked.connect(
+            lambda: self.devices_dock.setVisible(not self.devices_dock.isVisible())
+        )
+        control_layout.addWidget(btn_devices)
+
         btn_stage = QtWidgets.QPushButton('Stage Control...')
         btn_stage.clicked.connect(
             lambda: self.stage_dock.setVisible(not self.stage_dock.isVisible())
@@ -578,9 +899,9 @@ class SpectrometerApp(QtWidgets.QMainWindow):
         btn_reload_db.clicked.connect(self.reload_current_database)
         db_layout.addWidget(btn_reload_db)
 
-        btn_add_to_db = QtWidgets.QPushButton('Add spectrum to the base')
-        btn_add_to_db.clicked.connect(self.add_current_to_db)
-        db_layout.addWidget(btn_add_to_db)
+        self.btn_add_to_db = QtWidgets.QPushButton('Add spectrum to the base')
+        self.btn_add_to_db.clicked.connect(self.add_current_to_db)
+        db_layout.addWidget(self.btn_add_to_db)
 
         btn_remove_from_db = QtWidgets.QPushButton('Delete from base')
         btn_remove_from_db.clicked.connect(self.remove_from_db)
@@ -631,6 +952,11 @@ class SpectrometerApp(QtWidgets.QMainWindow):
         self.cb_trigger_out.stateChanged.connect(self.set_trigger_out)
         adv_layout.addWidget(self.cb_trigger_out)
 
+        self.cb_verify_crc = QtWidgets.QCheckBox('Verify frame checksum')
+        self.cb_verify_crc.setChecked(self.frame_reader.verify_crc)
+        self.cb_verify_crc.stateChanged.connect(self.set_verify_crc)
+        adv_layout.addWidget(self.cb_verify_crc)
+
         adv_layout.addWidget(QtWidgets.QLabel('Gain (0-255):'))
         self.spin_gain = QtWidgets.QSpinBox()
         self.spin_gain.setRange(0, 255)
@@ -679,6 +1005,204 @@ class SpectrometerApp(QtWidgets.QMainWindow):
         btn_set_smooth.clicked.connect(lambda: self.set_smoothing_level(self.spin_smooth.value()))
         adv_layout.addWidget(btn_set_smooth)
 
+        adv_layout.addWidget(QtWidgets.QLabel('Plot refresh cap (Hz):'))
+        self.spin_refresh_hz = QtWidgets.QSpinBox()
+        self.spin_refresh_hz.setRange(1, 240)
+        self.spin_refresh_hz.setValue(self.plot_refresh_hz)
+        self.spin_refresh_hz.valueChanged.connect(self.set_plot_refresh_hz)
+        adv_layout.addWidget(self.spin_refresh_hz)
+
+        accum_group = QtWidgets.QGroupBox("Software Accumulation (continuous mode)")
+        accum_layout = QtWidgets.QFormLayout()
+        self.cb_accumulate = QtWidgets.QCheckBox("Enable")
+        self.cb_accumulate.stateChanged.connect(self.on_accumulate_changed)
+        accum_layout.addRow(self.cb_accumulate)
+        self.spin_accum_frames = QtWidgets.QSpinBox()
+        self.spin_accum_frames.setRange(0, 1000000)
+        self.spin_accum_frames.setValue(100)
+        self.spin_accum_frames.setSpecialValueText("No limit")
+        self.spin_accum_frames.valueChanged.connect(self.on_accumulate_changed)
+        accum_layout.addRow("Frames (N):", self.spin_accum_frames)
+        self.spin_accum_window = QtWidgets.QDoubleSpinBox()
+        self.spin_accum_window.setRange(0, 86400)
+        self.spin_accum_window.setValue(0)
+        self.spin_accum_window.setSpecialValueText("No limit")
+        self.spin_accum_window.valueChanged.connect(self.on_accumulate_changed)
+        accum_layout.addRow("Time window (s):", self.spin_accum_window)
+        self.cb_accum_band = QtWidgets.QCheckBox("Show ±SEM band")
+        self.cb_accum_band.setChecked(True)
+        accum_layout.addRow(self.cb_accum_band)
+        accum_group.setLayout(accum_layout)
+        adv_layout.addWidget(accum_group)
+
+        spike_group = QtWidgets.QGroupBox("Spike Removal")
+        spike_layout = QtWidgets.QFormLayout()
+        self.cb_spike_filter = QtWidgets.QCheckBox("Remove cosmic-ray spikes")
+        self.cb_spike_filter.stateChanged.connect(self.on_spike_filter_changed)
+        spike_layout.addRow(self.cb_spike_filter)
+        self.combo_spike_mode = QtWidgets.QComboBox()
+        self.combo_spike_mode.addItems(["Single frame", "Temporal (frame stack)"])
+        self.combo_spike_mode.setToolTip(
+            "Single frame compares each frame with its running median and can clip Raman lines\n"
+            "only 1-2 px wide (sigma below ~0.8 px); temporal mode compares recent frames and\n"
+            "leaves lines that are present in every frame alone"
+        )
+        self.combo_spike_mode.currentIndexChanged.connect(self.on_spike_filter_changed)
+        spike_layout.addRow("Live mode:", self.combo_spike_mode)
+        self.spin_spike_threshold = QtWidgets.QDoubleSpinBox()
+        self.spin_spike_threshold.setRange(2.0, 50.0)
+        self.spin_spike_threshold.setValue(self.spike_filter.threshold)
+        self.spin_spike_threshold.valueChanged.connect(self.on_spike_filter_changed)
+        spike_layout.addRow("Threshold (sigma):", self.spin_spike_threshold)
+        self.spin_spike_history = QtWidgets.QSpinBox()
+        self.spin_spike_history.setRange(3, 50)
+        self.spin_spike_history.setValue(self.spike_filter.history)
+        self.spin_spike_history.valueChanged.connect(self.on_spike_filter_changed)
+        spike_layout.addRow("Stack frames:", self.spin_spike_history)
+        spike_group.setLayout(spike_layout)
+        adv_layout.addWidget(spike_group)
+
+        autoexp_group = QtWidgets.QGroupBox("Auto Exposure")
+        autoexp_layout = QtWidgets.QFormLayout()
+        self.spin_autoexp_fill = QtWidgets.QSpinBox()
+        self.spin_autoexp_fill.setRange(10, 95)
+        self.spin_autoexp_fill.setValue(70)
+        self.spin_autoexp_fill.setSuffix(" %")
+        autoexp_layout.addRow("Target peak fill:", self.spin_autoexp_fill)
+        self.spin_autoexp_max_time = QtWidgets.QSpinBox()
+        self.spin_autoexp_max_time.setRange(1, 60000)
+        self.spin_autoexp_max_time.setValue(10000)
+        autoexp_layout.addRow("Max time (ms):", self.spin_autoexp_max_time)
+        self.spin_autoexp_probes = QtWidgets.QSpinBox()
+        self.spin_autoexp_probes.setRange(2, 20)
+        self.spin_autoexp_probes.setValue(6)
+        autoexp_layout.addRow("Max probe frames:", self.spin_autoexp_probes)
+        self.spin_autoexp_start = QtWidgets.QSpinBox()
+        self.spin_autoexp_start.setRange(1, 60000)
+        self.spin_autoexp_start.setValue(10)
+        autoexp_layout.addRow("First probe (ms):", self.spin_autoexp_start)
+        autoexp_group.setLayout(autoexp_layout)
+        adv_layout.addWidget(autoexp_group)
+
+        trigger_group = QtWidgets.QGroupBox("External Trigger Capture")
+        trigger_layout = QtWidgets.QFormLayout()
+        self.combo_trigger_mode = QtWidgets.QComboBox()
+        self.combo_trigger_mode.addItem("External continuous (1)", 1)
+        self.combo_trigger_mode.addItem("External monopulse (2)", 2)
+        trigger_layout.addRow("Trigger mode:", self.combo_trigger_mode)
+        self.spin_trigger_period = QtWidgets.QDoubleSpinBox()
+        self.spin_trigger_period.setRange(0.0, 60000.0)
+        self.spin_trigger_period.setDecimals(3)
+        self.spin_trigger_period.setSpecialValueText("auto")
+        self.spin_trigger_period.setToolTip(
+            "Expected trigger period for gap detection; auto estimates it from the first frames"
+        )
+        trigger_layout.addRow("Trigger period (ms):", self.spin_trigger_period)
+        trigger_btns = QtWidgets.QHBoxLayout()
+        btn_arm = QtWidgets.QPushButton("Arm && Capture")
+        btn_arm.clicked.connect(self.start_trigger_capture)
+        trigger_btns.addWidget(btn_arm)
+        btn_disarm = QtWidgets.QPushButton("Disarm")
+        btn_disarm.clicked.connect(self.pause_acquisition)
+        trigger_btns.addWidget(btn_disarm)
+        trigger_layout.addRow(trigger_btns)
+        trigger_group.setLayout(trigger_layout)
+        adv_layout.addWidget(trigger_group)
+
+        latency_group = QtWidgets.QGroupBox("Latency Instrumentation")
+        latency_layout = QtWidgets.QVBoxLayout()
+        self.cb_latency = QtWidgets.QCheckBox("Record per-stage latency")
+        self.cb_latency.setChecked(self.latency.enabled)
+        self.cb_latency.stateChanged.connect(self.set_latency_enabled)
+        latency_layout.addWidget(self.cb_latency)
+        btn_dump_latency = QtWidgets.QPushButton("Dump Latency Stats...")
+        btn_dump_latency.clicked.connect(self.dump_latency_stats)
+        latency_layout.addWidget(btn_dump_latency)
+        btn_reset_latency = QtWidgets.QPushButton("Reset Latency Stats")
+        btn_reset_latency.clicked.connect(self.reset_latency_stats)
+        latency_layout.addWidget(btn_reset_latency)
+        latency_group.setLayout(latency_layout)
+        adv_layout.addWidget(latency_group)
+
+        dark_group = QtWidgets.QGroupBox("Dark Library")
+        dark_layout = QtWidgets.QFormLayout()
+        self.cb_dark_library = QtWidgets.QCheckBox("Pick stored dark when settings change")
+        self.cb_dark_library.setChecked(True)
+        self.cb_dark_library.setToolTip(
+            "Backgrounds are stored per integration time, gain, offset and average count;\n"
+            "missing integration times are interpolated between the nearest stored ones"
+        )
+        self.cb_dark_library.stateChanged.connect(self.on_dark_library_settings_changed)
+        dark_layout.addRow(self.cb_dark_library)
+        self.spin_dark_max_age = QtWidgets.QSpinBox()
+        self.spin_dark_max_age.setRange(1, 10080)
+        self.spin_dark_max_age.setValue(int(self.dark_library.max_age_s / 60))
+        self.spin_dark_max_age.setSuffix(" min")
+        self.spin_dark_max_age.valueChanged.connect(self.on_dark_library_settings_changed)
+        dark_layout.addRow("Expire after:", self.spin_dark_max_age)
+        self.lbl_dark_library = QtWidgets.QLabel("")
+        dark_layout.addRow(self.lbl_dark_library)
+        btn_clear_darks = QtWidgets.QPushButton("Clear Dark Library")
+        btn_clear_darks.clicked.connect(self.clear_dark_library)
+        dark_layout.addRow(btn_clear_darks)
+        dark_group.setLayout(dark_layout)
+        adv_layout.addWidget(dark_group)
+
+        cache_group = QtWidgets.QGroupBox("Result Cache")
+        cache_layout = QtWidgets.QFormLayout()
+        self.spin_result_cache_mb = QtWidgets.QSpinBox()
+        self.spin_result_cache_mb.setRange(0, 4096)
+        self.spin_result_cache_mb.setSingleStep(64)
+        self.spin_result_cache_mb.setValue(self.result_cache.max_bytes // (1024 * 1024))
+        self.spin_result_cache_mb.setSuffix(" MB")
+        self.spin_result_cache_mb.setToolTip(
+            "Processed spectra, peaks and search results are kept per spectrum and settings,\n"
+            "so Apply with unchanged settings returns immediately; 0 disables the cache"
+        )
+        self.spin_result_cache_mb.valueChanged.connect(self.on_result_cache_size_changed)
+        cache_layout.addRow("Size limit:", self.spin_result_cache_mb)
+        self.lbl_result_cache = QtWidgets.QLabel("")
+        cache_layout.addRow(self.lbl_result_cache)
+        btn_clear_cache = QtWidgets.QPushButton("Clear Result Cache")
+        btn_clear_cache.clicked.connect(self.clear_result_cache)
+        cache_layout.addRow(btn_clear_cache)
+        cache_group.setLayout(cache_layout)
+        adv_layout.addWidget(cache_group)
+        self.update_result_cache_label()
+
+        log_group = QtWidgets.QGroupBox("Logging")
+        log_layout = QtWidgets.QFormLayout()
+        self.combo_log_level = QtWidgets.QComboBox()
+        for name, level in applog.LEVELS.items():
+            self.combo_log_level.addItem(name, level)
+        self.combo_log_level.setCurrentText("Info")
+        self.combo_log_level.setToolTip("Debug also logs command bytes and processed arrays")
+        self.combo_log_level.currentIndexChanged.connect(self.on_log_settings_changed)
+        log_layout.addRow("Log level:", self.combo_log_level)
+        self.spin_log_lines = QtWidgets.QSpinBox()
+        self.spin_log_lines.setRange(100, 100000)
+        self.spin_log_lines.setSingleStep(500)
+        self.spin_log_lines.setValue(self.log_ring.capacity)
+        self.spin_log_lines.valueChanged.connect(self.on_log_settings_changed)
+        log_layout.addRow("Lines kept:", self.spin_log_lines)
+        self.cb_log_file = QtWidgets.QCheckBox("Also write to file")
+        self.cb_log_file.toggled.connect(self.toggle_log_file)
+        log_layout.addRow(self.cb_log_file)
+        self.spin_log_file_mb = QtWidgets.QDoubleSpinBox()
+        self.spin_log_file_mb.setRange(0.1, 1000.0)
+        self.spin_log_file_mb.setValue(5.0)
+        self.spin_log_file_mb.setSuffix(" MB")
+        log_layout.addRow("Rotate at:", self.spin_log_file_mb)
+        self.spin_log_file_backups = QtWidgets.QSpinBox()
+        self.spin_log_file_backups.setRange(0, 50)
+        self.spin_log_file_backups.setValue(3)
+        log_layout.addRow("Old files kept:", self.spin_log_file_backups)
+        btn_clear_log = QtWidgets.QPushButton("Clear Log Window")
+        btn_clear_log.clicked.connect(self.log_widget.clear)
+        log_layout.addRow(btn_clear_log)
+        log_group.setLayout(log_layout)
+        adv_layout.addWidget(log_group)
+
         adv_layout.addStretch()
 
         adv_scroll = QtWidgets.QScrollArea()
@@ -688,6 +1212,144 @@ class SpectrometerApp(QtWidgets.QMainWindow):
         adv_scroll.setVerticalScrollBarPolicy(QtCore.Qt.ScrollBarAsNeeded)
         self.advanced_dock.setWidget(adv_scroll)
 
+    def set_plot_refresh_hz(self, value):
+        self.plot_refresh_hz = max(1, int(value))
+
+    def on_accumulate_changed(self, *args):
+        self.accumulate_enabled = self.cb_accumulate.isChecked()
+        self.accumulator.target_frames = self.spin_accum_frames.value()
+        self.accumulator.window_s = self.spin_accum_window.value()
+        self.accumulator.reset()
+        if not self.accumulate_enabled:
+            self.set_accumulation_band_visible(False)
+            self.accum_label.setText("")
+
+    def on_spike_filter_changed(self, *args):
+        self.spike_filter_enabled = self.cb_spike_filter.isChecked()
+        self.spike_filter.temporal = self.combo_spike_mode.currentIndex() == 1
+        self.spike_filter.threshold = self.spin_spike_threshold.value()
+        self.spike_filter.history = self.spin_spike_history.value()
+        self.spike_filter.reset()
+
+    def remove_spikes(self, data_1, temporal=None, log=None):
+        # In place on a float frame; logs the replaced pixels when asked to
+        if not self.spike_filter_enabled:
+            return data_1
+        data_1, spikes = self.spike_filter.filter(data_1, out=data_1, temporal=temporal)
+        if log is not None and len(spikes):
+            log(f"  replaced {len(spikes)} spike pixel(s) at {spikes.tolist()[:10]}")
+        return data_1
+
+    def accumulate_frame(self, data_1, display=True):
+        acc = self.accumulator
+        if acc.is_complete():
+            acc.reset()
+        acc.add(data_1)
+        if acc.is_complete():
+            snr = acc.snr()
+            self.log(
+                f"Accumulated {acc.count} frames in {time.time() - acc.started:.1f} s, "
+                f"median SNR {np.median(snr):.1f}, max SNR {np.max(snr):.1f}"
+            )
+        if not display:
+            return None
+        limit = f"/{acc.target_frames}" if acc.target_frames else ""
+        self.accum_label.setText(f"Accum: {acc.count}{limit}")
+        return acc.mean.copy()
+
+    def update_accumulation_band(self, x):
+        show = self.accumulate_enabled and self.cb_accum_band.isChecked() and self.accumulator.count > 1
+        if show:
+            sem = self.accumulator.sem()
+            self.plot_curve_upper.setData(x, self.accumulator.mean + sem)
+            self.plot_curve_lower.setData(x, self.accumulator.mean - sem)
+        self.set_accumulation_band_visible(show)
+
+    def set_accumulation_band_visible(self, visible):
+        for item in (self.plot_curve_upper, self.plot_curve_lower, self.plot_band):
+            item.setVisible(visible)
+
+    def set_latency_enabled(self, state):
+        self.latency.enabled = state == QtCore.Qt.Checked
+        if not self.latency.enabled:
+            self.latency_label.setText("Latency: off")
+
+    def on_log_settings_changed(self, *args):
+        level = self.combo_log_level.currentData()
+        self.log_ring.setLevel(level)
+        if self.log_file is not None:
+            self.log_file.setLevel(level)
+        lines = self.spin_log_lines.value()
+        if lines != self.log_ring.capacity:
+            self.log_ring.set_capacity(lines)
+            self.log_widget.setMaximumBlockCount(lines)
+
+    def toggle_log_file(self, checked):
+        if not checked:
+            if self.log_file is not None:
+                self.log(f"Stopped logging to {self.log_file.baseFilename}")
+                applog.set_file_sink(self.logger, None)
+                self.log_file = None
+            return
+        file_name, _ = QtWidgets.QFileDialog.getSaveFileName(
+            self, 'Log File', time.strftime("raman_%Y%m%d.log"), 'Log files (*.log);;All files (*)'
+        )
+        if not file_name:
+            self.cb_log_file.setChecked(False)
+            return
+        try:
+            self.log_file = applog.set_file_sink(
+                self.logger, file_name,
+                max_bytes=int(self.spin_log_file_mb.value() * 1024 * 1024),
+                backup_count=self.spin_log_file_backups.value(),
+                level=self.combo_log_level.currentData(),
+            )
+            self.log(f"Logging to {file_name}")
+        except Exception as e:
+            self.log_file = None
+            self.cb_log_file.setChecked(False)
+            self.log(f"Failed to open log file: {e}", applog.ERROR)
+
+    def reset_latency_stats(self):
+        self.latency.reset()
+        self.update_latency_panel()
+        self.log("Latency statistics reset")
+
+    def dump_latency_stats(self):
+        file_name, _ = QtWidgets.QFileDialog.getSaveFileName(
+            self, 'Save Latency Stats', time.strftime("latency_%Y%m%d_%H%M%S.csv"),
+            'CSV files (*.csv);;JSON files (*.json)'
+        )
+        if not file_name:
+            return
+        try:
+            self.latency.dump(file_name)
+            self.log(f"Latency statistics saved to {file_name}")
+        except Exception as e:
+            self.log(f"Failed to save latency statistics: {e}", applog.ERROR)
+
+    def update_latency_panel(self):
+        if not self.latency.enabled:
+            return
+        summary = self.latency.summary()
+        read = summary['header_wait']['p50_ms'] + summary['payload_read']['p50_ms'] + summary['decode']['p50_ms']
+        draw = summary['update_plot']
+        if not draw['count']:
+            self.latency_label.setText("Latency: -")
+        else:
+            self.latency_label.setText(
+                f"Read p50 {read:.1f} ms / Plot p50 {draw['p50_ms']:.1f} p99 {draw['p99_ms']:.1f} ms"
+            )
+        rows = [f"{'stage':<15}{'n':>8}{'p50':>9}{'p95':>9}{'p99':>9}  (ms)"]
+        for name, r in summary.items():
+            rows.append(f"{name:<15}{r['count']:>8}{r['p50_ms']:>9.2f}{r['p95_ms']:>9.2f}{r['p99_ms']:>9.2f}")
+        self.latency_label.setToolTip("<pre>" + "\n".join(rows) + "</pre>")
+
+    def set_verify_crc(self, state):
+        self.frame_reader.verify_crc = state == QtCore.Qt.Checked
+        self.frame_reader.crc_auto_disabled = False
+        self.log(f"Frame checksum verification {'ON' if self.frame_reader.verify_crc else 'OFF'}")
+
     def set_smoothing_level(self, level):
         if not self.serial_port.is_open:
             self.log("Cannot set smoothing: port not open")
@@ -703,6 +1365,8 @@ class SpectrometerApp(QtWidgets.QMainWindow):
             if self.current_db_path:
                 self.lbl_current_db.setText(f"DB: {os.path.basename(self.current_db_path)}")
                 self.lbl_current_db.setStyleSheet("color: green;")
+            elif self.database_loading():
+                self.lbl_current_db.setText("Loading database...")
             else:
                 self.lbl_current_db.setText("No database loaded")
                 self.lbl_current_db.setStyleSheet("color: gray; font-style: italic;")
@@ -723,6 +1387,7 @@ class SpectrometerApp(QtWidgets.QMainWindow):
         self.exc_wlen_spin = QtWidgets.QSpinBox(self)
         self.exc_wlen_spin.setRange(0, 1000)
         self.exc_wlen_spin.setValue(785)  # restored old default
+        self.exc_wlen_spin.valueChanged.connect(self.invalidate_axis_cache)
         self.exc_wlen_spin.setSingleStep(1)
         wlen_layout.addWidget(self.exc_wlen_spin)
 
@@ -761,13 +1426,21 @@ class SpectrometerApp(QtWidgets.QMainWindow):
         self.spin_savgol_poly.setRange(1, 5)
         self.spin_savgol_poly.setValue(3)
         savgol_layout.addWidget(self.spin_savgol_poly)
+        savgol_layout.addWidget(QtWidgets.QLabel("Output:"))
+        self.combo_savgol_deriv = QtWidgets.QComboBox()
+        self.combo_savgol_deriv.addItems(["Smoothed", "1st derivative", "2nd derivative"])
+        savgol_layout.addWidget(self.combo_savgol_deriv)
         savgol_group.setLayout(savgol_layout)
         process_layout.addWidget(savgol_group)
 
-        baseline_group = QtWidgets.QGroupBox("ASLS Baseline Correction")
+        baseline_group = QtWidgets.QGroupBox("Baseline Correction")
         baseline_layout = QtWidgets.QHBoxLayout()
         self.checkbox_asls = QtWidgets.QCheckBox("Enable")
         baseline_layout.addWidget(self.checkbox_asls)
+        self.combo_baseline_method = QtWidgets.QComboBox()
+        self.combo_baseline_method.addItem("ASLS", 'asls')
+        self.combo_baseline_method.addItem("arPLS", 'arpls')
+        baseline_layout.addWidget(self.combo_baseline_method)
         baseline_group.setLayout(baseline_layout)
         process_layout.addWidget(baseline_group)
 
@@ -802,6 +1475,18 @@ class SpectrometerApp(QtWidgets.QMainWindow):
         peaks_group.setLayout(peaks_layout)
         process_layout.addWidget(peaks_group)
 
+        live_group = QtWidgets.QGroupBox("Live Processing")
+        live_layout = QtWidgets.QHBoxLayout()
+        self.checkbox_live = QtWidgets.QCheckBox("Process every acquired frame")
+        self.checkbox_live.setToolTip(
+            "Applies crop, SavGol, baseline correction, normalization and peak finding to each frame\n"
+            "as it arrives (database search still runs only from Apply)"
+        )
+        self.checkbox_live.stateChanged.connect(self.on_live_processing_changed)
+        live_layout.addWidget(self.checkbox_live)
+        live_group.setLayout(live_layout)
+        process_layout.addWidget(live_group)
+
         self.btn_download_procspectrum = QtWidgets.QPushButton("Download Processing Results")
         self.btn_download_procspectrum.clicked.connect(self.download_processing_results)
         self.btn_download_procspectrum.setEnabled(False)
@@ -905,6 +1590,22 @@ class SpectrometerApp(QtWidgets.QMainWindow):
         download_layout.addWidget(self.btn_download)
         process_layout.addLayout(download_layout)
 
+        self.checkbox_auto_apply = QtWidgets.QCheckBox("Auto-apply while editing")
+        self.checkbox_auto_apply.setToolTip(
+            "Reprocesses the current spectrum in the background as settings change;\n"
+            "the database search runs once they have not changed for a second"
+        )
+        self.checkbox_auto_apply.stateChanged.connect(self.on_processing_setting_changed)
+        process_layout.addWidget(self.checkbox_auto_apply)
+        for widget in (self.spin_crop_min, self.spin_crop_max, self.spin_savgol_window, self.spin_savgol_poly,
+                       self.spin_peaks_prominence, self.spin_peaks_width):
+            widget.valueChanged.connect(self.on_processing_setting_changed)
+        for widget in (self.checkbox_crop, self.checkbox_savgol, self.checkbox_asls, self.checkbox_norm,
+                       self.checkbox_peaks):
+            widget.stateChanged.connect(self.on_processing_setting_changed)
+        for widget in (self.combo_savgol_deriv, self.combo_baseline_method, self.combo_norm_type):
+            widget.currentIndexChanged.connect(self.on_processing_setting_changed)
+
         btn_layout = QtWidgets.QHBoxLayout()
         self.btn_apply = QtWidgets.QPushButton("Apply")
         self.btn_apply.clicked.connect(self.apply_processing)
@@ -953,7 +1654,7 @@ class SpectrometerApp(QtWidgets.QMainWindow):
         self.plot_db_spectrum()
         self.current_spectrum_1 = self.rspec.spectral_data
         self.original_spectrum = self.current_spectrum_1
-        self.spectral_axis = self.rspec.spectral_axis
+        self.spectral_axis = self.original_axis = self.rspec.spectral_axis
         self.processed_spectrum = None
         self.peaks = None
         self.plot_curve_ref.setVisible(False)
@@ -977,12 +1678,22 @@ class SpectrometerApp(QtWidgets.QMainWindow):
         ports = serial.tools.list_ports.comports()
         for port in ports:
             self.combo_ports.addItem(port.device)
+        self.combo_ports.addItem(VIRTUAL_PORT_PREFIX + "spectrometer")
 
     def connect_serial(self):
         if self.serial_port.is_open:
             return
         port = self.combo_ports.currentText()
         baudrate = int(self.combo_baudrate.currentText())
+        if is_virtual_port(port) != isinstance(self.serial_port, VirtualSpectrometer):
+            timeout = self.serial_port.timeout
+            self.serial_port = VirtualSpectrometer() if is_virtual_port(port) else serial.Serial()
+            self.serial_port.timeout = timeout
+            self.commands.port = self.serial_port
+        self.commands.reset()
+        # A checksum check switched off on the last connection is probed again
+        self.frame_reader.reset()
+        self.cb_verify_crc.setChecked(self.frame_reader.verify_crc)
         try:
             self.serial_port.port = port
             self.serial_port.baudrate = baudrate
@@ -1008,6 +1719,7 @@ class SpectrometerApp(QtWidgets.QMainWindow):
     def close_serial(self):
         if self.serial_port.is_open:
             self.pause_acquisition()
+            self.btn_record.setChecked(False)
             self.serial_port.close()
             self.status_bar.showMessage("Port closed", 2000)
 
@@ -1026,9 +1738,7 @@ class SpectrometerApp(QtWidgets.QMainWindow):
         if self.peaks is not None or self.processed_spectrum is not None:
             self.processed_spectrum = None
             self.peaks = None
-            for item in self.plot_widget.items():
-                if isinstance(item, pg.InfiniteLine):
-                    self.plot_widget.removeItem(item)
+            self.hide_peak_markers()
             self.plot_widget.setYRange(0, 65535)
             self.plot_widget.setXRange(self.wavelength_min, self.wavelength_max)
             self.processed_spectrum = None
@@ -1037,32 +1747,46 @@ class SpectrometerApp(QtWidgets.QMainWindow):
         if not self.serial_port.is_open:
             QtWidgets.QMessageBox.warning(self, "Error", "Serial port not open!")
             return
+        if self.continuous_mode:
+            self.log("Pause continuous acquisition before single acquire")
+            return
 
         self.progress_bar.setRange(0, 0)
         self.progress_bar.show()
-        QtWidgets.QApplication.processEvents()
+        self.process_events_timed()
         self.send_command(0x01)
         data_1 = self.read_spectral_data().astype(np.float64)
 
         time.sleep(0.15)
-        QtWidgets.QApplication.processEvents()
+        self.process_events_timed()
         self.progress_bar.hide()
 
+        t0 = time.perf_counter()
         if len(data_1) != 2048:
             data_1 = np.zeros(2048)
         if self.background_spectrum is not None:
-            data_1 = data_1 - self.background_spectrum
+            data_1 -= self.background_spectrum
+        data_1 = self.remove_spikes(data_1, temporal=False, log=self.log)
+        t1 = time.perf_counter()
+        self.latency.record('background', t1 - t0)
 
-        self.current_spectrum_1 = data_1.copy()
-        self.original_spectrum = data_1.copy()
+        self.current_spectrum_1 = data_1
+        self.original_spectrum = data_1
         self.spectral_axis = self.get_current_axis()
+        t2 = time.perf_counter()
+        self.latency.record('axis', t2 - t1)
+        self.set_accumulation_band_visible(False)
         self.update_plot(self.spectral_axis, data_1)
+        self.latency.record('update_plot', time.perf_counter() - t2)
         self.update_fps()
         self.collection_count += 1
         self.collection_label.setText(f"Acquisitions: {self.collection_count}")
         self.on_zoom_checkbox_changed()
 
-    def continuous_acquisition(self):
+    def start_trigger_capture(self):
+        self.continuous_acquisition(trigger_mode=self.combo_trigger_mode.currentData())
+
+    def continuous_acquisition(self, trigger_mode=0):
         self.rspec = None
         self.cur_spectrum_is_db = False
         self.plot_curve_ref.clear()
@@ -1075,9 +1799,7 @@ class SpectrometerApp(QtWidgets.QMainWindow):
         self.btn_download.setEnabled(False)
         self.btn_download_procspectrum.setEnabled(False)
         if self.peaks is not None or self.processed_spectrum is not None:
-            for item in self.plot_widget.items():
-                if isinstance(item, pg.InfiniteLine):
-                    self.plot_widget.removeItem(item)
+            self.hide_peak_markers()
             self.plot_widget.setYRange(0, 65535)
             self.plot_widget.setXRange(self.wavelength_min, self.wavelength_max)
             self.processed_spectrum = None
@@ -1085,67 +1807,234 @@ class SpectrometerApp(QtWidgets.QMainWindow):
             self.plot_widget.setTitle("Raw Spectrum")
         if not self.serial_port.is_open:
             return
+        if self.acq_worker is not None and self.acq_worker.isRunning():
+            return
         self.continuous_mode = True
+        if trigger_mode:
+            # Arm: external trigger mode, then start; the detector exposes on
+            # each trigger edge and frames are drained with no per-frame command
+            self.send_command(0x06)
+            self.flush_input()
+            self.set_trigger_mode(trigger_mode)
+            self.trigger_capture = trigger_mode
         self.send_command(0x02)
         self.collection_count = 0
         self.frame_counter = 0
-        while self.continuous_mode:
-            self.single_acquisition_logic()
-            QtWidgets.QApplication.processEvents()
-
-    def single_acquisition_logic(self):
+        self.frame_ring.clear()
+        self.accumulator.reset()
+        self.spike_filter.reset()
+        self.acq_worker = AcquisitionWorker(
+            self.serial_port, self.frame_ring,
+            verify_crc=self.frame_reader.verify_crc, parent=self
+        )
+        self.acq_worker.reader.latency = self.latency
+        if trigger_mode:
+            period_ms = self.spin_trigger_period.value()
+            self.acq_worker.triggered = True
+            self.acq_worker.gaps = GapDetector(period=period_ms / 1000.0 if period_ms > 0 else None)
+            self.log(
+                f"Armed external trigger mode {trigger_mode}, "
+                f"expected period {f'{period_ms:g} ms' if period_ms > 0 else 'auto'}"
+            )
+        self.acq_worker.recorder = self.recorder
+        self.acq_worker.record_params = self.current_record_params()
+        self.acq_worker.frame_ready.connect(self.schedule_redraw)
+        self.acq_worker.message.connect(lambda message: self.log(message, applog.WARNING))
+        self.acq_worker.finished.connect(self.progress_bar.hide)
         self.progress_bar.setRange(0, 0)
         self.progress_bar.show()
-        QtWidgets.QApplication.processEvents()
-        data_1 = self.read_spectral_data()
+        self.acq_worker.start()
+
+    def schedule_redraw(self):
+        if self.redraw_timer.isActive():
+            return
+        wait = self.last_redraw + 1.0 / self.plot_refresh_hz - time.time()
+        self.redraw_timer.start(max(0, int(wait * 1000)))
+
+    def on_worker_frame_ready(self):
+        frames = self.frame_ring.pop_all()
+        if not frames:
+            return
+        self.last_redraw = time.time()
+        self.latency.record('dispatch', self.last_redraw - frames[-1].timestamp)
+        # Only the newest frame is drawn; older queued frames still count as acquired
+        self.collection_count += len(frames) - 1
+        self.frame_counter += len(frames) - 1
+        self.update_fps(len(frames) - 1)
+        if self.accumulate_enabled:
+            for frame in frames[:-1]:
+                self.accumulate_frame(self.correct_frame(frame.data), display=False)
+        self.single_acquisition_logic(frames[-1].data)
+        self.update_worker_stats()
+
+    def current_record_params(self):
+        return (
+            self.spin_integration_time.value(),
+            self.spin_gain.value(),
+            self.spin_offset.value(),
+            self.average_count,
+            self.spin_laser_voltage.value(),
+        )
+
+    def refresh_record_params(self):
+        if self.acq_worker is not None:
+            self.acq_worker.record_params = self.current_record_params()
+
+    def toggle_recording(self, checked):
+        if checked:
+            file_name, _ = QtWidgets.QFileDialog.getSaveFileName(
+                self, 'Record Raw Frames', time.strftime("frames_%Y%m%d_%H%M%S.rec"),
+                'Frame recordings (*.rec)'
+            )
+            if not file_name:
+                self.btn_record.setChecked(False)
+                return
+            try:
+                self.recorder = FrameRecorder(file_name)
+            except Exception as e:
+                self.log(f"Failed to start recording: {e}", applog.ERROR)
+                self.btn_record.setChecked(False)
+                return
+            if self.acq_worker is not None:
+                self.acq_worker.record_params = self.current_record_params()
+                self.acq_worker.recorder = self.recorder
+            self.btn_record.setStyleSheet("background-color: #cc0000; color: white;")
+            self.log(f"Recording raw frames to {file_name}")
+        else:
+            recorder = self.recorder
+            self.recorder = None
+            if self.acq_worker is not None:
+                self.acq_worker.recorder = None
+            self.btn_record.setStyleSheet("")
+            if recorder is not None:
+                recorder.close()
+                self.log(f"Recording stopped: {recorder.n_frames} frames in {recorder.path}")
+
+    def update_worker_stats(self):
+        if self.acq_worker is None:
+            return
+        reader = self.acq_worker.reader
+        gaps = self.acq_worker.gaps
+        self.dropped_label.setText(
+            f"Dropped: {self.acq_worker.stats.dropped} / Overwritten: {self.frame_ring.overwritten} / "
+            f"Corrupt: {reader.corrupt_frames} / Resyncs: {reader.resyncs}"
+            + (f" / Spikes: {self.spike_filter.spikes}" if self.spike_filter_enabled else "")
+            + (f" / Gaps: {gaps.gaps} ({gaps.missed} missed)" if gaps is not None else "")
+        )
+
+    def stop_acquisition_worker(self):
+        if self.acq_worker is None:
+            return
+        self.acq_worker.stop()
+        self.acq_worker.wait()
+        self.redraw_timer.stop()
+        self.on_worker_frame_ready()
+        self.update_worker_stats()
+        stats = self.acq_worker.stats
+        reader = self.acq_worker.reader
+        self.log(
+            f"Continuous acquisition stopped: {stats.frames_read} frames "
+            f"({stats.rate():.1f} fps), dropped {stats.dropped}, "
+            f"overwritten {self.frame_ring.overwritten}, corrupt {reader.corrupt_frames}, "
+            f"resyncs {reader.resyncs} ({reader.bytes_discarded} bytes discarded)"
+        )
+        gaps = self.acq_worker.gaps
+        if gaps is not None:
+            g = gaps.summary()
+            self.log(
+                f"Trigger capture: period {g['period_ms']:.3f} ms, jitter {g['jitter_ms']:.3f} ms, "
+                f"{g['gaps']} gaps, {g['missed']} frames missed, {g['late']} late deliveries, longest interval {g['max_interval_ms']:.1f} ms"
+            )
+        if not reader.verify_crc:
+            self.cb_verify_crc.setChecked(False)
+            self.frame_reader.crc_auto_disabled = reader.crc_auto_disabled
+        self.acq_worker = None
+
+    def correct_frame(self, data_1):
+        # data_1 is a pooled view from the frame reader; the float conversion
+        # below is the only per-frame allocation and is shared by both slots
+        t0 = time.perf_counter()
+        data_1 = data_1.astype(np.float64)
         if len(data_1) != 2048:
             data_1 = np.zeros(2048)
         if self.background_spectrum is not None:
-            data_1 = np.maximum(data_1 - self.background_spectrum, 0)
-        self.current_spectrum_1 = data_1.copy()
-        self.original_spectrum = data_1.copy()
+            np.subtract(data_1, self.background_spectrum, out=data_1)
+            np.maximum(data_1, 0, out=data_1)
+        self.latency.record('background', time.perf_counter() - t0)
+        return self.remove_spikes(data_1)
+
+    def single_acquisition_logic(self, data_1):
+        data_1 = self.correct_frame(data_1)
+        if self.accumulate_enabled:
+            data_1 = self.accumulate_frame(data_1)
+        self.current_spectrum_1 = data_1
+        self.original_spectrum = data_1
+        t0 = time.perf_counter()
         self.spectral_axis = self.get_current_axis()
-        self.update_plot(self.spectral_axis, data_1)
+        t1 = time.perf_counter()
+        self.latency.record('axis', t1 - t0)
+        live = False
+        if self.checkbox_live.isChecked():
+            live = self.live_process(data_1, self.spectral_axis)
+            t2 = time.perf_counter()
+            self.latency.record('live_processing', t2 - t1)
+            t1 = t2
+        if live:
+            y = self.processed_spectrum
+            self.update_plot(self.spectral_axis, y * 100 if y.max() <= 1 else y, zoom=True)
+            self.set_accumulation_band_visible(False)
+        else:
+            self.update_plot(self.spectral_axis, data_1)
+            self.update_accumulation_band(self.spectral_axis)
+        self.latency.record('update_plot', time.perf_counter() - t1)
         self.update_fps()
         self.collection_count += 1
         self.collection_label.setText(f"Acquisitions: {self.collection_count}")
         self.frame_counter += 1
-        self.on_zoom_checkbox_changed()
-        self.progress_bar.hide()
 
     def pause_acquisition(self):
         self.continuous_mode = False
+        self.stop_acquisition_worker()
+        if not self.serial_port.is_open:
+            return
         self.send_command(0x06)
+        if self.trigger_capture:
+            self.trigger_capture = 0
+            self.set_trigger_mode(0)
+            self.log("External trigger disarmed, back to software trigger")
+
+    def pause_for_requests(self):
+        # Request/reply commands need the port to themselves: stops the
+        # acquisition worker and returns the trigger mode to restart it
+        # with, or None if it was not running
+        if not self.continuous_mode:
+            return None
+        mode = self.trigger_capture
+        self.pause_acquisition()
+        self.flush_input()
+        return mode
+
+    def resume_after_requests(self, mode):
+        if mode is not None:
+            self.continuous_acquisition(trigger_mode=mode)
 
     def send_command(self, cmd_byte):
-        cmd = bytearray([0x81, cmd_byte, 0x00, 0x00])
-        crc = sum(cmd) & 0xFF
-        cmd.append(crc)
-        self.serial_port.write(cmd)
+        self.commands.send(cmd_byte)
+
+    def flush_input(self):
+        self.serial_port.reset_input_buffer()
+        self.frame_reader.reset(recheck_crc=False)
+        self.commands.reset()
 
     def read_reply(self, expected_cmd, timeout=1):
-        start = time.time()
-        buf = bytearray()
-        while time.time() - start < timeout:
-            if self.serial_port.in_waiting:
-                buf += self.serial_port.read(self.serial_port.in_waiting)
-                if len(buf) >= 5:
-                    pkt = buf[:5]
-                    if pkt[0] == 0x81 and pkt[1] == expected_cmd:
-                        crc = (pkt[0] + pkt[1] + pkt[2] + pkt[3]) & 0xFF
-                        if crc == pkt[4]:
-                            return pkt
-                    buf = buf[1:]
-            time.sleep(0.001)
-        return None
+        return self.commands.wait(expected_cmd, timeout=timeout)
 
     def get_integration_time(self):
-        time.sleep(0.3)
-        self.serial_port.reset_input_buffer()
-        cmd = bytearray([0x81, 0x0A, 0x00, 0x00])
-        cmd.append(sum(cmd) & 0xFF)
-        self.serial_port.write(cmd)
-        reply = self.read_reply(0x02)
+        self.flush_input()
+        reply = self.commands.request(0x0A)
+        return self.log_integration_time(reply)
+
+    def log_integration_time(self, reply):
         if reply is None:
             self.log("GET integration time: no response")
             return None
@@ -1154,12 +2043,11 @@ class SpectrometerApp(QtWidgets.QMainWindow):
         return time_val
 
     def get_integration_unit(self):
-        time.sleep(0.3)
-        self.serial_port.reset_input_buffer()
-        cmd = bytearray([0x81, 0x12, 0x00, 0x00])
-        cmd.append(sum(cmd) & 0xFF)
-        self.serial_port.write(cmd)
-        reply = self.read_reply(0x12)
+        self.flush_input()
+        reply = self.commands.request(0x12)
+        return self.log_integration_unit(reply)
+
+    def log_integration_unit(self, reply):
         if reply is None:
             self.log("GET integration unit: no response")
             return None
@@ -1168,6 +2056,49 @@ class SpectrometerApp(QtWidgets.QMainWindow):
         self.log(f"Device integration unit = {unit_str}")
         return unit
 
+    def probe_frame(self, time_ms):
+        # Raw frame at a trial integration time, without the readback and
+        # flash save of set_integration_time
+        timeout = self.serial_port.timeout
+        self.serial_port.timeout = max(timeout or 0, time_ms / 1000.0 + 2.0)
+        try:
+            self.commands.send(0x03, (time_ms >> 8) & 0xFF, time_ms & 0xFF)
+            self.send_command(0x01)
+            data = self.read_spectral_data()
+        finally:
+            self.serial_port.timeout = timeout
+        self.process_events_timed()
+        if len(data) != 2048 or not np.any(data):
+            return None
+        return data
+
+    def auto_exposure(self, start_time=None, log=None):
+        log = log or self.log
+        if not self.serial_port.is_open:
+            log("Auto exposure: port not open")
+            return None
+        if self.continuous_mode:
+            self.pause_acquisition()
+        engine = AutoExposure(
+            saturation=self.scan_sat_thresh_spin.value(),
+            target_fill=self.spin_autoexp_fill.value() / 100.0,
+            max_time=self.spin_autoexp_max_time.value(),
+            max_probes=self.spin_autoexp_probes.value(),
+        )
+        if start_time is None:
+            start_time = min(self.spin_autoexp_start.value(), self.spin_integration_time.value())
+        self.flush_input()
+        result = engine.run(self.probe_frame, start_time)
+        for t, peak, saturated in result.probes:
+            log(f"  probe {t} ms: peak {peak:.0f}{' (saturated)' if saturated else ''}")
+        log(
+            f"Auto exposure {'converged' if result.converged else 'stopped'} after "
+            f"{len(result.probes)} probes: {result.integration_time} ms"
+        )
+        self.spin_integration_time.setValue(result.integration_time)
+        self.set_integration_time()
+        return result.integration_time
+
     def set_trigger_mode(self, mode):
         self.send_command_with_data(0x07, mode, 0x00)
         self.log(f"Trigger mode set to {mode} (0: soft, 1: external continuous, 2: external monopulse)")
@@ -1175,27 +2106,32 @@ class SpectrometerApp(QtWidgets.QMainWindow):
     def set_integration_time(self):
         if not self.serial_port.is_open:
             return
+        if self.continuous_mode:
+            self.pause_acquisition()
         self.send_command(0x06)
         self.log("Acquisition STOP sent")
-        time.sleep(0.3)
-        self.serial_port.reset_input_buffer()
-        current_unit = self.get_integration_unit()
+        self.flush_input()
+        time_ms = self.spin_integration_time.value()
+        hi = (time_ms >> 8) & 0xFF
+        lo = time_ms & 0xFF
+        # Whole set/readback sequence in one write; replies are matched as they arrive
+        unit_before, _, unit_after, _, reply = self.commands.pipeline([
+            (0x12, 0x00, 0x00, 0x12),
+            (0x11, 0x00, 0x00, None),
+            (0x12, 0x00, 0x00, 0x12),
+            (0x03, hi, lo, None),
+            (0x0A, 0x00, 0x00, 0x02),
+        ])
+        current_unit = self.log_integration_unit(unit_before)
         if current_unit is not None:
             self.log(f"Current integration unit before set: {'ms' if current_unit == 0x00 else 'µs'}")
-        self.send_command_with_data(0x11, 0x00, 0x00)
-        time.sleep(0.05)
-        new_unit = self.get_integration_unit()
+        new_unit = self.log_integration_unit(unit_after)
         if new_unit is not None:
             self.log(f"CONFIRMED integration unit after set: {'ms' if new_unit == 0x00 else 'µs'}")
         else:
             self.log("Unit readback unavailable")
-        time_ms = self.spin_integration_time.value()
-        hi = (time_ms >> 8) & 0xFF
-        lo = time_ms & 0xFF
-        self.send_command_with_data(0x03, hi, lo)
         self.log(f"Integration time SET request = {time_ms} ms")
-        time.sleep(0.05)
-        val = self.get_integration_time()
+        val = self.log_integration_time(reply)
         if val is not None:
             self.log(f"CONFIRMED by device: {val} ms")
         else:
@@ -1205,40 +2141,46 @@ class SpectrometerApp(QtWidgets.QMainWindow):
         self.serial_port.timeout = (time_ms / 1000.0) + 10.0
         self.log(f"Serial timeout updated to {self.serial_port.timeout} seconds")
         self.save_parameters()
+        self.select_library_dark()
 
     def save_parameters(self):
         self.send_command_with_data(0x22, 0x00, 0x00)
         self.log("Parameters saved to device")
 
     def send_command_with_data(self, cmd, d1, d2):
-        cmd = bytearray([0x81, cmd, d1, d2])
-        crc = sum(cmd) & 0xFF
-        cmd.append(crc)
-        self.serial_port.write(cmd)
-        self.log(f"Sent command {cmd}")
+        cmd = self.commands.send(cmd, d1, d2)
+        if self.log_enabled(applog.DEBUG):
+            self.log(f"Sent command {cmd}", applog.DEBUG)
 
     def set_average_count(self, value):
         self.average_count = value
         self.set_hardware_average(value)
+        self.refresh_record_params()
+        self.select_library_dark()
 
     def read_spectral_data(self):
         if not self.serial_port.is_open:
             return np.zeros(2048)
-        head = self.serial_port.read(5)
-        if len(head) != 5 or head[0] != 0x81 or head[1] != 0x01 or head[4] != 0x00:
-            self.log(f"Invalid head: {head}")
-            return np.zeros(2048)
-        length = (head[2] << 8) | head[3]
-        self.log(f"Data length from head: {length}")
-        data = self.serial_port.read(length + 2)
-        if len(data) != length + 2:
-            self.log(f"Incomplete data: expected {length + 2}, got {len(data)}")
+        reader = self.frame_reader
+        corrupt, discarded = reader.corrupt_frames, reader.bytes_discarded
+        crc_auto_disabled = reader.crc_auto_disabled
+        data, error = reader.read(self.serial_port)
+        if reader.corrupt_frames != corrupt or reader.bytes_discarded != discarded:
+            self.log(
+                f"Resynced frame stream: {reader.corrupt_frames - corrupt} corrupt frames, "
+                f"{reader.bytes_discarded - discarded} bytes discarded"
+            )
+        if reader.crc_auto_disabled and not crc_auto_disabled:
+            self.cb_verify_crc.setChecked(False)
+            reader.crc_auto_disabled = True
+            self.log(
+                "Frame checksum never matched on consecutive clean frames: "
+                "checksum verification is OFF until the next connection", applog.ERROR
+            )
+        if data is None:
+            self.log(error, applog.WARNING)
             return np.zeros(2048)
-        pixel_data = data[:-2]
-        crc_received = (data[-2] << 8) | data[-1]
-        data_1 = pixel_data[:min(4096, length)]
-        spectral_data_1 = np.frombuffer(data_1, dtype='>u2') if len(data_1) == 4096 else np.zeros(2048)
-        return spectral_data_1
+        return data
 
     def update_plot(self, x, y, zoom=False):
         self.plot_curve_1.setData(x, y)
@@ -1250,105 +2192,156 @@ class SpectrometerApp(QtWidgets.QMainWindow):
         else:
             self.plot_widget.setYRange(0, 65535)
 
-        if np.max(x) > 1500:
-            self.plot_widget.setLabel('bottom', 'Raman shift (cm<sup>-1</sup>)')
-        else:
-            self.plot_widget.setLabel('bottom', 'Wavelength (nm)')
+        label = 'Raman shift (cm<sup>-1</sup>)' if np.max(x) > 1500 else 'Wavelength (nm)'
+        if self.plot_widget.getAxis('bottom').labelText != label:
+            self.plot_widget.setLabel('bottom', label)
+
+        self.update_peak_markers(x, y)
+
+    def update_peak_markers(self, x, y):
+        n = len(self.peaks) if self.peaks is not None else 0
+        while len(self.peak_lines) < n:
+            line = pg.InfiniteLine(angle=90, pen=pg.mkPen('r', style=QtCore.Qt.DashLine))
+            text = pg.TextItem("", anchor=(0.5, 1.1), color='r')
+            self.plot_widget.addItem(line)
+            self.plot_widget.addItem(text)
+            self.peak_lines.append(line)
+            self.peak_labels.append(text)
+        for i in range(n):
+            peak = self.peaks[i]
+            pos = x[peak]
+            line = self.peak_lines[i]
+            text = self.peak_labels[i]
+            line.setPos(pos)
+            text.setText(str(int(pos)))
+            text.setPos(pos, y[peak])
+            line.setVisible(True)
+            text.setVisible(True)
+        self.hide_peak_markers(start=n)
+
+    def hide_peak_markers(self, start=0):
+        for line, text in zip(self.peak_lines[start:], self.peak_labels[start:]):
+            if line.isVisible():
+                line.setVisible(False)
+                text.setVisible(False)
+
+    def processing_params(self):
+        return {
+            'crop': (self.spin_crop_min.value(), self.spin_crop_max.value()) if self.checkbox_crop.isChecked() else None,
+            'savgol': self.savgol_params() if self.checkbox_savgol.isChecked() else None,
+            'baseline_method': self.combo_baseline_method.currentData() if self.checkbox_asls.isChecked() else None,
+            'normalize': self.combo_norm_type.currentText() if self.checkbox_norm.isChecked() else None,
+        }
 
-        for line in self.peak_lines:
-            self.plot_widget.removeItem(line)
-        for label in self.peak_labels:
-            self.plot_widget.removeItem(label)
-        self.peak_lines = []
-        self.peak_labels = []
+    def savgol_params(self):
+        params = (self.spin_savgol_window.value(), self.spin_savgol_poly.value())
+        deriv = self.combo_savgol_deriv.currentIndex()
+        return params + (deriv,) if deriv else params
 
-        if self.peaks is not None:
-            for peak in self.peaks:
-                pos = x[peak]
-                line = pg.InfiniteLine(pos=pos, angle=90, pen=pg.mkPen('r', style=QtCore.Qt.DashLine))
-                self.plot_widget.addItem(line)
-                self.peak_lines.append(line)
-                label_text = str(int(pos))
-                text = pg.TextItem(label_text, anchor=(0.5, 1.1), color='r')
-                text.setPos(pos, y[peak])
-                self.plot_widget.addItem(text)
-                self.peak_labels.append(text)
+    def live_processing_chain(self, axis):
+        params = self.processing_params()
+        chain = self.live_chain
+        if chain is None or chain.source_axis is not axis or chain.params != params:
+            try:
+                chain = self.live_chain = ProcessingChain(axis, warm_start=True, **params)
+            except ValueError as e:
+                self.live_chain = None
+                self.log(f"Live processing stopped: {e}", applog.ERROR)
+                self.checkbox_live.setChecked(False)
+                return None
+        return chain
+
+    def live_process(self, spectrum, axis):
+        # Runs the compiled chain on one frame; on success the processed
+        # spectrum, its axis and peaks replace the current ones, as after Apply
+        chain = self.live_processing_chain(axis)
+        if chain is None:
+            return False
+        self.processed_spectrum = chain.apply(spectrum)
+        self.processed_axis = chain.axis
+        self.current_spectrum_1 = self.processed_spectrum
+        self.spectral_axis = chain.axis
+        self.peaks = None
+        if self.checkbox_peaks.isChecked():
+            self.peaks, self.peakshifts = analysis.find_spectrum_peaks(
+                self.processed_spectrum, chain.axis, self.spin_peaks_prominence.value(), self.spin_peaks_width.value()
+            )
+        return True
+
+    def on_live_processing_changed(self, state):
+        live = state == QtCore.Qt.Checked
+        self.live_chain = None
+        if live:
+            # Compile (and pay scipy's import) now rather than on the first frame
+            chain = self.live_processing_chain(self.get_current_axis())
+            if chain is None:
+                return
+            chain.apply(np.zeros(len(chain.source_axis)))
+            self.plot_widget.setTitle("Live Processed Spectrum")
+            self.log("Live processing on")
+        else:
+            self.plot_widget.setTitle("")
+            self.peaks = None
+            self.hide_peak_markers()
+            self.log("Live processing off")
+        self.btn_download_peaks.setEnabled(live and self.checkbox_peaks.isChecked())
+        self.btn_download_procspectrum.setEnabled(live)
+
+    def processing_input(self):
+        # Unprocessed spectrum and its axis
+        spectrum = np.array(self.original_spectrum.copy())
+        if self.cur_spectrum_is_db is False:
+            return spectrum, self.get_current_axis()
+        return spectrum, self.original_axis if self.original_axis is not None else self.spectral_axis
 
     def apply_processing(self):
         if self.original_spectrum is None:
             return
-
-        spectrum = np.array(self.original_spectrum.copy())
-
-        if self.cur_spectrum_is_db is False:
-            specax = self.get_current_axis()
-            self.log(f'New spectral axis: {specax}')
-        else:
-            specax = self.spectral_axis
-
-        robj = rp.SpectralContainer(np.array([spectrum]), specax)
-        self.log(f'Robj specax: {robj.spectral_axis}')
-
-        proclist = []
-        if self.checkbox_crop.isChecked():
-            cropreg = (self.spin_crop_min.value(), self.spin_crop_max.value())
-            proclist.append(rp.preprocessing.misc.Cropper(region=cropreg))
-        if self.checkbox_savgol.isChecked():
-            window = self.spin_savgol_window.value()
-            poly = self.spin_savgol_poly.value()
-            proclist.append(rp.preprocessing.denoise.SavGol(window_length=window, polyorder=poly))
-        if self.checkbox_asls.isChecked():
-            proclist.append(rp.preprocessing.baseline.ASLS())
-        if self.checkbox_norm.isChecked():
-            norm_type = self.combo_norm_type.currentText()
-            if norm_type == "MinMax":
-                proclist.append(rp.preprocessing.normalise.MinMax())
-            elif norm_type == "Vector":
-                proclist.append(rp.preprocessing.normalise.Vector())
-
-        self.preprocessing_pipeline = rp.preprocessing.Pipeline(proclist)
-        self.preprocessed_robj = self.preprocessing_pipeline.apply(robj)
-        self.log(f'Preproc robj specax: {self.preprocessed_robj.spectral_axis}')
+        # An explicit Apply supersedes any pending preview
+        self.preview_generation += 1
+        self.preview_timer.stop()
+        self.settle_timer.stop()
+
+        spectrum, specax = self.processing_input()
+
+        self.preprocessing_params = self.processing_params()
+        # Same spectrum, axis and settings as before: reuse the results
+        proc_key = content_key('process', spectrum, specax, self.preprocessing_params)
+        robj = self.result_cache.get(proc_key)
+        if robj is None:
+            graph = self.processing_graph
+            graph.set_params('source', (specax, spectrum))
+            set_spectrum_params(graph, self.preprocessing_params)
+            try:
+                axis, data = graph.get('normalize')
+            except ValueError as e:
+                self.log(f"Processing failed: {e}", applog.ERROR)
+                return
+            self.log(f"Processing stages run: {', '.join(graph.last_run) or 'none'}", applog.DEBUG)
+            robj = self.result_cache.put(proc_key, analysis.Processed(axis, np.atleast_2d(data)))
 
         self.peaks = None
-        self.btn_download_peaks.setEnabled(False)
         if self.checkbox_peaks.isChecked():
-            prominence = self.spin_peaks_prominence.value()
-            width = int(self.spin_peaks_width.value())
-            peaks, props = find_peaks(
-                self.preprocessed_robj.spectral_data[0],
-                prominence=prominence,
-                width=width
-            )
-            self.peaks = peaks
-            self.peakshifts = self.preprocessed_robj.spectral_axis[peaks]
+            prominence, width = self.spin_peaks_prominence.value(), self.spin_peaks_width.value()
+            peaks_key = content_key('peaks', proc_key, prominence, width)
+            found = self.result_cache.get(peaks_key)
+            if found is None:
+                found = self.result_cache.put(peaks_key, analysis.spectrum_peaks(robj, prominence, width))
+            self.peaks, self.peakshifts = found
             self.log(f"Peaks found: {self.peaks}")
-            self.btn_download_peaks.setEnabled(True)
 
-        self.processed_spectrum = self.preprocessed_robj.spectral_data[0]
-        self.current_spectrum_1 = self.processed_spectrum
-        self.spectral_axis = self.preprocessed_robj.spectral_axis
-        self.log(f"Preprocessed axis {self.spectral_axis}")
-        self.log(f"Preprocessed spectrum {self.processed_spectrum}")
-        self.log(f"Spectral data {self.preprocessed_robj.spectral_data}")
-        self.log(f"{len(self.spectral_axis) == len(self.processed_spectrum)}")
-
-        if max(self.processed_spectrum) <= 1:
-            self.update_plot(self.spectral_axis, self.processed_spectrum * 100, zoom=True)
-        else:
-            self.update_plot(self.spectral_axis, self.processed_spectrum, zoom=True)
-        self.plot_widget.setTitle("Processed Spectrum")
+        if self.log_enabled(applog.DEBUG):
+            self.log(f"Input axis {specax}", applog.DEBUG)
+        self.show_processed(robj, "Processed Spectrum")
 
         if self.checkbox_search.isChecked():
             if self.specdict is None:
-                self.log("No database loaded - skipping search")
+                if self.database_loading():
+                    self.log("Database is still loading - skipping search")
+                else:
+                    self.log("No database loaded - skipping search")
                 return
 
-            progress = QtWidgets.QProgressDialog("Searching database...", "Cancel", 0, len(self.specdict), self)
-            progress.setWindowModality(QtCore.Qt.WindowModal)
-            progress.setMinimumDuration(0)
-            progress.show()
-
             if self.checkbox_sad.isChecked():
                 method = 'sad'
             elif self.checkbox_sid.isChecked():
@@ -1361,15 +2354,32 @@ class SpectrometerApp(QtWidgets.QMainWindow):
                 method = 'iur'
 
             topn = self.spin_topn.value()
-            self.log('Started search')
-            self.searchres = self.run_dbsearch_rbase(
-                robj=self.preprocessed_robj,
-                rbase_specdict=self.specdict,
-                nleads=topn,
-                metric=method,
-                progress=progress
-            )
-            self.log('Search results ready')
+            # Cached with the top-N it was run for; a smaller top-N is a slice
+            search_params = self.search_params()
+            if method != 'iur':
+                # Only IUR reads the peak settings; tuning them keeps other results
+                search_params = {k: search_params[k] for k in ('min_overlap', 'process_db')}
+            search_key = content_key('search', proc_key, method, search_params, self.db_generation)
+            cached = self.result_cache.get(search_key)
+            if cached is not None and topn <= cached[0]:
+                self.searchres = cached[1][:topn]
+                self.log('Search results from cache')
+            else:
+                progress = QtWidgets.QProgressDialog("Searching database...", "Cancel", 0, len(self.specdict), self)
+                progress.setWindowModality(QtCore.Qt.WindowModal)
+                progress.setMinimumDuration(0)
+                progress.show()
+                self.log('Started search')
+                self.searchres = self.run_dbsearch_rbase(
+                    robj=self.preprocessed_robj,
+                    rbase_specdict=self.specdict,
+                    nleads=topn,
+                    metric=method,
+                    progress=progress
+                )
+                self.log('Search results ready')
+                if not self.searchres.empty:
+                    self.result_cache.put(search_key, (topn, self.searchres))
             if self.searchres.empty:
                 self.log('Search canceled or no results')
             else:
@@ -1381,6 +2391,92 @@ class SpectrometerApp(QtWidgets.QMainWindow):
                 self.combo_reference.addItem(row['component'])
             self.btn_download.setEnabled(True)
 
+        self.update_result_cache_label()
+
+    def on_processing_setting_changed(self, *_):
+        if (not self.checkbox_auto_apply.isChecked() or self.original_spectrum is None
+                or self.checkbox_live.isChecked()):
+            return
+        self.preview_generation += 1
+        self.settle_timer.stop()
+        self.preview_timer.start()
+
+    def start_preview(self):
+        if self.original_spectrum is None:
+            return
+        if self.preview_worker is not None and self.preview_worker.isRunning():
+            # Its result will be stale; rerun with the newest settings then
+            self.preview_pending = True
+            return
+        spectrum, axis = self.processing_input()
+        params = self.processing_params()
+        peaks = None
+        if self.checkbox_peaks.isChecked():
+            peaks = (self.spin_peaks_prominence.value(), self.spin_peaks_width.value())
+        key = content_key('process', spectrum, axis, params)
+        robj = self.result_cache.get(key)
+        if robj is not None:
+            found = None
+            if peaks is not None:
+                peaks_key = content_key('peaks', key, *peaks)
+                found = self.result_cache.get(peaks_key)
+                if found is None:
+                    found = self.result_cache.put(peaks_key, analysis.spectrum_peaks(robj, *peaks))
+            self.on_preview_ready(self.preview_generation, key, robj, peaks, found, "")
+            return
+        self.preview_worker = PreviewWorker(self.preview_generation, key, spectrum, axis, params, peaks, self)
+        self.preview_worker.ready.connect(self.on_preview_ready)
+        self.preview_worker.start()
+
+    def on_preview_ready(self, generation, key, robj, peaks, found, error):
+        if robj is not None:
+            # Valid for their own settings even when stale, so keep them
+            if key not in self.result_cache:
+                self.result_cache.put(key, robj)
+            if found is not None:
+                peaks_key = content_key('peaks', key, *peaks)
+                if peaks_key not in self.result_cache:
+                    self.result_cache.put(peaks_key, found)
+        if self.preview_pending:
+            self.preview_pending = False
+            QtCore.QTimer.singleShot(0, self.start_preview)
+            return
+        if generation != self.preview_generation:
+            return
+        if error:
+            self.log(f"Preview not updated: {error}", applog.WARNING)
+            return
+        self.peaks = None
+        if found is not None:
+            self.peaks, self.peakshifts = found
+        self.show_processed(robj, "Processed Spectrum (preview)")
+        self.update_result_cache_label()
+        if self.checkbox_search.isChecked():
+            self.settle_timer.start()
+
+    def on_preview_settled(self):
+        # Settings unchanged since the last preview: full Apply, whose
+        # processing and peaks come from the cache, then the search
+        if self.checkbox_auto_apply.isChecked() and not self.checkbox_live.isChecked():
+            self.apply_processing()
+
+    def show_processed(self, robj, title):
+        # Makes robj (and self.peaks) the current processed result and plots it
+        self.preprocessed_robj = robj
+        self.processed_spectrum = robj.spectral_data[0]
+        self.processed_axis = robj.spectral_axis
+        self.current_spectrum_1 = self.processed_spectrum
+        self.spectral_axis = self.processed_axis
+        if self.log_enabled(applog.DEBUG):
+            self.log(f"Preprocessed axis {self.spectral_axis}", applog.DEBUG)
+            self.log(f"Preprocessed spectrum {self.processed_spectrum}", applog.DEBUG)
+
+        if max(self.processed_spectrum) <= 1:
+            self.update_plot(self.spectral_axis, self.processed_spectrum * 100, zoom=True)
+        else:
+            self.update_plot(self.spectral_axis, self.processed_spectrum, zoom=True)
+        self.plot_widget.setTitle(title)
+        self.btn_download_peaks.setEnabled(self.peaks is not None)
         self.btn_download_procspectrum.setEnabled(True)
         self.btn_revert.setEnabled(True)
 
@@ -1435,16 +2531,12 @@ class SpectrometerApp(QtWidgets.QMainWindow):
                 self.spectral_axis = self.get_current_axis()
                 self.update_plot(self.spectral_axis, self.current_spectrum_1)
                 self.plot_widget.setTitle("")
-                for line in self.peak_lines:
-                    self.plot_widget.removeItem(line)
-                for label in self.peak_labels:
-                    self.plot_widget.removeItem(label)
-                self.peak_lines = []
-                self.peak_labels = []
+                self.hide_peak_markers()
                 self.plot_widget.setYRange(0, 65535)
                 self.plot_widget.setXRange(np.min(self.spectral_axis), np.max(self.spectral_axis))
             else:
-                self.update_plot(self.rspec.spectral_axis, self.current_spectrum_1)
+                self.spectral_axis = self.original_axis
+                self.update_plot(self.spectral_axis, self.current_spectrum_1)
                 self.plot_widget.setTitle("DB Spectrum")
                 self.plot_widget.setLabel('bottom', 'Raman shift (cm<sup>-1</sup>)')
                 self.cur_spectrum_is_db = True
@@ -1463,20 +2555,20 @@ class SpectrometerApp(QtWidgets.QMainWindow):
             return
         file_name, _ = QtWidgets.QFileDialog.getSaveFileName(self, 'Save Peaks', '', 'CSV Files (*.csv)')
         if file_name:
+            import pandas as pd
             data = pd.DataFrame.from_dict({
                 'Raman Shifts': self.peakshifts,
-                'Intensities': self.preprocessed_robj.spectral_data[0][
-                    np.where(np.isin(self.preprocessed_robj.spectral_axis, self.peakshifts))
-                ]
+                'Intensities': self.processed_spectrum[self.peaks]
             })
             data.to_csv(file_name, index=False)
             return
 
     def download_processing_results(self):
         file_name, _ = QtWidgets.QFileDialog.getSaveFileName(self, 'Save Results', '', 'CSV Files (*.csv)')
+        import pandas as pd
         data = pd.DataFrame.from_dict({
-            'Raman Shifts': self.preprocessed_robj.spectral_axis,
-            'Intensities': self.preprocessed_robj.spectral_data[0]
+            'Raman Shifts': self.processed_axis,
+            'Intensities': self.processed_spectrum
         })
         data.to_csv(file_name, index=False)
         return
@@ -1505,8 +2597,8 @@ class SpectrometerApp(QtWidgets.QMainWindow):
                 header = 'x,Intensity'
                 np.savetxt(file_name, data, delimiter=',', header=header, comments='')
 
-    def update_fps(self):
-        self.frame_count += 1
+    def update_fps(self, frames=1):
+        self.frame_count += frames
         elapsed = time.time() - self.start_time
         if elapsed > 1:
             fps = self.frame_count / elapsed
@@ -1514,14 +2606,31 @@ class SpectrometerApp(QtWidgets.QMainWindow):
             self.frame_count = 0
             self.start_time = time.time()
 
+    def process_events_timed(self):
+        t0 = time.perf_counter()
+        QtWidgets.QApplication.processEvents()
+        self.latency.record('process_events', time.perf_counter() - t0)
+
     def on_zoom_checkbox_changed(self):
         if self.current_spectrum_1 is not None:
             x = self.spectral_axis if self.spectral_axis is not None else self.wavelengths
             self.update_plot(x, self.current_spectrum_1)
 
-    def log(self, message):
-        timestamp = time.strftime("%H:%M:%S")
-        self.log_widget.appendPlainText(f"[{timestamp}] {message}")
+    def log(self, message, level=applog.INFO):
+        self.logger.log(level, "%s", message)
+
+    def log_enabled(self, level):
+        # Guard for messages that are expensive to format (array dumps)
+        return self.log_ring.level <= level or (
+            self.log_file is not None and self.log_file.level <= level
+        )
+
+    def flush_log(self):
+        lines, dropped = self.log_ring.drain()
+        if dropped:
+            lines.insert(0, f"[{time.strftime('%H:%M:%S')}] ... {dropped} log lines skipped")
+        if lines:
+            self.log_widget.appendPlainText("\n".join(lines))
 
     def acquire_background(self):
         if not self.serial_port.is_open:
@@ -1535,128 +2644,156 @@ class SpectrometerApp(QtWidgets.QMainWindow):
             data = self.read_spectral_data().astype(np.float64)
 
             if len(data) == 2048:
-                self.background_spectrum = data.copy()
-                self.log("Background is acquired")
+                self.background_spectrum = data
+                self.background_key = self.current_dark_key()
+                self.store_dark(data)
+                self.log(f"Background is acquired ({self.format_dark_key(self.background_key)})")
             else:
-                self.log("Background acquisition failed")
+                self.log("Background acquisition failed", applog.ERROR)
         finally:
             self.progress_bar.hide()
 
     def clear_background(self):
         self.background_spectrum = None
+        self.background_key = None
         self.log("Background cleared")
 
+    def current_dark_key(self):
+        return dark_key(
+            self.spin_integration_time.value(), self.spin_gain.value(),
+            self.spin_offset.value(), self.average_count
+        )
+
+    @staticmethod
+    def format_dark_key(key):
+        if key is None:
+            return "unknown settings"
+        return f"{key[0]} ms, gain {key[1]}, offset {key[2]}, avg {key[3]}"
+
+    def load_dark_library(self):
+        path = self.dark_library.path
+        if os.path.exists(path):
+            try:
+                expired = self.dark_library.load()
+                self.log(
+                    f"Loaded {len(self.dark_library)} darks from {path}"
+                    + (f" ({expired} expired)" if expired else "")
+                )
+            except Exception as e:
+                self.log(f"Failed to load dark library: {e}", applog.ERROR)
+        self.update_dark_library_label()
+
+    def store_dark(self, data, n_frames=1):
+        self.dark_library.add(data, *self.current_dark_key(), n_frames=n_frames)
+        try:
+            self.dark_library.save()
+        except Exception as e:
+            self.log(f"Failed to save dark library: {e}", applog.ERROR)
+        self.update_dark_library_label()
+
+    def select_library_dark(self):
+        # Called after integration time, gain, offset or averaging change
+        if not self.cb_dark_library.isChecked():
+            return
+        key = self.current_dark_key()
+        if key == self.background_key:
+            return
+        match = self.dark_library.lookup(*key)
+        if match is None:
+            if self.background_spectrum is not None:
+                self.log(
+                    f"No stored dark for {self.format_dark_key(key)}; background is still the one "
+                    f"taken at {self.format_dark_key(self.background_key)}", applog.WARNING
+                )
+            return
+        self.background_spectrum = np.array(match.data)
+        self.background_key = key
+        sources = " and ".join(self.format_dark_key(k) for k in match.keys)
+        self.log(f"Background from dark library ({match.kind}: {sources})")
+
+    def on_dark_library_settings_changed(self, *args):
+        self.dark_library.max_age_s = self.spin_dark_max_age.value() * 60.0
+        self.update_dark_library_label()
+        self.select_library_dark()
+
+    def update_dark_library_label(self):
+        if hasattr(self, 'lbl_dark_library'):
+            fresh = sum(1 for e in self.dark_library.entries.values() if self.dark_library.is_fresh(e))
+            self.lbl_dark_library.setText(f"{fresh} darks stored ({len(self.dark_library) - fresh} expired)")
+
+    def clear_dark_library(self):
+        self.dark_library.clear()
+        try:
+            self.dark_library.save()
+        except Exception as e:
+            self.log(f"Failed to save dark library: {e}", applog.ERROR)
+        self.update_dark_library_label()
+        self.log("Dark library cleared")
+
+    def update_result_cache_label(self):
+        if hasattr(self, 'lbl_result_cache'):
+            stats = self.result_cache.summary()
+            self.lbl_result_cache.setText(
+                f"{stats['entries']} results, {stats['bytes'] / 1e6:.1f} MB; "
+                f"{stats['hits']} hits / {stats['misses']} misses ({stats['hit_rate']:.0%})"
+            )
+
+    def on_result_cache_size_changed(self, mb):
+        self.result_cache.resize(max_bytes=mb * 1024 * 1024)
+        self.update_result_cache_label()
+
+    def clear_result_cache(self):
+        self.result_cache.clear()
+        self.result_cache.reset_stats()
+        self.update_result_cache_label()
+        self.log("Result cache cleared")
+
     def clear_log(self):
         self.log_widget.clear()
 
+    def search_params(self):
+        return {
+            'min_overlap': self.spin_min_olap.value(),
+            'peak_prominence': self.spin_peaks_prominence.value(),
+            'peak_width': self.spin_peaks_width.value(),
+            'iur_prominence': self.spin_iur_prominence.value(),
+            'iur_width': self.spin_iur_width.value(),
+            'iur_tol': self.spin_iur_tol.value(),
+            'process_db': self.checkbox_process_db.isChecked(),
+        }
+
     def run_dbsearch_rbase(self, robj, rbase_specdict, nleads=10, metric='sad', progress=None):
-        results = []
-        ind = 0
-        sres = []
-        i = 0
-        total_items = len(rbase_specdict)
-        for rbid, d in rbase_specdict.items():
-            if progress is not None:
-                progress.setValue(i)
-                if progress.wasCanceled():
-                    self.log("Search canceled by user")
-                    return pd.DataFrame()
-            try:
-                rspec = d['spectrum']
-                name = d['name']
-                url = d['url']
-                ident = d['identifier']
-                if self.checkbox_process_db.isChecked():
-                    rspec = self.preprocessing_pipeline.apply(rspec)
-                olap = min(robj.spectral_axis.max(), rspec.spectral_axis.max()) - max(robj.spectral_axis.min(), rspec.spectral_axis.min())
-                if olap > self.spin_min_olap.value():
-                    common_axis = np.linspace(
-                        max(robj.spectral_axis.min(), rspec.spectral_axis.min()),
-                        min(robj.spectral_axis.max(), rspec.spectral_axis.max()),
-                        2000
-                    )
-                    if len(common_axis) == 0:
-                        i += 1
-                        continue
-                    query_data = robj.spectral_data[0] if robj.spectral_data.ndim > 1 else robj.spectral_data
-                    ref_data = rspec.spectral_data[0] if rspec.spectral_data.ndim > 1 else rspec.spectral_data
-                    interp1 = interp1d(robj.spectral_axis, query_data, kind='linear', fill_value='extrapolate')
-                    interp2 = interp1d(rspec.spectral_axis, ref_data, kind='linear', fill_value='extrapolate')
-                    aligned_intensity1 = interp1(common_axis)
-                    aligned_intensity2 = interp2(common_axis)
-                    if np.any(np.isnan(aligned_intensity1)) or np.any(np.isnan(aligned_intensity2)):
-                        i += 1
-                        continue
-                    if np.linalg.norm(aligned_intensity1) == 0 or np.linalg.norm(aligned_intensity2) == 0:
-                        i += 1
-                        continue
-                    if metric == 'mae':
-                        s = rp.metrics.MAE(aligned_intensity1, aligned_intensity2)
-                    elif metric == 'mse':
-                        s = rp.metrics.MSE(aligned_intensity1, aligned_intensity2)
-                    elif metric == 'sad':
-                        s = rp.metrics.SAD(aligned_intensity1, aligned_intensity2)
-                    elif metric == 'sid':
-                        s = rp.metrics.SID(aligned_intensity1, aligned_intensity2)
-                    elif metric == 'iur':
-                        q_max = np.max(aligned_intensity1)
-                        r_max = np.max(aligned_intensity2)
-                        q = aligned_intensity1 / q_max if q_max > 0 else aligned_intensity1
-                        r = aligned_intensity2 / r_max if r_max > 0 else aligned_intensity2
-                        delta = common_axis[1] - common_axis[0] if len(common_axis) > 1 else 1.0
-                        width_samples_q = self.spin_peaks_width.value() / delta if delta > 0 else 1.0
-                        width_samples_db = self.spin_iur_width.value() / delta if delta > 0 else 1.0
-                        peaks_q_idx = find_peaks(q, prominence=self.spin_peaks_prominence.value(), width=width_samples_q)[0]
-                        peaks_r_idx = find_peaks(r, prominence=self.spin_iur_prominence.value(), width=width_samples_db)[0]
-                        peaks_q_pos = common_axis[peaks_q_idx]
-                        peaks_r_pos = common_axis[peaks_r_idx]
-                        len_q = len(peaks_q_pos)
-                        len_r = len(peaks_r_pos)
-                        if len_q == 0 and len_r == 0:
-                            s = 0.0
-                        else:
-                            i_p, j_p, matched = 0, 0, 0
-                            while i_p < len_q and j_p < len_r:
-                                if abs(peaks_q_pos[i_p] - peaks_r_pos[j_p]) <= self.spin_iur_tol.value():
-                                    matched += 1
-                                    i_p += 1
-                                    j_p += 1
-                                elif peaks_q_pos[i_p] < peaks_r_pos[j_p]:
-                                    i_p += 1
-                                else:
-                                    j_p += 1
-                            total = len_q + len_r
-                            iou = matched / (total - matched) if (total - matched) != 0 else 0
-                            if matched < 1.0:
-                                iou = 0.0
-                                s = 1.0
-                            else:
-                                s = 1.0 - iou
-                    sres.append({
-                        'component': name,
-                        'url': url,
-                        'id': rbid,
-                        'identifier': ident,
-                        'distance_score': s,
-                        'source': 'rbase',
-                        'aligned_intensity_comp': aligned_intensity2,
-                        'spectral_axis_comp': common_axis
-                    })
-                i += 1
-                if i % 10 == 0:
-                    QtWidgets.QApplication.processEvents()
-            except Exception as e:
-                print(e)
-                results.append(None)
-                i += 1
-        if progress is not None:
-            progress.setValue(total_items)
-        if not sres:
-            self.log("No valid search results found.")
-            return pd.DataFrame()
-        sdf = pd.DataFrame(sres).sort_values('distance_score', ascending=True)[:nleads].reset_index(drop=True)
-        sdf['metric'] = metric
-        return sdf
+        def on_progress(i, total):
+            if i % 10 == 0:
+                QtWidgets.QApplication.processEvents()
+            if progress is None:
+                return False
+            progress.setValue(i)
+            return progress.wasCanceled()
+
+        params = self.search_params()
+        processed = None
+        if params['process_db'] and rbase_specdict is self.specdict:
+            processed = self.processed_database()
+        else:
+            # Drop a preprocessed database nobody searches
+            self.processing_graph.invalidate('database')
+        return analysis.search_database(
+            robj, rbase_specdict, nleads=nleads, metric=metric, params=params,
+            processing=self.preprocessing_params, processed=processed, progress=on_progress, log=self.log
+        )
+
+    def processed_database(self):
+        # Database spectra through the current processing settings, rerun
+        # only when the database or those settings change
+        graph = self.processing_graph
+        graph.set_params('database_source', self.specdict, token=self.db_generation)
+        graph.set_params('database', self.preprocessing_params)
+        t0 = time.perf_counter()
+        processed = graph.get('database')
+        if graph.last_run:
+            self.log(f"Preprocessed {len(processed)} database spectra in {time.perf_counter() - t0:.2f} s")
+        return processed
 
     def plot_db_spectrum(self):
         if self.specdict is None:
@@ -1705,6 +2842,7 @@ class SpectrometerApp(QtWidgets.QMainWindow):
         lo = mV & 0xFF
         self.send_command_with_data(0x0D, hi, lo)
         self.log(f"Analog output (laser voltage) → {mV} mV")
+        self.refresh_record_params()
 
     def set_trigger_out(self, state):
         if not self.serial_port.is_open:
@@ -1720,6 +2858,8 @@ class SpectrometerApp(QtWidgets.QMainWindow):
         gain = self.spin_gain.value()
         self.send_command_with_data(0x04, gain, 0x00)
         self.log(f"Gain is set → {gain}")
+        self.refresh_record_params()
+        self.select_library_dark()
 
     def set_offset(self):
         if not self.serial_port.is_open:
@@ -1729,18 +2869,18 @@ class SpectrometerApp(QtWidgets.QMainWindow):
         sign = 0x01 if offset >= 0 else 0x00
         self.send_command_with_data(0x05, data, sign)
         self.log(f"Offset is set → {offset} (data={data}, sign={sign})")
+        self.refresh_record_params()
+        self.select_library_dark()
 
     def read_gain(self):
-        self.send_command_with_data(0x23, 0x00, 0x00)
-        reply = self.read_reply(0x23, timeout=1.0)
+        reply = self.commands.request(0x23, timeout=1.0)
         if reply and len(reply) >= 3:
             gain = reply[2]
             self.spin_gain.setValue(gain)
             self.log(f"Current gain = {gain}")
 
     def read_offset(self):
-        self.send_command_with_data(0x24, 0x00, 0x00)
-        reply = self.read_reply(0x24, timeout=1.0)
+        reply = self.commands.request(0x24, timeout=1.0)
         if reply and len(reply) >= 4:
             data = reply[2]
             sign = reply[3]
@@ -1751,8 +2891,7 @@ class SpectrometerApp(QtWidgets.QMainWindow):
     def read_smoothing_level(self):
         if not self.serial_port.is_open:
             return
-        self.send_command(0x25)
-        reply = self.read_reply(0x25, timeout=1.0)
+        reply = self.commands.request(0x25, timeout=1.0)
         if reply and len(reply) >= 3:
             level = reply[2]
             if 1 <= level <= 10:
@@ -1768,6 +2907,9 @@ class SpectrometerApp(QtWidgets.QMainWindow):
         if self.current_spectrum_1 is None:
             self.log("No spectrum to add")
             return
+        if self.specdict is None and self.db_loader is not None:
+            self.log("Database is still loading - add the spectrum once it is ready")
+            return
         if self.specdict is None:
             self.specdict = {}
 
@@ -1788,6 +2930,7 @@ class SpectrometerApp(QtWidgets.QMainWindow):
 
         axis = self.spectral_axis
         intensity = self.current_spectrum_1.copy()
+        import ramanspy as rp
         rspec = rp.Spectrum(intensity, axis)
         self.specdict[name] = {
             'name': name,
@@ -1795,6 +2938,7 @@ class SpectrometerApp(QtWidgets.QMainWindow):
             'url': '',
             'identifier': name,
         }
+        self.db_generation += 1
         self.update_reference_combo_all()
         self.log(f"Spectrum '{name}' is added to the base (total n: {len(self.specdict)})")
 
@@ -1813,6 +2957,7 @@ class SpectrometerApp(QtWidgets.QMainWindow):
         )
         if ok and name:
             del self.specdict[name]
+            self.db_generation += 1
             self.log(f"Spectrum '{name}' is removed. Remaining: {len(self.specdict)}")
         self.update_reference_combo_all()
 
@@ -1824,12 +2969,13 @@ class SpectrometerApp(QtWidgets.QMainWindow):
             self, "Save spectra db", "", "Pickle (*.pkl)"
         )
         if file_name:
+            import pickle
             try:
                 with open(file_name, "wb") as f:
                     pickle.dump(self.specdict, f)
                 self.log(f"Base is saved: {file_name}")
             except Exception as e:
-                self.log(f"Error saving base: {e}")
+                self.log(f"Error saving base: {e}", applog.ERROR)
 
     def create_new_empty_db(self):
         reply = QtWidgets.QMessageBox.question(
@@ -1853,13 +2999,7 @@ class SpectrometerApp(QtWidgets.QMainWindow):
         if not file_name:
             return
         try:
-            with open(file_name, "rb") as f:
-                loaded_dict = pickle.load(f)
-
-            if not isinstance(loaded_dict, dict):
-                raise ValueError("Loaded file does not contain a dictionary")
-
-            self.specdict = loaded_dict
+            self.specdict = analysis.load_database(file_name)
             self.current_db_path = file_name
             self.searchres = None
             self.combo_reference.clear()
@@ -1870,7 +3010,7 @@ class SpectrometerApp(QtWidgets.QMainWindow):
             self.update_reference_combo_all()
         except Exception as e:
             QtWidgets.QMessageBox.critical(self, "Load Error", f"Failed to load database:\n{str(e)}")
-            self.log(f"Database load failed: {e}")
+            self.log(f"Database load failed: {e}", applog.ERROR)
 
     def reload_current_database(self):
         if not self.current_db_path or not os.path.exists(self.current_db_path):
@@ -1881,8 +3021,7 @@ class SpectrometerApp(QtWidgets.QMainWindow):
             )
             return
         try:
-            with open(self.current_db_path, "rb") as f:
-                self.specdict = pickle.load(f)
+            self.specdict = analysis.load_database(self.current_db_path)
 
             self.searchres = None
             self.combo_reference.clear()
@@ -1892,7 +3031,7 @@ class SpectrometerApp(QtWidgets.QMainWindow):
             self.lbl_current_db.setStyleSheet("color: green;")
             self.update_reference_combo_all()
         except Exception as e:
-            self.log(f"Failed to reload database: {e}")
+            self.log(f"Failed to reload database: {e}", applog.ERROR)
             QtWidgets.QMessageBox.warning(self, "Reload Error", str(e))
 
     def save_as_default_database(self):
@@ -1911,6 +3050,7 @@ class SpectrometerApp(QtWidgets.QMainWindow):
             if reply != QtWidgets.QMessageBox.Yes:
                 self.log("Save as default canceled by user")
                 return
+        import pickle
         try:
             with open(default_path, "wb") as f:
                 pickle.dump(self.specdict, f)
@@ -1920,16 +3060,17 @@ class SpectrometerApp(QtWidgets.QMainWindow):
             self.lbl_current_db.setText(f"DB: {os.path.basename(default_path)} (default)")
             self.lbl_current_db.setStyleSheet("color: green;")
         except Exception as e:
-            self.log(f"Failed to save as default database: {e}")
+            self.log(f"Failed to save as default database: {e}", applog.ERROR)
             QtWidgets.QMessageBox.critical(self, "Save Error", f"Could not save default database:\n{str(e)}")
 
     def read_calibration_group(self, group: int):
         if not self.serial_port.is_open:
             self.log("Port not open")
             return None
-        self.send_command_with_data(0x29, group, 0x00)
-        time.sleep(0.1)
-        raw = self.serial_port.read(5 + 1 + 64 + 1)
+        raw = self.commands.request(0x29, group, 0x00, reply_len=CALIB_REPLY_LEN, timeout=1.0)
+        if raw is None:
+            self.log(f"No reply for group {group}")
+            return None
         if len(raw) < 70 or raw[0] != 0x81 or raw[1] != 0x29 or raw[2] != group or raw[3] != 0x40:
             self.log(f"Invalid reply for group {group}")
             return None
@@ -1958,12 +3099,16 @@ class SpectrometerApp(QtWidgets.QMainWindow):
             )
             return strings
         else:
-            self.log(f"Failed to parse coefficients for group {group}")
+            self.log(f"Failed to parse coefficients for group {group}", applog.ERROR)
             return None
 
     def read_all_calibration(self):
-        for g in [1, 2, 3]:
-            self.read_calibration_group(g)
+        resume = self.pause_for_requests()
+        try:
+            for g in [1, 2, 3]:
+                self.read_calibration_group(g)
+        finally:
+            self.resume_after_requests(resume)
         self.log("Calibration coefficients read complete")
 
     def write_calibration_group(self, group: int):
@@ -1977,7 +3122,7 @@ class SpectrometerApp(QtWidgets.QMainWindow):
                 s = s[:15]
             data.extend(s.ljust(16, b'\x00'))
         if len(data) != 64:
-            self.log("Internal error: calibration data not 64 bytes")
+            self.log("Internal error: calibration data not 64 bytes", applog.ERROR)
             return
         head = bytearray([0x81, 0x28, group, 0x00])
         head_crc = sum(head) & 0xFF
@@ -1985,15 +3130,26 @@ class SpectrometerApp(QtWidgets.QMainWindow):
         full_packet = head + data
         total_crc = sum(full_packet) & 0xFF
         full_packet.append(total_crc)
-        self.serial_port.write(full_packet)
+        self.commands.write(full_packet)
         self.log(f"Wrote calibration group {group} ({self.calib_group_names[group]}) → device")
-        time.sleep(0.3)
+        # The read-back reply marks the write as processed and verifies it
+        raw = self.commands.request(0x29, group, 0x00, reply_len=CALIB_REPLY_LEN, timeout=1.0)
+        if raw is None:
+            self.log(f"Group {group} write not confirmed: no read-back reply")
+        elif bytes(raw[5:5 + 64]) != bytes(data):
+            self.log(f"Group {group} read-back differs from written coefficients")
+        else:
+            self.log(f"Group {group} write confirmed by read-back")
 
     def write_selected_calibration(self):
         idx = self.calib_tabs.currentIndex()
         if idx < 3:
             group = idx + 1
-            self.write_calibration_group(group)
+            resume = self.pause_for_requests()
+            try:
+                self.write_calibration_group(group)
+            finally:
+                self.resume_after_requests(resume)
         self.log("Write complete. Remember to SAVE to flash if needed.")
 
     def save_parameters_to_flash(self):
@@ -2028,6 +3184,458 @@ class SpectrometerApp(QtWidgets.QMainWindow):
     #  MOTORIZED STAGE CONTROL
     # =================================================================
 
+    # -----------------------------------------------------------------
+    # Additional spectrometers (device manager)
+    # -----------------------------------------------------------------
+
+    DEVICE_COLORS = ('b', 'r', 'g', 'm', 'c', 'y')
+
+    def create_devices_panel(self):
+        self.devices_dock = QtWidgets.QDockWidget("Spectrometers", self)
+        self.devices_dock.setAllowedAreas(QtCore.Qt.RightDockWidgetArea | QtCore.Qt.LeftDockWidgetArea)
+        self.addDockWidget(QtCore.Qt.RightDockWidgetArea, self.devices_dock)
+        self.devices_dock.setVisible(False)
+        self.devices_dock.setMinimumWidth(520)
+
+        container = QtWidgets.QWidget()
+        main_layout = QtWidgets.QVBoxLayout(container)
+        main_layout.setSpacing(3)
+        main_layout.setContentsMargins(4, 4, 4, 4)
+
+        add_group = QtWidgets.QGroupBox("Add Spectrometer")
+        add_lay = QtWidgets.QFormLayout()
+        add_lay.setSpacing(2)
+        self.edit_device_name = QtWidgets.QLineEdit("det1")
+        add_lay.addRow("Name:", self.edit_device_name)
+        port_row = QtWidgets.QHBoxLayout()
+        self.combo_device_ports = QtWidgets.QComboBox()
+        self.combo_device_ports.setEditable(True)
+        port_row.addWidget(self.combo_device_ports, 1)
+        btn_dev_refresh = QtWidgets.QPushButton("Refresh")
+        btn_dev_refresh.clicked.connect(self.devices_refresh_ports)
+        port_row.addWidget(btn_dev_refresh)
+        self.combo_device_baud = QtWidgets.QComboBox()
+        self.combo_device_baud.addItems(["19200", "38400", "115200"])
+        port_row.addWidget(self.combo_device_baud)
+        add_lay.addRow("Port:", port_row)
+        btn_add_device = QtWidgets.QPushButton("Connect && Add")
+        btn_add_device.clicked.connect(self.add_device)
+        add_lay.addRow(btn_add_device)
+        add_group.setLayout(add_lay)
+        main_layout.addWidget(add_group)
+
+        self.device_table = QtWidgets.QTableWidget(0, 6)
+        self.device_table.setHorizontalHeaderLabels(
+            ["Name", "Port", "Int. time (ms)", "Range (nm)", "Background", "Frames"]
+        )
+        self.device_table.setSelectionBehavior(QtWidgets.QAbstractItemView.SelectRows)
+        self.device_table.setSelectionMode(QtWidgets.QAbstractItemView.SingleSelection)
+        self.device_table.setEditTriggers(QtWidgets.QAbstractItemView.NoEditTriggers)
+        self.device_table.horizontalHeader().setStretchLastSection(True)
+        self.device_table.setMaximumHeight(150)
+        self.device_table.itemSelectionChanged.connect(self.on_device_selected)
+        main_layout.addWidget(self.device_table)
+
+        dev_group = QtWidgets.QGroupBox("Selected Spectrometer")
+        dev_lay = QtWidgets.QFormLayout()
+        dev_lay.setSpacing(2)
+        self.spin_device_time = QtWidgets.QSpinBox()
+        self.spin_device_time.setRange(1, 60000)
+        self.spin_device_time.setValue(100)
+        dev_lay.addRow("Integration time (ms):", self.spin_device_time)
+        self.spin_device_average = QtWidgets.QSpinBox()
+        self.spin_device_average.setRange(1, 255)
+        dev_lay.addRow("Average:", self.spin_device_average)
+        range_row = QtWidgets.QHBoxLayout()
+        self.spin_device_wl_min = QtWidgets.QDoubleSpinBox()
+        self.spin_device_wl_min.setRange(100, 3000)
+        self.spin_device_wl_min.setValue(796)
+        range_row.addWidget(self.spin_device_wl_min)
+        self.spin_device_wl_max = QtWidgets.QDoubleSpinBox()
+        self.spin_device_wl_max.setRange(100, 3000)
+        self.spin_device_wl_max.setValue(1119)
+        range_row.addWidget(self.spin_device_wl_max)
+        dev_lay.addRow("Wavelength range (nm):", range_row)
+        self.spin_device_exc = QtWidgets.QDoubleSpinBox()
+        self.spin_device_exc.setRange(200, 2000)
+        self.spin_device_exc.setValue(785)
+        dev_lay.addRow("Excitation (nm):", self.spin_device_exc)
+        btn_row = QtWidgets.QHBoxLayout()
+        btn_apply_dev = QtWidgets.QPushButton("Apply")
+        btn_apply_dev.clicked.connect(self.apply_device_settings)
+        btn_row.addWidget(btn_apply_dev)
+        btn_dev_bg = QtWidgets.QPushButton("Acquire Background")
+        btn_dev_bg.clicked.connect(self.device_acquire_background)
+        btn_row.addWidget(btn_dev_bg)
+        btn_dev_clear_bg = QtWidgets.QPushButton("Clear Background")
+        btn_dev_clear_bg.clicked.connect(self.device_clear_background)
+        btn_row.addWidget(btn_dev_clear_bg)
+        dev_lay.addRow(btn_row)
+        btn_row2 = QtWidgets.QHBoxLayout()
+        btn_dev_calib = QtWidgets.QPushButton("Load Calibration...")
+        btn_dev_calib.clicked.connect(self.device_load_calibration)
+        btn_row2.addWidget(btn_dev_calib)
+        btn_dev_remove = QtWidgets.QPushButton("Disconnect && Remove")
+        btn_dev_remove.clicked.connect(self.remove_device)
+        btn_row2.addWidget(btn_dev_remove)
+        dev_lay.addRow(btn_row2)
+        dev_group.setLayout(dev_lay)
+        main_layout.addWidget(dev_group)
+
+        acq_group = QtWidgets.QGroupBox("Parallel Acquisition")
+        acq_lay = QtWidgets.QFormLayout()
+        acq_lay.setSpacing(2)
+        self.spin_device_tolerance = QtWidgets.QSpinBox()
+        self.spin_device_tolerance.setRange(1, 60000)
+        self.spin_device_tolerance.setValue(50)
+        self.spin_device_tolerance.setToolTip(
+            "Frames from different spectrometers closer than this on the host clock are merged into one set"
+        )
+        acq_lay.addRow("Alignment tolerance (ms):", self.spin_device_tolerance)
+        self.cb_device_raman = QtWidgets.QCheckBox("Plot Raman shift")
+        self.cb_device_raman.stateChanged.connect(lambda *args: self.redraw_devices())
+        acq_lay.addRow(self.cb_device_raman)
+        btn_row3 = QtWidgets.QHBoxLayout()
+        self.btn_devices_start = QtWidgets.QPushButton("Start All")
+        self.btn_devices_start.clicked.connect(self.start_devices)
+        btn_row3.addWidget(self.btn_devices_start)
+        btn_devices_stop = QtWidgets.QPushButton("Stop All")
+        btn_devices_stop.clicked.connect(self.stop_devices)
+        btn_row3.addWidget(btn_devices_stop)
+        self.btn_devices_record = QtWidgets.QPushButton("Record All")
+        self.btn_devices_record.setCheckable(True)
+        self.btn_devices_record.toggled.connect(self.toggle_device_recording)
+        btn_row3.addWidget(self.btn_devices_record)
+        acq_lay.addRow(btn_row3)
+        self.lbl_devices_stats = QtWidgets.QLabel("Sets: 0")
+        acq_lay.addRow(self.lbl_devices_stats)
+        acq_group.setLayout(acq_lay)
+        main_layout.addWidget(acq_group)
+
+        self.device_plot = pg.PlotWidget()
+        self.device_plot.setBackground('w')
+        self.device_plot.addLegend()
+        self.device_plot.setMinimumHeight(250)
+        self.device_plot.setLabel('left', 'Light Intensity')
+        self.device_plot.setLabel('bottom', 'Wavelength (nm)')
+        main_layout.addWidget(self.device_plot, 1)
+
+        scroll = QtWidgets.QScrollArea()
+        scroll.setWidgetResizable(True)
+        scroll.setWidget(container)
+        self.devices_dock.setWidget(scroll)
+
+        self.device_curves = {}
+        self.device_latest = {}
+        self.device_workers = {}
+        self.device_aligner = None
+        self.device_recorder = None
+        self.device_redraw_timer = QtCore.QTimer(self)
+        self.device_redraw_timer.setSingleShot(True)
+        self.device_redraw_timer.timeout.connect(self.on_devices_frame_ready)
+        self.device_last_redraw = 0.0
+        self.devices_refresh_ports()
+
+    def devices_refresh_ports(self):
+        current = self.combo_device_ports.currentText()
+        self.combo_device_ports.clear()
+        for port in serial.tools.list_ports.comports():
+            self.combo_device_ports.addItem(port.device)
+        self.combo_device_ports.addItem(VIRTUAL_PORT_PREFIX + "spectrometer")
+        if current:
+            self.combo_device_ports.setCurrentText(current)
+
+    def devices_running(self):
+        return bool(self.device_workers)
+
+    def selected_device(self):
+        rows = self.device_table.selectionModel().selectedRows() if self.device_table.selectionModel() else []
+        if not rows:
+            if len(self.device_manager) == 1:
+                return next(iter(self.device_manager))
+            self.log("Select a spectrometer in the list first")
+            return None
+        return self.device_manager.get(self.device_table.item(rows[0].row(), 0).text())
+
+    def refresh_device_table(self):
+        self.device_table.setRowCount(len(self.device_manager))
+        for row, dev in enumerate(self.device_manager):
+            values = (
+                dev.name, dev.port_name,
+                "?" if dev.integration_time is None else f"{dev.integration_time} ×{dev.average}",
+                f"{dev.wavelength_min:g}–{dev.wavelength_max:g}",
+                "yes" if dev.background is not None else "no",
+                str(dev.frames),
+            )
+            for col, value in enumerate(values):
+                item = self.device_table.item(row, col)
+                if item is None:
+                    self.device_table.setItem(row, col, QtWidgets.QTableWidgetItem(value))
+                else:
+                    item.setText(value)
+
+    def on_device_selected(self):
+        rows = self.device_table.selectionModel().selectedRows()
+        if not rows:
+            return
+        dev = self.device_manager.get(self.device_table.item(rows[0].row(), 0).text())
+        if dev is None:
+            return
+        if dev.integration_time is not None:
+            self.spin_device_time.setValue(dev.integration_time)
+        self.spin_device_average.setValue(dev.average)
+        self.spin_device_wl_min.setValue(dev.wavelength_min)
+        self.spin_device_wl_max.setValue(dev.wavelength_max)
+        self.spin_device_exc.setValue(dev.excitation)
+
+    def add_device(self):
+        if self.devices_running():
+            self.log("Stop parallel acquisition before adding a spectrometer")
+            return
+        name = self.edit_device_name.text().strip()
+        port = self.combo_device_ports.currentText().strip()
+        if not name or not port:
+            return
+        if port == self.serial_port.port and self.serial_port.is_open and not is_virtual_port(port):
+            QtWidgets.QMessageBox.warning(self, "Port in use", f"{port} is the main window's spectrometer")
+            return
+        try:
+            dev = self.device_manager.add(
+                name, port, baudrate=int(self.combo_device_baud.currentText()),
+                wavelength_range=(self.spin_device_wl_min.value(), self.spin_device_wl_max.value()),
+                excitation=self.spin_device_exc.value(),
+            )
+        except ValueError as e:
+            QtWidgets.QMessageBox.warning(self, "Add Spectrometer", str(e))
+            return
+        try:
+            dev.open()
+            confirmed = dev.configure(self.spin_device_time.value(), self.spin_device_average.value())
+        except Exception as e:
+            self.device_manager.remove(name)
+            QtWidgets.QMessageBox.critical(self, "Connection Error", f"{port}: {e}")
+            return
+        color = self.DEVICE_COLORS[(len(self.device_manager) - 1) % len(self.DEVICE_COLORS)]
+        curve = self.device_plot.plot(pen=pg.mkPen(color, width=1.5), name=name)
+        curve.setDownsampling(auto=True, method='peak')
+        curve.setClipToView(True)
+        self.device_curves[name] = curve
+        self.log(f"Spectrometer '{name}' connected on {port}, integration time {confirmed} ms")
+        self.edit_device_name.setText(f"det{len(self.device_manager) + 1}")
+        self.refresh_device_table()
+
+    def remove_device(self):
+        dev = self.selected_device()
+        if dev is None:
+            return
+        if self.devices_running():
+            self.log("Stop parallel acquisition before removing a spectrometer")
+            return
+        self.device_manager.remove(dev.name)
+        curve = self.device_curves.pop(dev.name, None)
+        if curve is not None:
+            self.device_plot.removeItem(curve)
+        self.device_latest.pop(dev.name, None)
+        self.log(f"Spectrometer '{dev.name}' disconnected")
+        self.refresh_device_table()
+
+    def apply_device_settings(self):
+        dev = self.selected_device()
+        if dev is None:
+            return
+        dev.set_wavelength_range(self.spin_device_wl_min.value(), self.spin_device_wl_max.value())
+        dev.set_excitation(self.spin_device_exc.value())
+        if self.devices_running():
+            self.log(f"'{dev.name}': axis updated; stop acquisition to change integration time or average")
+        else:
+            try:
+                confirmed = dev.configure(self.spin_device_time.value(), self.spin_device_average.value())
+                self.log(f"'{dev.name}': integration time {confirmed} ms, average {dev.average}")
+            except Exception as e:
+                self.log(f"'{dev.name}': failed to apply settings: {e}", applog.ERROR)
+        self.refresh_device_table()
+        self.redraw_devices()
+
+    def device_acquire_background(self):
+        dev = self.selected_device()
+        if dev is None:
+            return
+        if self.devices_running():
+            self.log("Stop parallel acquisition before acquiring a background")
+            return
+        self.progress_bar.setRange(0, 0)
+        self.progress_bar.show()
+        QtWidgets.QApplication.processEvents()
+        try:
+            background = dev.acquire_background()
+        finally:
+            self.progress_bar.hide()
+        if background is None:
+            self.log(f"'{dev.name}': background acquisition failed", applog.ERROR)
+        else:
+            self.log(f"'{dev.name}': background acquired")
+        self.refresh_device_table()
+
+    def device_clear_background(self):
+        dev = self.selected_device()
+        if dev is None:
+            return
+        dev.background = None
+        self.log(f"'{dev.name}': background cleared")
+        self.refresh_device_table()
+
+    def device_load_calibration(self):
+        dev = self.selected_device()
+        if dev is None:
+            return
+        file_name, _ = QtWidgets.QFileDialog.getOpenFileName(
+            self, f"Load Calibration for {dev.name}", "", "CSV Files (*.csv)"
+        )
+        if not file_name:
+            return
+        try:
+            dev.set_calibration(analysis.load_calibration(file_name))
+            self.log(f"'{dev.name}': loaded calibration {file_name} coeffs {dev.calib_coeffs}")
+        except Exception as e:
+            self.log(f"'{dev.name}': failed to load calibration: {e}", applog.ERROR)
+        self.redraw_devices()
+
+    def start_devices(self):
+        if self.devices_running():
+            return
+        devices = self.device_manager.open_devices()
+        if not devices:
+            self.log("No spectrometers connected")
+            return
+        self.device_aligner = self.device_manager.aligner(
+            tolerance_s=self.spin_device_tolerance.value() / 1000.0,
+            # A set waits at most a couple of frame periods of the slowest device
+            max_wait_s=max(1.0, 2.5 * max((d.integration_time or 100) * d.average for d in devices) / 1000.0),
+        )
+        self.device_latest.clear()
+        for dev in devices:
+            dev.start_continuous()
+            worker = AcquisitionWorker(dev.port, dev.ring, verify_crc=dev.reader.verify_crc, parent=self)
+            worker.record_params = (dev.integration_time or 0, 0, 0, dev.average, 0)
+            if self.device_recorder is not None and dev.name in self.device_recorder.recorders:
+                worker.recorder = self.device_recorder.sink(dev.name)
+            worker.frame_ready.connect(self.schedule_devices_redraw)
+            worker.message.connect(lambda message, name=dev.name: self.log(f"[{name}] {message}", applog.WARNING))
+            self.device_workers[dev.name] = worker
+        for worker in self.device_workers.values():
+            worker.start()
+        self.btn_devices_start.setEnabled(False)
+        self.log(f"Parallel acquisition started: {', '.join(self.device_workers)}")
+
+    def stop_devices(self):
+        if not self.devices_running():
+            return
+        for worker in self.device_workers.values():
+            worker.stop()
+        for name, worker in self.device_workers.items():
+            worker.wait()
+            dev = self.device_manager.get(name)
+            try:
+                dev.stop_continuous()
+                dev.port.reset_input_buffer()
+                dev.commands.reset()
+            except Exception as e:
+                self.log(f"[{name}] stop failed: {e}", applog.ERROR)
+        self.device_redraw_timer.stop()
+        self.on_devices_frame_ready(flush=True)
+        for name, worker in self.device_workers.items():
+            stats = worker.stats
+            self.log(
+                f"[{name}] stopped: {stats.frames_read} frames ({stats.rate():.1f} fps), "
+                f"dropped {stats.dropped}, corrupt {worker.reader.corrupt_frames}"
+            )
+        aligner = self.device_aligner
+        self.log(
+            f"Aligned sets: {aligner.sets}, incomplete {aligner.incomplete}, "
+            f"max skew {1000 * aligner.max_skew:.1f} ms"
+        )
+        self.device_workers = {}
+        self.btn_devices_start.setEnabled(True)
+
+    def toggle_device_recording(self, checked):
+        if checked:
+            names = [dev.name for dev in self.device_manager.open_devices()]
+            if not names:
+                self.log("No spectrometers connected")
+                self.btn_devices_record.setChecked(False)
+                return
+            file_name, _ = QtWidgets.QFileDialog.getSaveFileName(
+                self, 'Record All Spectrometers', time.strftime("multi_%Y%m%d_%H%M%S.rec"),
+                'Frame recordings (*.rec)'
+            )
+            if not file_name:
+                self.btn_devices_record.setChecked(False)
+                return
+            try:
+                self.device_recorder = MultiRecorder(file_name, names)
+            except Exception as e:
+                self.log(f"Failed to start recording: {e}", applog.ERROR)
+                self.btn_devices_record.setChecked(False)
+                return
+            for name, worker in self.device_workers.items():
+                worker.recorder = self.device_recorder.sink(name)
+            self.btn_devices_record.setStyleSheet("background-color: #cc0000; color: white;")
+            self.log(f"Recording {', '.join(names)}; timeline in {self.device_recorder.timeline_path}")
+        else:
+            recorder = self.device_recorder
+            self.device_recorder = None
+            for worker in self.device_workers.values():
+                worker.recorder = None
+            self.btn_devices_record.setStyleSheet("")
+            if recorder is not None:
+                recorder.close()
+                counts = ', '.join(f"{name} {r.n_frames}" for name, r in recorder.recorders.items())
+                self.log(f"Recording stopped: {counts} frames, {recorder.sets} aligned sets")
+
+    def schedule_devices_redraw(self):
+        if self.device_redraw_timer.isActive():
+            return
+        wait = self.device_last_redraw + 1.0 / self.plot_refresh_hz - time.time()
+        self.device_redraw_timer.start(max(0, int(wait * 1000)))
+
+    def on_devices_frame_ready(self, flush=False):
+        aligner = self.device_aligner
+        if aligner is None:
+            return
+        self.device_last_redraw = time.time()
+        for name in self.device_workers:
+            dev = self.device_manager.get(name)
+            frames = dev.ring.pop_all()
+            # Ring slots are reused by the reader; correct() makes the copy
+            for frame in frames:
+                aligner.push(name, frame.timestamp, dev.correct(frame.data))
+            dev.frames += len(frames)
+        sets = aligner.pop_ready(now=float('inf') if flush else None)
+        if not sets:
+            return
+        recorder = self.device_recorder
+        for aligned in sets:
+            if recorder is not None:
+                recorder.write_set(aligned)
+            for name, entry in aligned.frames.items():
+                if entry is not None:
+                    self.device_latest[name] = entry[1]
+        self.redraw_devices()
+        self.lbl_devices_stats.setText(
+            f"Sets: {aligner.sets} / Incomplete: {aligner.incomplete} / "
+            f"Max skew: {1000 * aligner.max_skew:.1f} ms"
+        )
+        self.refresh_device_table()
+
+    def redraw_devices(self):
+        raman = self.cb_device_raman.isChecked()
+        for name, data in self.device_latest.items():
+            dev = self.device_manager.get(name)
+            curve = self.device_curves.get(name)
+            if dev is not None and curve is not None:
+                curve.setData(dev.axis(raman), data)
+        self.device_plot.setLabel('bottom', 'Raman shift (cm<sup>-1</sup>)' if raman else 'Wavelength (nm)')
+
     def create_stage_panel(self):
         self.stage_dock = QtWidgets.QDockWidget("Motorized Stage Control", self)
         self.stage_dock.setAllowedAreas(
@@ -2154,7 +3762,8 @@ class SpectrometerApp(QtWidgets.QMainWindow):
         scan_lay.addWidget(QtWidgets.QLabel(
             "Syntax: xspeed60yspeed70step200inttime200v500settle200\n"
             "_3strokesxneg2strokesypos_runnametest\n"
-            "_autodarktrue_savezoomtrue_home"
+            "_autodarktrue_savezoomtrue_home\n"
+            "autoexptrue: auto exposure once, autoexppoint: at every point"
         ))
         self.stage_scan_edit = QtWidgets.QPlainTextEdit()
         self.stage_scan_edit.setMaximumHeight(50)
@@ -2283,6 +3892,7 @@ class SpectrometerApp(QtWidgets.QMainWindow):
         self.stage_log_widget = QtWidgets.QPlainTextEdit()
         self.stage_log_widget.setReadOnly(True)
         self.stage_log_widget.setMaximumHeight(100)
+        self.stage_log_widget.setMaximumBlockCount(2000)
         main_layout.addWidget(self.stage_log_widget)
 
         main_layout.addStretch()
@@ -2481,6 +4091,9 @@ class SpectrometerApp(QtWidgets.QMainWindow):
         m = re.search(r'autodark(true|false)', text, re.IGNORECASE)
         p['autodark'] = (m.group(1).lower() == 'true') if m else False
 
+        m = re.search(r'autoexp(true|false|point)', text, re.IGNORECASE)
+        p['autoexp'] = m.group(1).lower() if m else 'false'
+
         m = re.search(r'savezoom(true|false)', text, re.IGNORECASE)
         p['savezoom'] = (m.group(1).lower() == 'true') if m else False
 
@@ -2585,6 +4198,8 @@ class SpectrometerApp(QtWidgets.QMainWindow):
             self.stage_log(f"Dark attempt {attempt}/{max_attempts}")
             self.send_command(0x01)
             data = self.read_spectral_data().astype(np.float64)
+            if len(data) == 2048:
+                data = self.remove_spikes(data, temporal=False, log=self.stage_log)
             if len(data) != 2048:
                 self.stage_log("  wrong length, retry")
                 time.sleep(0.2)
@@ -2607,12 +4222,26 @@ class SpectrometerApp(QtWidgets.QMainWindow):
         self.stage_log("All dark attempts failed!")
         return None
 
+    def _scan_dark(self, max_attempts=5):
+        # Stored or interpolated dark for the current settings when the
+        # library has one; otherwise a fresh dark, which is then stored
+        if self.cb_dark_library.isChecked():
+            match = self.dark_library.lookup(*self.current_dark_key())
+            if match is not None:
+                sources = " and ".join(self.format_dark_key(k) for k in match.keys)
+                self.stage_log(f"  {match.kind} dark from library ({sources})")
+                return np.array(match.data)
+        data = self._acquire_valid_dark(max_attempts=max_attempts)
+        if data is not None:
+            self.store_dark(data)
+        return data
+
     def _scan_acquire_valid(self, max_attempts=3):
         for attempt in range(max_attempts):
             self.send_command(0x01)
             data = self.read_spectral_data().astype(np.float64)
             if data is not None and len(data) == 2048 and not np.all(data == 0):
-                return data
+                return self.remove_spikes(data, temporal=False, log=self.stage_log)
             self.stage_log(f"  Scan acq retry {attempt + 1}")
             time.sleep(0.1)
         return None
@@ -2666,6 +4295,7 @@ class SpectrometerApp(QtWidgets.QMainWindow):
         inttime = params['inttime']
         voltage = params['voltage']
         savezoom = params['savezoom']
+        autoexp = params['autoexp']
         stroke_seq = params['stroke_sequence']
 
         settle_ms = params.get('settle', 50)
@@ -2717,13 +4347,24 @@ class SpectrometerApp(QtWidgets.QMainWindow):
         else:
             self.stage_log(">> No voltage specified, skipping laser control")
 
+        if autoexp in ('true', 'point'):
+            self.stage_log(">> Auto exposure (laser on during probes)...")
+            self._set_trigger_out_value(True)
+            time.sleep(0.05)
+            try:
+                self.auto_exposure(log=self.stage_log)
+            except Exception as e:
+                self.stage_log(f">> ERROR during auto exposure: {e}")
+            self._set_trigger_out_value(False)
+
         dark_spectrum = None
+        dark_time = self.spin_integration_time.value()
         if autodark:
             self.stage_log("=== Auto-dark (trigger OUT LOW = laser not firing) ===")
             self._set_trigger_out_value(False)
             QtWidgets.QApplication.processEvents()
             try:
-                dark_spectrum = self._acquire_valid_dark(max_attempts=5)
+                dark_spectrum = self._scan_dark(max_attempts=5)
             except Exception as e:
                 self.stage_log(f">> ERROR during dark acquisition: {e}")
                 dark_spectrum = None
@@ -2734,6 +4375,7 @@ class SpectrometerApp(QtWidgets.QMainWindow):
                     delimiter=',', header='wavelength,intensity', comments=''
                 )
                 self.background_spectrum = dark_spectrum.copy()
+                self.background_key = self.current_dark_key()
                 self.stage_log(">> Dark spectrum saved and set as background")
             else:
                 self.stage_log(">> WARNING: Could not get valid dark!")
@@ -2749,6 +4391,7 @@ class SpectrometerApp(QtWidgets.QMainWindow):
         QtWidgets.QApplication.processEvents()
 
         def acquire_at_position(pos_name):
+            nonlocal dark_spectrum, dark_time
             self.stage_log(f"  Acquiring at {pos_name}...")
 
             self._stage_pause(settle_ms)
@@ -2759,6 +4402,31 @@ class SpectrometerApp(QtWidgets.QMainWindow):
             self._set_trigger_out_value(True)
             time.sleep(0.05)
 
+            if autoexp == 'point':
+                try:
+                    self.auto_exposure(start_time=self.spin_integration_time.value(), log=self.stage_log)
+                except Exception as e:
+                    self.stage_log(f"  ERROR during auto exposure: {e}")
+                inttime_now = self.spin_integration_time.value()
+                with open(os.path.join(run_dir, "exposure_log.csv"), 'a') as f:
+                    f.write(f"{pos_name},{inttime_now}\n")
+                if autodark and dark_spectrum is not None and inttime_now != dark_time:
+                    # Dark current scales with exposure: re-take the dark
+                    self._set_trigger_out_value(False)
+                    new_dark = self._scan_dark(max_attempts=5)
+                    if new_dark is not None:
+                        dark_spectrum = new_dark
+                        dark_time = inttime_now
+                        self.background_spectrum = dark_spectrum.copy()
+                        self.background_key = self.current_dark_key()
+                        np.savetxt(
+                            os.path.join(run_dir, f"{pos_name}_dark.csv"),
+                            np.column_stack((self.wavelengths, dark_spectrum)),
+                            delimiter=',', header='wavelength,intensity', comments=''
+                        )
+                    self._set_trigger_out_value(True)
+                    time.sleep(0.05)
+
             raw_data = self._scan_acquire_valid(max_attempts=3)
 
             self._set_trigger_out_value(False)
@@ -2773,8 +4441,8 @@ class SpectrometerApp(QtWidgets.QMainWindow):
                 delimiter=',', header='wavelength,raw_intensity', comments=''
             )
 
-            self.current_spectrum_1 = raw_data.copy()
-            self.original_spectrum = raw_data.copy()
+            self.current_spectrum_1 = raw_data
+            self.original_spectrum = raw_data
             self.checkbox_zoom.setChecked(False)
             self.spectral_axis = self.wavelengths.copy()
             self.update_plot(self.wavelengths, raw_data)
@@ -2791,8 +4459,8 @@ class SpectrometerApp(QtWidgets.QMainWindow):
                     delimiter=',', header='wavelength,corrected_intensity',
                     comments=''
                 )
-                self.current_spectrum_1 = corrected.copy()
-                self.original_spectrum = corrected.copy()
+                self.current_spectrum_1 = corrected
+                self.original_spectrum = corrected
                 self.spectral_axis = self.wavelengths.copy()
                 self.update_plot(self.wavelengths, corrected)
                 QtWidgets.QApplication.processEvents()
@@ -2938,263 +4606,41 @@ class SpectrometerApp(QtWidgets.QMainWindow):
                 f"Post-processing failed:\n{e}"
             )
 
+    def scan_analysis_params(self):
+        return {
+            'excitation': self.scan_exc_wl_spin.value(),
+            'use_calibration': self.scan_use_calib_cb.isChecked(),
+            'use_corrected': self.scan_use_corrected_cb.isChecked(),
+            'crop_min': self.scan_crop_min_spin.value(),
+            'crop_max': self.scan_crop_max_spin.value(),
+            'savgol_window': self.scan_sg_window_spin.value(),
+            'savgol_polyorder': self.scan_sg_poly_spin.value(),
+            'saturation': self.scan_sat_thresh_spin.value(),
+            'flat_threshold': self.scan_flat_thresh_spin.value(),
+            'peak_prominence': self.scan_peak_prom_spin.value(),
+        }
+
     def _run_scan_analysis_pipeline(self, scan_folder):
-        import matplotlib
-        matplotlib.use('Agg')
-        import matplotlib.pyplot as plt
-
-        # ---- Gather parameters from UI ----
-        EXCITATION_WAVELENGTH = self.scan_exc_wl_spin.value()
-        USE_SOFTWARE_CALIBRATION = self.scan_use_calib_cb.isChecked()
-        USE_CORRECTED = self.scan_use_corrected_cb.isChecked()
-        CROP_MIN = self.scan_crop_min_spin.value()
-        CROP_MAX = self.scan_crop_max_spin.value()
-        CROP_REGION = (CROP_MIN, CROP_MAX) if CROP_MIN < CROP_MAX else None
-        SAVGOL_WINDOW = self.scan_sg_window_spin.value()
-        SAVGOL_POLYORDER = self.scan_sg_poly_spin.value()
-        SATURATION_INTENSITY = self.scan_sat_thresh_spin.value()
-        SATURATION_PIXEL_FRACTION = 0.05
-        FLAT_CV_THRESHOLD = self.scan_flat_thresh_spin.value()
-        PEAK_PROMINENCE = self.scan_peak_prom_spin.value()
-        PEAK_MIN_WIDTH = 2
+        def on_progress(percent):
+            self.scan_analysis_progress.setValue(percent)
+            QtWidgets.QApplication.processEvents()
 
         # Use calibration from app if available
-        calib_coeffs_soft = None
-        if USE_SOFTWARE_CALIBRATION and self.is_calibrated and self.calib_coeffs_soft:
-            calib_coeffs_soft = self.calib_coeffs_soft
-            self.stage_log(f"Using app calibration: {calib_coeffs_soft}")
-        elif USE_SOFTWARE_CALIBRATION:
-            calib_path = "calibration_cur.csv"
-            if os.path.exists(calib_path):
-                try:
-                    df = pd.read_csv(calib_path, header=None)
-                    calib_coeffs_soft = df.values.flatten()[:3].tolist()
-                    self.stage_log(f"Loaded calibration from {calib_path}: {calib_coeffs_soft}")
-                except Exception as e:
-                    self.stage_log(f"Failed to load calibration: {e}")
-            else:
-                self.stage_log("No calibration file found, proceeding without")
-
-        self.stage_log(f"Params: exc={EXCITATION_WAVELENGTH}, crop={CROP_REGION}, "
-                       f"SG={SAVGOL_WINDOW}/{SAVGOL_POLYORDER}, calib={calib_coeffs_soft is not None}")
-
-        # ---- Load spectra ----
-        self.scan_analysis_progress.setValue(5)
-        QtWidgets.QApplication.processEvents()
-
-        if USE_CORRECTED:
-            pattern = os.path.join(scan_folder, "pt_*_corrected.csv")
-            files = sorted(glob.glob(pattern))
-            if not files:
-                pattern = os.path.join(scan_folder, "pt_*_raw.csv")
-                files = sorted(glob.glob(pattern))
-                self.stage_log("No corrected files, using raw")
-        else:
-            pattern = os.path.join(scan_folder, "pt_*_raw.csv")
-            files = sorted(glob.glob(pattern))
-
-        if not files:
-            self.stage_log("No spectral files found!")
-            return
-
-        spectra = {}
-        for f in files:
-            try:
-                df = pd.read_csv(f)
-                wl = df.iloc[:, 0].values.astype(np.float64)
-                inten = df.iloc[:, 1].values.astype(np.float64)
-                basename = os.path.basename(f)
-                point_name = re_module.sub(r'_(corrected|raw)\.csv$', '', basename)
-                spectra[basename] = {
-                    'wavelength': wl,
-                    'intensity': inten,
-                    'point_name': point_name,
-                }
-            except Exception as e:
-                self.stage_log(f"Error loading {f}: {e}")
-
-        self.stage_log(f"Loaded {len(spectra)} spectra")
-        self.scan_analysis_progress.setValue(15)
-        QtWidgets.QApplication.processEvents()
-
-        # ---- QC Filtering ----
-        filtered = {}
-        rejected_sat = {}
-        rejected_flat = {}
-
-        for name, data in spectra.items():
-            intensity = data['intensity']
-
-            n_sat = np.sum(intensity >= SATURATION_INTENSITY)
-            sat_frac = n_sat / len(intensity)
-            is_saturated = sat_frac > SATURATION_PIXEL_FRACTION
-
-            # Flat check
-            y = intensity.astype(np.float64)
-            is_flat = False
-            flat_score = 999.0
-            if len(y) >= 7:
-                sg_w = min(11, len(y))
-                if sg_w % 2 == 0:
-                    sg_w -= 1
-                sg_p = min(3, sg_w - 1)
-                try:
-                    y_sm = savgol_filter(y, sg_w, sg_p)
-                    residual = y - y_sm
-                    noise_std = np.std(residual)
-                    signal_span = np.percentile(y_sm, 95) - np.percentile(y_sm, 5)
-                    flat_score = signal_span / (noise_std + 1e-12)
-                    is_flat = flat_score < FLAT_CV_THRESHOLD
-                except Exception:
-                    pass
-
-            if is_saturated:
-                rejected_sat[name] = data
-            elif is_flat:
-                rejected_flat[name] = data
-            else:
-                filtered[name] = data
-
-            self.stage_log(
-                f"  {data['point_name']}: max={np.max(intensity):.0f} "
-                f"sat={sat_frac*100:.1f}% flat={flat_score:.1f} "
-                f"{'SAT' if is_saturated else 'FLAT' if is_flat else 'OK'}"
-            )
-
-        self.stage_log(
-            f"QC: {len(filtered)} passed, "
-            f"{len(rejected_sat)} saturated, "
-            f"{len(rejected_flat)} flat"
+        calib_coeffs = self.calib_coeffs_soft if self.is_calibrated and self.calib_coeffs_soft else None
+        result = analysis.analyze_scan(
+            scan_folder, self.scan_analysis_params(), calib_coeffs=calib_coeffs,
+            log=self.stage_log, progress=on_progress
         )
-
-        if len(filtered) == 0:
-            self.stage_log("ALL spectra rejected! Aborting analysis.")
+        if result is None:
             return
 
-        self.scan_analysis_progress.setValue(25)
-        QtWidgets.QApplication.processEvents()
-
-        # ---- Wavelength -> Raman shift ----
-        for name, data in filtered.items():
-            initial_shifts = rp.utils.wavelength_to_wavenumber(
-                data['wavelength'], EXCITATION_WAVELENGTH
-            )
-            initial_shifts = np.asarray(initial_shifts, dtype=np.float64)
-
-            if calib_coeffs_soft is not None:
-                a, b, c = calib_coeffs_soft[:3]
-                cal_shifts = a * initial_shifts**2 + b * initial_shifts + c
-            else:
-                cal_shifts = initial_shifts
-
-            data['ramanshift'] = cal_shifts
-
-        # ---- Crop ----
-        for name, data in filtered.items():
-            if CROP_REGION is not None:
-                mask = (data['ramanshift'] >= CROP_REGION[0]) & (data['ramanshift'] <= CROP_REGION[1])
-                data['ramanshift_cropped'] = data['ramanshift'][mask]
-                data['intensity_cropped'] = data['intensity'][mask]
-            else:
-                data['ramanshift_cropped'] = data['ramanshift']
-                data['intensity_cropped'] = data['intensity']
-
-        self.scan_analysis_progress.setValue(35)
-        QtWidgets.QApplication.processEvents()
-
-        # ---- Baseline correction (RamanSPy ASLS) ----
-        self.stage_log("Applying ASLS baseline correction via RamanSPy...")
-
-        for name, data in filtered.items():
-            y = data['intensity_cropped'].copy()
-            x = data['ramanshift_cropped']
-
-            sg_w, sg_p = self._validate_sg(SAVGOL_WINDOW, SAVGOL_POLYORDER, len(y))
-            y_smooth = savgol_filter(y, sg_w, sg_p)
-
-            try:
-                spectrum_obj = rp.Spectrum(y_smooth, x)
-                asls = self._build_rp_asls_obj()
-                corrected_obj = asls.apply(spectrum_obj)
-                corrected_y = np.asarray(corrected_obj.spectral_data).squeeze().astype(np.float64)
-                baseline = y_smooth - corrected_y
-            except Exception as e:
-                self.stage_log(f"  ASLS failed for {data['point_name']}: {e}, using smoothed")
-                corrected_y = y_smooth
-                baseline = np.zeros_like(y_smooth)
-
-            data['baseline'] = baseline
-            data['intensity_corrected'] = corrected_y
-
-        self.scan_analysis_progress.setValue(55)
-        QtWidgets.QApplication.processEvents()
-
-        # ---- Normalization ----
-        for name, data in filtered.items():
-            y = data['intensity_corrected']
-            y_min, y_max = np.min(y), np.max(y)
-            if (y_max - y_min) < 1e-10:
-                data['intensity_normalized'] = np.zeros_like(y)
-            else:
-                data['intensity_normalized'] = (y - y_min) / (y_max - y_min)
-
-        self.scan_analysis_progress.setValue(65)
-        QtWidgets.QApplication.processEvents()
-
-        # ---- Build spectral matrix ----
-        all_x = [data['ramanshift_cropped'] for data in filtered.values()]
-        all_y = [data['intensity_normalized'] for data in filtered.values()]
-
-        x_ref = all_x[0]
-        axes_match = all(np.allclose(x, x_ref, atol=0.01) for x in all_x)
-
-        if not axes_match:
-            self.stage_log("Interpolating to common axis...")
-            common_min = max(x.min() for x in all_x)
-            common_max = min(x.max() for x in all_x)
-            common_x = np.linspace(common_min, common_max, 2000)
-            all_y_interp = []
-            for x, y in zip(all_x, all_y):
-                f = interp1d(x, y, kind='linear', fill_value='extrapolate')
-                all_y_interp.append(f(common_x))
-            spectral_matrix = np.array(all_y_interp)
-            raman_axis = common_x
-        else:
-            spectral_matrix = np.array(all_y)
-            raman_axis = x_ref
-
-        mean_spectrum = np.mean(spectral_matrix, axis=0)
-        std_spectrum = np.std(spectral_matrix, axis=0)
-        median_spectrum = np.median(spectral_matrix, axis=0)
-
-        with np.errstate(divide='ignore', invalid='ignore'):
-            cv_spectrum = np.where(
-                np.abs(mean_spectrum) > 1e-10,
-                std_spectrum / np.abs(mean_spectrum),
-                0
-            )
-
-        self.scan_analysis_progress.setValue(75)
-        QtWidgets.QApplication.processEvents()
-
-        # ---- Peaks ----
-        peaks_idx, props = find_peaks(
-            mean_spectrum,
-            prominence=PEAK_PROMINENCE,
-            width=PEAK_MIN_WIDTH
-        )
-
-        if len(peaks_idx) > 0:
-            peak_positions = raman_axis[peaks_idx]
-            self.stage_log(f"Peaks: {', '.join(f'{p:.0f}' for p in peak_positions)}")
-        else:
-            peak_positions = np.array([])
-            self.stage_log("No peaks detected")
-
         # ---- Show mean spectrum in main plot ----
+        raman_axis = result['raman_axis']
+        mean_spectrum = result['mean_spectrum']
+        peaks_idx = result['peaks_idx']
         self.current_spectrum_1 = mean_spectrum.copy()
         self.original_spectrum = mean_spectrum.copy()
-        self.spectral_axis = raman_axis.copy()
+        self.spectral_axis = self.original_axis = raman_axis.copy()
         self.peaks = peaks_idx if len(peaks_idx) > 0 else None
         self.processed_spectrum = mean_spectrum.copy()
         self.cur_spectrum_is_db = True  # treat as external axis
@@ -3202,176 +4648,11 @@ class SpectrometerApp(QtWidgets.QMainWindow):
         self.update_plot(raman_axis, mean_spectrum, zoom=True)
         self.plot_widget.setTitle(
             f"Mean SERS — {os.path.basename(scan_folder)} "
-            f"(n={spectral_matrix.shape[0]})"
+            f"(n={result['spectral_matrix'].shape[0]})"
         )
         self.plot_widget.setLabel('bottom', 'Raman shift (cm<sup>-1</sup>)')
-
-        self.scan_analysis_progress.setValue(80)
-        QtWidgets.QApplication.processEvents()
-
-        # ---- Generate plots with matplotlib (saved to files) ----
-        self.stage_log("Generating analysis plots...")
-
-        axis_label = "Calibrated Raman shift (cm⁻¹)" if calib_coeffs_soft else "Raman shift (cm⁻¹)"
-
-        # Mean spectrum plot
-        try:
-            fig, axes_plt = plt.subplots(3, 1, figsize=(14, 12),
-                                         gridspec_kw={'height_ratios': [3, 1, 1]})
-
-            ax = axes_plt[0]
-            calib_tag = " + calibration" if calib_coeffs_soft else ""
-            ax.set_title(
-                f"Mean SERS — {os.path.basename(scan_folder)} "
-                f"(n={spectral_matrix.shape[0]}, λ={EXCITATION_WAVELENGTH} nm{calib_tag})"
-            )
-
-            for i in range(spectral_matrix.shape[0]):
-                ax.plot(raman_axis, spectral_matrix[i],
-                        color='lightblue', alpha=0.3, linewidth=0.5)
-
-            ax.fill_between(raman_axis,
-                            mean_spectrum - std_spectrum,
-                            mean_spectrum + std_spectrum,
-                            alpha=0.3, color='steelblue', label='Mean ± 1 SD')
-            ax.plot(raman_axis, mean_spectrum, 'b-', linewidth=1.5, label='Mean')
-            ax.plot(raman_axis, median_spectrum, 'g--', linewidth=1, alpha=0.7, label='Median')
-
-            if len(peaks_idx) > 0:
-                ax.plot(peak_positions, mean_spectrum[peaks_idx], 'rv', markersize=6, label='Peaks')
-                for pos, inten in zip(peak_positions, mean_spectrum[peaks_idx]):
-                    ax.annotate(f'{pos:.0f}', xy=(pos, inten),
-                                xytext=(0, 10), textcoords='offset points',
-                                fontsize=8, ha='center', color='red')
-
-            ax.set_xlabel(axis_label)
-            ax.set_ylabel("Normalized intensity")
-            ax.legend(loc='upper right')
-            ax.grid(True, alpha=0.3)
-
-            axes_plt[1].set_title("Standard Deviation")
-            axes_plt[1].fill_between(raman_axis, 0, std_spectrum, alpha=0.5, color='orange')
-            axes_plt[1].plot(raman_axis, std_spectrum, 'darkorange', linewidth=0.8)
-            axes_plt[1].set_xlabel(axis_label)
-            axes_plt[1].set_ylabel("SD")
-            axes_plt[1].grid(True, alpha=0.3)
-
-            axes_plt[2].set_title("Coefficient of Variation")
-            axes_plt[2].fill_between(raman_axis, 0, cv_spectrum, alpha=0.5, color='salmon')
-            axes_plt[2].plot(raman_axis, cv_spectrum, 'darkred', linewidth=0.8)
-            axes_plt[2].set_xlabel(axis_label)
-            axes_plt[2].set_ylabel("CV")
-            axes_plt[2].set_ylim(0, min(float(np.percentile(cv_spectrum, 99)), 5.0))
-            axes_plt[2].grid(True, alpha=0.3)
-
-            plt.tight_layout()
-            fig.savefig(os.path.join(scan_folder, "mean_sers_spectrum.png"), dpi=200, bbox_inches='tight')
-            plt.close(fig)
-            self.stage_log("Saved: mean_sers_spectrum.png")
-        except Exception as e:
-            self.stage_log(f"Plot generation failed: {e}")
-
-        self.scan_analysis_progress.setValue(90)
-        QtWidgets.QApplication.processEvents()
-
-        # ---- Export CSV ----
-        try:
-            results_df = pd.DataFrame({
-                'raman_shift_cm-1': raman_axis,
-                'mean_intensity': mean_spectrum,
-                'std': std_spectrum,
-                'median_intensity': median_spectrum,
-                'cv': cv_spectrum,
-            })
-            results_df.to_csv(os.path.join(scan_folder, "mean_sers_spectrum_stats.csv"), index=False)
-
-            if len(peaks_idx) > 0:
-                peaks_df = pd.DataFrame({
-                    'peak_raman_shift_cm-1': peak_positions,
-                    'peak_intensity': mean_spectrum[peaks_idx],
-                    'prominence': props.get('prominences', np.full(len(peaks_idx), np.nan)),
-                })
-                peaks_df.to_csv(os.path.join(scan_folder, "mean_sers_peaks.csv"), index=False)
-
-            point_names = [data['point_name'] for data in filtered.values()]
-            matrix_df = pd.DataFrame({'raman_shift_cm-1': raman_axis})
-            for i, pn in enumerate(point_names):
-                matrix_df[pn] = spectral_matrix[i]
-            matrix_df.to_csv(os.path.join(scan_folder, "processed_spectra_matrix.csv"), index=False)
-
-            # QC table
-            qc_rows = []
-            for name, data in spectra.items():
-                status = "PASSED" if name in filtered else (
-                    "SATURATED" if name in rejected_sat else "FLAT"
-                )
-                qc_rows.append({
-                    'file': name,
-                    'point_name': data['point_name'],
-                    'intensity_max': float(np.max(data['intensity'])),
-                    'status': status,
-                })
-            pd.DataFrame(qc_rows).to_csv(os.path.join(scan_folder, "qc_summary.csv"), index=False)
-
-            # Metadata
-            with open(os.path.join(scan_folder, "postprocessing_parameters.txt"), "w") as f:
-                f.write(f"SCAN_FOLDER={os.path.abspath(scan_folder)}\n")
-                f.write(f"EXCITATION_WAVELENGTH={EXCITATION_WAVELENGTH}\n")
-                f.write(f"USE_CORRECTED={USE_CORRECTED}\n")
-                f.write(f"CROP_REGION={CROP_REGION}\n")
-                f.write(f"SAVGOL_WINDOW={SAVGOL_WINDOW}\n")
-                f.write(f"SAVGOL_POLYORDER={SAVGOL_POLYORDER}\n")
-                f.write(f"USE_SOFTWARE_CALIBRATION={USE_SOFTWARE_CALIBRATION}\n")
-                f.write(f"CALIBRATION_COEFFS={calib_coeffs_soft}\n")
-                f.write(f"N_TOTAL={len(spectra)}\n")
-                f.write(f"N_PASSED={len(filtered)}\n")
-                f.write(f"N_PEAKS={len(peaks_idx)}\n")
-
-            self.stage_log("All CSV exports saved")
-        except Exception as e:
-            self.stage_log(f"Export failed: {e}")
-
-        self.scan_analysis_progress.setValue(100)
         self.stage_log(f"=== Post-processing COMPLETE: {scan_folder} ===")
 
-    def _validate_sg(self, window, polyorder, n_points):
-        window = int(window)
-        polyorder = int(polyorder)
-        if window < 3:
-            window = 3
-        if window % 2 == 0:
-            window += 1
-        if window >= n_points:
-            window = n_points - 1 if n_points % 2 == 0 else n_points
-            if window % 2 == 0:
-                window -= 1
-        if window < 3:
-            window = 3
-        if polyorder >= window:
-            polyorder = max(1, window - 1)
-        return window, polyorder
-
-    def _build_rp_asls_obj(self, lam=1e5, p=0.01, niter=10):
-        cls = rp.preprocessing.baseline.ASLS
-        sig = inspect_module.signature(cls.__init__)
-        params = sig.parameters
-        kwargs = {}
-        if 'lam' in params:
-            kwargs['lam'] = lam
-        elif 'lambda_' in params:
-            kwargs['lambda_'] = lam
-        if 'p' in params:
-            kwargs['p'] = p
-        if 'niter' in params:
-            kwargs['niter'] = niter
-        elif 'n_iter' in params:
-            kwargs['n_iter'] = niter
-        return cls(**kwargs)
-
-
-
-
-
     def _stage_return_home_from_sequence(self, stroke_sequence):
         self.stage_log("=== Returning home (retracing path) ===")
 
@@ -3417,6 +4698,7 @@ class SpectrometerApp(QtWidgets.QMainWindow):
 
 if __name__ == "__main__":
     app = QtWidgets.QApplication(sys.argv)
+    STARTUP.mark('QApplication')
     window = SpectrometerApp()
     window.show()
     sys.exit(app.exec_())
@@ -0,0 +1,645 @@
+import collections
+import math
+import os
+import threading
+import time
+
+import numpy as np
+
+
+N_PIXELS = 2048
+FRAME_HEAD_LEN = 5
+
+
+Frame = collections.namedtuple("Frame", ["index", "timestamp", "data"])
+
+
+MAX_PAYLOAD_LEN = 8192
+CRC_PROBE_FRAMES = 3
+_HEAD_MAGIC = b'\x81\x01'
+
+
+def frame_checksum(payload):
+    # 16-bit additive checksum over the payload bytes, summed in one numpy pass
+    return int(np.frombuffer(payload, dtype=np.uint8).sum(dtype=np.uint32)) & 0xFFFF
+
+
+class FrameReader:
+    # Streaming parser for 0x81/0x01 spectral frames. Bytes are read into a
+    # preallocated buffer, scanned for a valid header and checked against the
+    # trailing checksum; on a bad header or checksum only one byte is dropped
+    # and the scan continues, so a glitch costs the corrupt bytes rather than
+    # a whole frame period.
+    #
+    # A device using another checksum scheme fails every frame. If no frame
+    # has matched yet and CRC_PROBE_FRAMES well-formed frames in a row fail,
+    # each starting right where the previous one ended (no resync between
+    # them), checking is switched off and crc_auto_disabled is set. The
+    # failing frames are still dropped. reset() switches checking back on,
+    # so the next connection is probed again.
+    #
+    # Decoded pixels are copied into a rotating pool of uint16 arrays. The
+    # returned array stays valid until the pool wraps around (pool_size frames
+    # later); copy it if it has to live longer.
+
+    def __init__(self, pool_size=4, verify_crc=True):
+        self.pool_size = pool_size
+        self.verify_crc = verify_crc
+        self.crc_auto_disabled = False
+        self._buf = bytearray(2 * (FRAME_HEAD_LEN + MAX_PAYLOAD_LEN + 2))
+        self._mv = memoryview(self._buf)
+        self._start = 0
+        self._end = 0
+        self._pixels = [np.empty(N_PIXELS, dtype=np.uint16) for _ in range(pool_size)]
+        self._next = 0
+        self._in_sync = True
+        # Stream offset of _start, and where the last well-formed frame ended
+        self._offset = 0
+        self._frame_end = None
+        self._crc_failed_run = 0
+        # Optional LatencyMonitor: header wait, payload read and decode times
+        self.latency = None
+        # Host wall-clock time at which the last returned frame's header was found
+        self.header_time = None
+        self.reset_stats()
+
+    def reset(self, recheck_crc=True):
+        # Drop buffered bytes, e.g. after the port input buffer was flushed.
+        # Unless recheck_crc is False, checksum checking that was switched
+        # off automatically is switched back on and probed again.
+        self._start = 0
+        self._end = 0
+        self._in_sync = True
+        self._frame_end = None
+        self._crc_failed_run = 0
+        if recheck_crc and self.crc_auto_disabled:
+            self.verify_crc = True
+            self.crc_auto_disabled = False
+            self._crc_ok_frames = 0
+
+    def reset_stats(self):
+        self.frames = 0
+        self.corrupt_frames = 0
+        self.resyncs = 0
+        self.bytes_discarded = 0
+        self._crc_ok_frames = 0
+
+    def buffered(self):
+        return self._end - self._start
+
+    def _discard(self, n):
+        if n <= 0:
+            return
+        if self._in_sync:
+            self.resyncs += 1
+            self._in_sync = False
+        self.bytes_discarded += n
+        self._start += n
+        self._offset += n
+
+    def _fill(self, port, need):
+        # Make sure at least `need` bytes are buffered; False on timeout/cancel
+        while self._end - self._start < need:
+            if self._end + need > len(self._buf):
+                avail = self._end - self._start
+                self._mv[:avail] = self._mv[self._start:self._end]
+                self._start = 0
+                self._end = avail
+            want = need - (self._end - self._start)
+            try:
+                waiting = port.in_waiting
+            except Exception:
+                waiting = 0
+            want = max(want, min(waiting, len(self._buf) - self._end))
+            n = port.readinto(self._mv[self._end:self._end + want]) or 0
+            self._end += n
+            if n < want and self._end - self._start < need:
+                return False
+        return True
+
+    def read(self, port):
+        # Returns (data, error): data is a uint16 array of N_PIXELS or None.
+        buf = self._buf
+        t0 = time.perf_counter()
+        while True:
+            if not self._fill(port, FRAME_HEAD_LEN):
+                return None, f"Timeout waiting for head ({self.buffered()} bytes buffered)"
+            idx = buf.find(_HEAD_MAGIC, self._start, self._end)
+            if idx < 0:
+                # A trailing 0x81 may be the first byte of the next header
+                keep = 1 if buf[self._end - 1] == 0x81 else 0
+                self._discard(self._end - self._start - keep)
+                continue
+            self._discard(idx - self._start)
+            if not self._fill(port, FRAME_HEAD_LEN):
+                return None, f"Timeout waiting for head ({self.buffered()} bytes buffered)"
+
+            s = self._start
+            length = (buf[s + 2] << 8) | buf[s + 3]
+            if buf[s + 4] != 0x00 or not N_PIXELS * 2 <= length <= MAX_PAYLOAD_LEN:
+                self._discard(1)
+                continue
+            total = FRAME_HEAD_LEN + length + 2
+            t1 = time.perf_counter()
+            header_time = time.time()
+            if not self._fill(port, total):
+                return None, f"Incomplete data: expected {length + 2}, got {self.buffered() - FRAME_HEAD_LEN}"
+            t2 = time.perf_counter()
+
+            s = self._start
+            payload = s + FRAME_HEAD_LEN
+            if self.verify_crc:
+                crc_received = (buf[s + total - 2] << 8) | buf[s + total - 1]
+                if frame_checksum(self._mv[payload:payload + length]) != crc_received:
+                    self.corrupt_frames += 1
+                    back_to_back = self._offset == self._frame_end
+                    self._crc_failed_run = self._crc_failed_run + 1 if back_to_back else 1
+                    self._frame_end = self._offset + total
+                    if self._crc_ok_frames == 0 and self._crc_failed_run >= CRC_PROBE_FRAMES:
+                        # Clean consecutive frames that never match: the device
+                        # uses another checksum scheme, stop rejecting its frames
+                        self.verify_crc = False
+                        self.crc_auto_disabled = True
+                    self._discard(1)
+                    continue
+                self._crc_ok_frames += 1
+
+            slot = self._next
+            pixels = self._pixels[slot]
+            np.copyto(pixels, np.frombuffer(buf, dtype='>u2', count=N_PIXELS, offset=payload))
+            self._next = (slot + 1) % self.pool_size
+            self._start += total
+            self._offset += total
+            self._frame_end = self._offset
+            self._in_sync = True
+            self.frames += 1
+            self.header_time = header_time
+            if self.latency is not None:
+                # Header wait includes any resync work before the valid header
+                t3 = time.perf_counter()
+                self.latency.record('header_wait', t1 - t0)
+                self.latency.record('payload_read', t2 - t1)
+                self.latency.record('decode', t3 - t2)
+            return pixels, None
+
+
+class FrameRingBuffer:
+    def __init__(self, capacity=64):
+        self._frames = collections.deque(maxlen=capacity)
+        self._lock = threading.Lock()
+        self.capacity = capacity
+        self.pushed = 0
+        self.overwritten = 0
+
+    def push(self, frame):
+        # Returns the number of queued frames (1 means the ring was empty)
+        with self._lock:
+            if len(self._frames) == self.capacity:
+                self.overwritten += 1
+            self._frames.append(frame)
+            self.pushed += 1
+            return len(self._frames)
+
+    def pop_all(self):
+        with self._lock:
+            frames = list(self._frames)
+            self._frames.clear()
+        return frames
+
+    def clear(self):
+        with self._lock:
+            self._frames.clear()
+            self.pushed = 0
+            self.overwritten = 0
+
+    def __len__(self):
+        with self._lock:
+            return len(self._frames)
+
+
+class AcquisitionStats:
+    def __init__(self):
+        self.frames_read = 0
+        self.dropped = 0
+        self.last_error = None
+        self.started = time.time()
+
+    def rate(self):
+        elapsed = time.time() - self.started
+        return self.frames_read / elapsed if elapsed > 0 else 0.0
+
+
+class GapDetector:
+    # Finds missing frames in an externally triggered stream from host
+    # timestamps (frame headers carry no counter). Frames are assigned to
+    # trigger slots on a line fitted through timestamp vs slot number; a
+    # frame landing more than one slot ahead of the previous one means
+    # frames were missed. Host delivery can be late but never early, so a
+    # frame that arrives before its predicted slot retracts the gap just
+    # counted (it was a late delivery, not a loss). With no period given it
+    # is estimated from the median of the first `warmup` intervals and then
+    # refined by the fit.
+
+    def __init__(self, period=None, warmup=16, max_events=1000):
+        self.fixed_period = period
+        self.warmup = warmup
+        self.events = collections.deque(maxlen=max_events)
+        self.reset()
+
+    def reset(self):
+        self.period = self.fixed_period
+        self.frames = 0
+        self.gaps = 0
+        self.missed = 0
+        self.late = 0
+        self.last = None
+        self.max_interval = 0.0
+        self.events.clear()
+        self._origin = None
+        self._slot = 0
+        self._unconfirmed = 0
+        self._warmup = []
+        # Running fit of (slot, time since origin) and interval statistics
+        self._fn = 0
+        self._mx = 0.0
+        self._my = 0.0
+        self._cxx = 0.0
+        self._cxy = 0.0
+        self._n = 0
+        self._mean = 0.0
+        self._m2 = 0.0
+
+    def _fit_add(self, x, y):
+        self._fn += 1
+        dx = x - self._mx
+        self._mx += dx / self._fn
+        self._my += (y - self._my) / self._fn
+        self._cxx += dx * (x - self._mx)
+        self._cxy += dx * (y - self._my)
+        if self.fixed_period is None and self._fn > self.warmup and self._cxx > 0:
+            self.period = self._cxy / self._cxx
+
+    def update(self, timestamp):
+        # Returns the number of frames missed just before this one; negative
+        # when it retracts a gap that turned out to be a late delivery
+        self.frames += 1
+        last = self.last
+        self.last = timestamp
+        if last is None:
+            self._origin = timestamp
+            self._fit_add(0, 0.0)
+            return 0
+        dt = timestamp - last
+        if dt > self.max_interval:
+            self.max_interval = dt
+        y = timestamp - self._origin
+        if self.period is None:
+            self._slot += 1
+            self._fit_add(self._slot, y)
+            self._warmup.append(dt)
+            if len(self._warmup) >= self.warmup:
+                self.period = sorted(self._warmup)[len(self._warmup) // 2]
+                self._warmup = []
+            return 0
+
+        expected = self._slot + 1
+        k = int(round(self._mx + (y - self._my) / self.period))
+        missed = 0
+        if k > expected:
+            missed = k - expected
+            self.gaps += 1
+            self.missed += missed
+            self._unconfirmed += missed
+            self.events.append((timestamp, missed, dt))
+            self._slot = k
+        elif k < expected and self._unconfirmed:
+            undo = min(expected - k, self._unconfirmed)
+            self.missed -= undo
+            self._unconfirmed -= undo
+            self.late += 1
+            if self._unconfirmed == 0:
+                self.gaps -= 1
+                if self.events:
+                    self.events.pop()
+            self._slot = expected - undo
+            missed = -undo
+        else:
+            self._slot = expected
+            if k == expected:
+                self._unconfirmed = 0
+                self._fit_add(self._slot, y)
+                # Interval statistics (jitter) over on-phase frames only
+                self._n += 1
+                delta = dt - self._mean
+                self._mean += delta / self._n
+                self._m2 += delta * (dt - self._mean)
+        return missed
+
+    def jitter(self):
+        return math.sqrt(self._m2 / (self._n - 1)) if self._n > 1 else 0.0
+
+    def summary(self):
+        return {
+            'frames': self.frames,
+            'gaps': self.gaps,
+            'missed': self.missed,
+            'late': self.late,
+            'period_ms': 1000.0 * self.period if self.period else 0.0,
+            'jitter_ms': 1000.0 * self.jitter(),
+            'max_interval_ms': 1000.0 * self.max_interval,
+        }
+
+
+RECORDING_MAGIC = b'RAMANREC'
+RECORDING_VERSION = 1
+RECORDING_HEADER_DTYPE = np.dtype([
+    ('magic', 'S8'),
+    ('version', '<u4'),
+    ('n_pixels', '<u4'),
+    ('record_size', '<u4'),
+    ('reserved0', '<u4'),
+    ('n_frames', '<u8'),
+    ('created', '<f8'),
+    ('reserved', 'V24'),
+])
+
+
+def recording_record_dtype(n_pixels=N_PIXELS):
+    return np.dtype([
+        ('timestamp', '<f8'),
+        ('integration_time', '<u4'),
+        ('gain', '<u2'),
+        ('offset', '<i2'),
+        ('average', '<u2'),
+        ('laser_mv', '<u2'),
+        ('pixels', '<u2', (n_pixels,)),
+    ])
+
+
+class FrameRecorder:
+    # Appends raw uint16 frames with timestamp and acquisition parameters to
+    # a memory-mapped file. The file is preallocated in chunks and grown as
+    # needed; the header frame count is updated after every frame and the
+    # file is trimmed to the recorded size on close.
+
+    def __init__(self, path, n_pixels=N_PIXELS, chunk_frames=1024):
+        self.path = path
+        self.n_pixels = n_pixels
+        self.chunk_frames = chunk_frames
+        self.record_dtype = recording_record_dtype(n_pixels)
+        self.n_frames = 0
+        self._lock = threading.Lock()
+        self._closed = False
+
+        with open(path, 'wb') as f:
+            f.truncate(RECORDING_HEADER_DTYPE.itemsize)
+        header = np.memmap(path, dtype=RECORDING_HEADER_DTYPE, mode='r+', shape=(1,))
+        header['magic'] = RECORDING_MAGIC
+        header['version'] = RECORDING_VERSION
+        header['n_pixels'] = n_pixels
+        header['record_size'] = self.record_dtype.itemsize
+        header['n_frames'] = 0
+        header['created'] = time.time()
+        header.flush()
+        del header
+        self._header = None
+        self._records = None
+        self.capacity = 0
+        self._grow()
+
+    def _grow(self):
+        # All maps are dropped before resizing (required on Windows)
+        if self._records is not None:
+            self._records.flush()
+            self._header.flush()
+        self._records = None
+        self._header = None
+        self.capacity += self.chunk_frames
+        with open(self.path, 'r+b') as f:
+            f.truncate(RECORDING_HEADER_DTYPE.itemsize + self.capacity * self.record_dtype.itemsize)
+        self._header = np.memmap(self.path, dtype=RECORDING_HEADER_DTYPE, mode='r+', shape=(1,))
+        self._records = np.memmap(
+            self.path, dtype=self.record_dtype, mode='r+',
+            offset=RECORDING_HEADER_DTYPE.itemsize, shape=(self.capacity,)
+        )
+
+    def append(self, data, timestamp, params):
+        # params: (integration_time, gain, offset, average, laser_mv)
+        with self._lock:
+            if self._closed:
+                return False
+            if self.n_frames == self.capacity:
+                self._grow()
+            rec = self._records[self.n_frames]
+            rec['timestamp'] = timestamp
+            (rec['integration_time'], rec['gain'], rec['offset'],
+             rec['average'], rec['laser_mv']) = params
+            rec['pixels'] = data
+            self.n_frames += 1
+            self._header['n_frames'] = self.n_frames
+            return True
+
+    def close(self):
+        with self._lock:
+            if self._closed:
+                return
+            self._closed = True
+            self._records.flush()
+            self._header.flush()
+            self._records = None
+            self._header = None
+            with open(self.path, 'r+b') as f:
+                f.truncate(RECORDING_HEADER_DTYPE.itemsize + self.n_frames * self.record_dtype.itemsize)
+
+
+class Recording:
+    # Lazy read-only view of a FrameRecorder file: `frames` is an
+    # (n_frames, n_pixels) uint16 array backed by the file, not loaded in RAM.
+
+    def __init__(self, path):
+        self.path = path
+        header = np.fromfile(path, dtype=RECORDING_HEADER_DTYPE, count=1)
+        if len(header) != 1 or header['magic'][0] != RECORDING_MAGIC:
+            raise ValueError(f"Not a frame recording: {path}")
+        self.header = header[0]
+        self.n_pixels = int(self.header['n_pixels'])
+        self.record_dtype = recording_record_dtype(self.n_pixels)
+        self.created = float(self.header['created'])
+        # Trust the file size over the header if the recorder was not closed cleanly
+        body = os.path.getsize(path) - RECORDING_HEADER_DTYPE.itemsize
+        self.n_frames = min(int(self.header['n_frames']), body // self.record_dtype.itemsize)
+        if self.n_frames:
+            self.records = np.memmap(
+                path, dtype=self.record_dtype, mode='r',
+                offset=RECORDING_HEADER_DTYPE.itemsize, shape=(self.n_frames,)
+            )
+        else:
+            self.records = np.zeros(0, dtype=self.record_dtype)
+
+    @property
+    def frames(self):
+        return self.records['pixels']
+
+    @property
+    def timestamps(self):
+        return self.records['timestamp']
+
+    def params(self, index):
+        rec = self.records[index]
+        return {
+            'integration_time': int(rec['integration_time']),
+            'gain': int(rec['gain']),
+            'offset': int(rec['offset']),
+            'average': int(rec['average']),
+            'laser_mv': int(rec['laser_mv']),
+        }
+
+    def __len__(self):
+        return self.n_frames
+
+
+def open_recording(path):
+    return Recording(path)
+
+
+# GET integration time (0x0A) is answered with command byte 0x02
+REPLY_CMD = {0x0A: 0x02}
+CALIB_REPLY_LEN = 71
+
+
+def command_packet(cmd, d1=0, d2=0):
+    pkt = bytearray([0x81, cmd, d1 & 0xFF, d2 & 0xFF])
+    pkt.append(sum(pkt) & 0xFF)
+    return pkt
+
+
+class CommandChannel:
+    # Request/reply layer for the short 0x81 command protocol. A request
+    # returns as soon as its reply (matched by command byte) has arrived
+    # instead of after a fixed sleep; spectral frames and stray bytes in
+    # front of it are skipped, and replies that belong to another queued
+    # request are kept for it, so set/get sequences can be written back to
+    # back with pipeline(). The timeout only matters when the device stays
+    # silent.
+
+    def __init__(self, port, poll_interval=0.0005):
+        self.port = port
+        self.poll_interval = poll_interval
+        self.latency = None
+        self._buf = bytearray()
+        self._replies = collections.defaultdict(collections.deque)
+        self._expected = {}
+        self._outstanding = collections.Counter()
+        self.timeouts = 0
+        self.bytes_skipped = 0
+
+    def reset(self):
+        self._buf.clear()
+        self._replies.clear()
+        self._expected.clear()
+        self._outstanding.clear()
+
+    def write(self, packet):
+        t0 = time.perf_counter()
+        self.port.write(packet)
+        if self.latency is not None:
+            self.latency.record('command_send', time.perf_counter() - t0)
+
+    def send(self, cmd, d1=0, d2=0):
+        pkt = command_packet(cmd, d1, d2)
+        self.write(pkt)
+        return pkt
+
+    def request(self, cmd, d1=0, d2=0, reply_cmd=None, reply_len=5, timeout=1.0):
+        if reply_cmd is None:
+            reply_cmd = REPLY_CMD.get(cmd, cmd)
+        self._expect(reply_cmd, reply_len)
+        self.send(cmd, d1, d2)
+        return self._collect(reply_cmd, timeout)
+
+    def pipeline(self, requests, timeout=1.0):
+        # requests: (cmd, d1, d2, reply_cmd) with reply_cmd None for commands
+        # without a reply. All packets go out in one write; returns one reply
+        # (or None) per request, in order.
+        out = bytearray()
+        for cmd, d1, d2, reply_cmd in requests:
+            out += command_packet(cmd, d1, d2)
+            if reply_cmd is not None:
+                self._expect(reply_cmd, 5)
+        self.write(out)
+        return [None if reply_cmd is None else self._collect(reply_cmd, timeout)
+                for _, _, _, reply_cmd in requests]
+
+    def wait(self, reply_cmd, reply_len=5, timeout=1.0):
+        # Wait for a reply to a command that was written some other way
+        self._expect(reply_cmd, reply_len)
+        return self._collect(reply_cmd, timeout)
+
+    def _expect(self, reply_cmd, reply_len):
+        self._expected[reply_cmd] = reply_len
+        self._outstanding[reply_cmd] += 1
+
+    def _collect(self, reply_cmd, timeout):
+        queued = self._replies[reply_cmd]
+        deadline = time.perf_counter() + timeout
+        try:
+            return self._poll(queued, deadline)
+        finally:
+            self._outstanding[reply_cmd] -= 1
+            if self._outstanding[reply_cmd] <= 0:
+                del self._outstanding[reply_cmd]
+                self._expected.pop(reply_cmd, None)
+                queued.clear()
+
+    def _poll(self, queued, deadline):
+        while True:
+            self._scan()
+            if queued:
+                return queued.popleft()
+            if time.perf_counter() >= deadline:
+                self.timeouts += 1
+                return None
+            try:
+                waiting = self.port.in_waiting
+            except Exception:
+                waiting = 0
+            if waiting:
+                self._buf += self.port.read(waiting)
+            else:
+                time.sleep(self.poll_interval)
+
+    def _skip(self, n):
+        self.bytes_skipped += n
+        del self._buf[:n]
+
+    def _scan(self):
+        buf = self._buf
+        while buf:
+            idx = buf.find(b'\x81')
+            if idx < 0:
+                self._skip(len(buf))
+                return
+            self._skip(idx)
+            if len(buf) < 5:
+                return
+            cmd = buf[1]
+            if cmd == 0x01 and buf[4] == 0x00:
+                # Spectral frame: drop it whole so pixel bytes cannot pose as a reply
+                length = (buf[2] << 8) | buf[3]
+                if N_PIXELS * 2 <= length <= MAX_PAYLOAD_LEN:
+                    if len(buf) < FRAME_HEAD_LEN + length + 2:
+                        return
+                    self._skip(FRAME_HEAD_LEN + length + 2)
+                    continue
+            n = self._expected.get(cmd, 5)
+            if n == 5 and (buf[0] + buf[1] + buf[2] + buf[3]) & 0xFF != buf[4]:
+                self._skip(1)
+                continue
+            if len(buf) < n:
+                return
+            if cmd in self._expected:
+                self._replies[cmd].append(bytes(buf[:n]))
+                del buf[:n]
+            else:
+                # Well-formed but unsolicited reply
+                self._skip(n)
@@ -0,0 +1,661 @@
+import collections
+import glob
+import os
+import re
+
+import numpy as np
+
+from processing import ProcessingChain, SavGolFilter
+
+# ramanspy, pandas and scipy cost several seconds to import; they are
+# imported by the functions that use them so that importing this module
+# (from the GUI or `cli.py acquire`) stays cheap.
+
+
+SEARCH_METRICS = ('sad', 'sid', 'mae', 'mse', 'iur')
+
+# Defaults match the Process Spectra panel
+SEARCH_DEFAULTS = {
+    'min_overlap': 3000.0,
+    'peak_prominence': 0.1,
+    'peak_width': 2.0,
+    'iur_prominence': 0.1,
+    'iur_width': 2.0,
+    'iur_tol': 30.0,
+    'process_db': True,
+}
+
+# Defaults match the Scan Post-Processing panel
+SCAN_DEFAULTS = {
+    'excitation': 785,
+    'use_calibration': True,
+    'use_corrected': True,
+    'crop_min': 200,
+    'crop_max': 3200,
+    'savgol_window': 7,
+    'savgol_polyorder': 3,
+    'saturation': 60000,
+    'saturation_fraction': 0.05,
+    'flat_threshold': 2.0,
+    'peak_prominence': 0.05,
+    'peak_min_width': 2,
+}
+
+
+def wavelength_to_raman(wavelengths, excitation, calib_coeffs=None):
+    # Same conversion as ramanspy.utils.wavelength_to_wavenumber
+    shifts = 1e7 / excitation - 1e7 / np.asarray(wavelengths, dtype=np.float64)
+    if calib_coeffs:
+        a, b, c = calib_coeffs[:3]
+        shifts = a * shifts**2 + b * shifts + c
+    return shifts
+
+
+def load_calibration(path):
+    # [a, b, c] written one per line (or as a row) without a header
+    return np.loadtxt(path, delimiter=',', ndmin=1).flatten()[:3].tolist()
+
+
+def load_database(path):
+    import pickle
+    with open(path, "rb") as f:
+        specdict = pickle.load(f)
+    if not isinstance(specdict, dict):
+        raise ValueError("Loaded file does not contain a dictionary")
+    return specdict
+
+
+def load_spectrum_csv(path):
+    # Two-column CSV with a header row, as written by Save Data and scans
+    import pandas as pd
+    df = pd.read_csv(path)
+    return df.iloc[:, 0].values.astype(np.float64), df.iloc[:, 1].values.astype(np.float64)
+
+
+# Same attributes as a ramanspy SpectralContainer (spectral_data is 2-D)
+Processed = collections.namedtuple('Processed', 'spectral_axis spectral_data')
+
+
+def process_spectrum(spectrum, axis, params):
+    chain = ProcessingChain(axis, **params)
+    return Processed(chain.axis, chain.apply(np.atleast_2d(spectrum)))
+
+
+def group_by_axis(axes):
+    # {axis bytes: (axis, [indices])} in first-seen order
+    groups = collections.OrderedDict()
+    for i, axis in enumerate(axes):
+        axis = np.asarray(axis, dtype=np.float64)
+        groups.setdefault(axis.tobytes(), (axis, []))[1].append(i)
+    return groups
+
+
+def process_spectra(axes, spectra, params, log=None, chunk_rows=1024):
+    # Preprocesses many spectra: those sharing an axis are stacked and run
+    # through one compiled chain as a matrix, `chunk_rows` at a time.
+    # Returns a Processed (or None where the chain does not apply to that
+    # axis) per input, in order.
+    out = [None] * len(spectra)
+    for axis, rows in group_by_axis(axes).values():
+        try:
+            chain = ProcessingChain(axis, **params)
+        except ValueError as e:
+            if log is not None:
+                log(f"Skipping {len(rows)} spectra on a {len(axis)}-point axis: {e}")
+            continue
+        for start in range(0, len(rows), chunk_rows):
+            chunk = rows[start:start + chunk_rows]
+            processed = chain.apply(np.array([np.ravel(spectra[i]) for i in chunk], dtype=np.float64))
+            for i, row in zip(chunk, processed):
+                out[i] = Processed(chain.axis, row[np.newaxis])
+    return out
+
+
+def spectrum_peaks(robj, prominence, width):
+    return find_spectrum_peaks(robj.spectral_data[0], robj.spectral_axis, prominence, width)
+
+
+def find_spectrum_peaks(spectrum, axis, prominence, width):
+    from scipy.signal import find_peaks
+    peaks, props = find_peaks(spectrum, prominence=prominence, width=int(width))
+    return peaks, axis[peaks]
+
+
+def preprocess_database(specdict, processing, log=print):
+    # Processed (or None) per database entry, in specdict order
+    entries = list(specdict.values())
+    return process_spectra(
+        [d['spectrum'].spectral_axis for d in entries],
+        [d['spectrum'].spectral_data for d in entries],
+        processing, log=log,
+    )
+
+
+def search_database(robj, specdict, nleads=10, metric='sad', params=None, processing=None,
+                    processed=None, progress=None, log=print):
+    # progress(i, total) is called per entry and returns True to cancel.
+    # With process_db set, database spectra are first run through the
+    # `processing` chain (ProcessingChain keyword arguments) in batches,
+    # unless `processed` already holds preprocess_database() output.
+    import pandas as pd
+    import ramanspy as rp
+    from scipy.interpolate import interp1d
+    from scipy.signal import find_peaks
+
+    p = dict(SEARCH_DEFAULTS)
+    if params:
+        p.update(params)
+    results = []
+    sres = []
+    i = 0
+    total_items = len(specdict)
+    if p['process_db'] and processed is None and processing is not None:
+        if progress is not None and progress(0, total_items):
+            log("Search canceled by user")
+            return pd.DataFrame()
+        processed = preprocess_database(specdict, processing, log=log)
+    elif not p['process_db'] or processed is None:
+        processed = [d['spectrum'] for d in specdict.values()]
+    for (rbid, d), rspec in zip(specdict.items(), processed):
+        if progress is not None and progress(i, total_items):
+            log("Search canceled by user")
+            return pd.DataFrame()
+        try:
+            name = d['name']
+            url = d['url']
+            ident = d['identifier']
+            if rspec is None:
+                i += 1
+                continue
+            olap = min(robj.spectral_axis.max(), rspec.spectral_axis.max()) - max(robj.spectral_axis.min(), rspec.spectral_axis.min())
+            if olap > p['min_overlap']:
+                common_axis = np.linspace(
+                    max(robj.spectral_axis.min(), rspec.spectral_axis.min()),
+                    min(robj.spectral_axis.max(), rspec.spectral_axis.max()),
+                    2000
+                )
+                if len(common_axis) == 0:
+                    i += 1
+                    continue
+                query_data = robj.spectral_data[0] if robj.spectral_data.ndim > 1 else robj.spectral_data
+                ref_data = rspec.spectral_data[0] if rspec.spectral_data.ndim > 1 else rspec.spectral_data
+                interp1 = interp1d(robj.spectral_axis, query_data, kind='linear', fill_value='extrapolate')
+                interp2 = interp1d(rspec.spectral_axis, ref_data, kind='linear', fill_value='extrapolate')
+                aligned_intensity1 = interp1(common_axis)
+                aligned_intensity2 = interp2(common_axis)
+                if np.any(np.isnan(aligned_intensity1)) or np.any(np.isnan(aligned_intensity2)):
+                    i += 1
+                    continue
+                if np.linalg.norm(aligned_intensity1) == 0 or np.linalg.norm(aligned_intensity2) == 0:
+                    i += 1
+                    continue
+                if metric == 'mae':
+                    s = rp.metrics.MAE(aligned_intensity1, aligned_intensity2)
+                elif metric == 'mse':
+                    s = rp.metrics.MSE(aligned_intensity1, aligned_intensity2)
+                elif metric == 'sad':
+                    s = rp.metrics.SAD(aligned_intensity1, aligned_intensity2)
+                elif metric == 'sid':
+                    s = rp.metrics.SID(aligned_intensity1, aligned_intensity2)
+                elif metric == 'iur':
+                    q_max = np.max(aligned_intensity1)
+                    r_max = np.max(aligned_intensity2)
+                    q = aligned_intensity1 / q_max if q_max > 0 else aligned_intensity1
+                    r = aligned_intensity2 / r_max if r_max > 0 else aligned_intensity2
+                    delta = common_axis[1] - common_axis[0] if len(common_axis) > 1 else 1.0
+                    width_samples_q = p['peak_width'] / delta if delta > 0 else 1.0
+                    width_samples_db = p['iur_width'] / delta if delta > 0 else 1.0
+                    peaks_q_idx = find_peaks(q, prominence=p['peak_prominence'], width=width_samples_q)[0]
+                    peaks_r_idx = find_peaks(r, prominence=p['iur_prominence'], width=width_samples_db)[0]
+                    peaks_q_pos = common_axis[peaks_q_idx]
+                    peaks_r_pos = common_axis[peaks_r_idx]
+                    len_q = len(peaks_q_pos)
+                    len_r = len(peaks_r_pos)
+                    if len_q == 0 and len_r == 0:
+                        s = 0.0
+                    else:
+                        i_p, j_p, matched = 0, 0, 0
+                        while i_p < len_q and j_p < len_r:
+                            if abs(peaks_q_pos[i_p] - peaks_r_pos[j_p]) <= p['iur_tol']:
+                                matched += 1
+                                i_p += 1
+                                j_p += 1
+                            elif peaks_q_pos[i_p] < peaks_r_pos[j_p]:
+                                i_p += 1
+                            else:
+                                j_p += 1
+                        total = len_q + len_r
+                        iou = matched / (total - matched) if (total - matched) != 0 else 0
+                        if matched < 1.0:
+                            iou = 0.0
+                            s = 1.0
+                        else:
+                            s = 1.0 - iou
+                sres.append({
+                    'component': name,
+                    'url': url,
+                    'id': rbid,
+                    'identifier': ident,
+                    'distance_score': s,
+                    'source': 'rbase',
+                    'aligned_intensity_comp': aligned_intensity2,
+                    'spectral_axis_comp': common_axis
+                })
+            i += 1
+        except Exception as e:
+            log(f"Skipping database entry {rbid}: {e}")
+            results.append(None)
+            i += 1
+    if progress is not None:
+        progress(total_items, total_items)
+    if not sres:
+        log("No valid search results found.")
+        return pd.DataFrame()
+    sdf = pd.DataFrame(sres).sort_values('distance_score', ascending=True)[:nleads].reset_index(drop=True)
+    sdf['metric'] = metric
+    return sdf
+
+
+def validate_savgol(window, polyorder, n_points):
+    window = int(window)
+    polyorder = int(polyorder)
+    if window < 3:
+        window = 3
+    if window % 2 == 0:
+        window += 1
+    if window >= n_points:
+        window = n_points - 1 if n_points % 2 == 0 else n_points
+        if window % 2 == 0:
+            window -= 1
+    if window < 3:
+        window = 3
+    if polyorder >= window:
+        polyorder = max(1, window - 1)
+    return window, polyorder
+
+
+# Baseline of the scan post-processing (ramanspy ASLS(lam=1e5, p=0.01))
+SCAN_BASELINE = {'baseline_method': 'asls', 'baseline_lam': 1e5, 'baseline_p': 0.01}
+
+
+def analyze_scan(scan_folder, params=None, calib_coeffs=None, log=print, progress=None):
+    # QC, Raman axis, crop, SavGol + ASLS, min-max normalization, statistics,
+    # peaks, plots and CSV exports for a scan folder written by the scan
+    # program. progress(percent) is called between stages. Returns a dict
+    # with the mean spectrum and statistics, or None when nothing passed.
+    import matplotlib
+    matplotlib.use('Agg')
+    import matplotlib.pyplot as plt
+    import pandas as pd
+    from scipy.interpolate import interp1d
+    from scipy.signal import find_peaks
+
+    p = dict(SCAN_DEFAULTS)
+    if params:
+        p.update(params)
+    progress = progress or (lambda percent: None)
+
+    EXCITATION_WAVELENGTH = p['excitation']
+    USE_SOFTWARE_CALIBRATION = p['use_calibration']
+    USE_CORRECTED = p['use_corrected']
+    CROP_MIN = p['crop_min']
+    CROP_MAX = p['crop_max']
+    CROP_REGION = (CROP_MIN, CROP_MAX) if CROP_MIN < CROP_MAX else None
+    SAVGOL_WINDOW = p['savgol_window']
+    SAVGOL_POLYORDER = p['savgol_polyorder']
+    SATURATION_INTENSITY = p['saturation']
+    SATURATION_PIXEL_FRACTION = p['saturation_fraction']
+    FLAT_CV_THRESHOLD = p['flat_threshold']
+    PEAK_PROMINENCE = p['peak_prominence']
+    PEAK_MIN_WIDTH = p['peak_min_width']
+
+    calib_coeffs_soft = calib_coeffs if USE_SOFTWARE_CALIBRATION else None
+    if calib_coeffs_soft is not None:
+        log(f"Using calibration: {calib_coeffs_soft}")
+    elif USE_SOFTWARE_CALIBRATION:
+        calib_path = "calibration_cur.csv"
+        if os.path.exists(calib_path):
+            try:
+                calib_coeffs_soft = load_calibration(calib_path)
+                log(f"Loaded calibration from {calib_path}: {calib_coeffs_soft}")
+            except Exception as e:
+                log(f"Failed to load calibration: {e}")
+        else:
+            log("No calibration file found, proceeding without")
+
+    log(f"Params: exc={EXCITATION_WAVELENGTH}, crop={CROP_REGION}, "
+        f"SG={SAVGOL_WINDOW}/{SAVGOL_POLYORDER}, calib={calib_coeffs_soft is not None}")
+
+    # ---- Load spectra ----
+    progress(5)
+
+    if USE_CORRECTED:
+        pattern = os.path.join(scan_folder, "pt_*_corrected.csv")
+        files = sorted(glob.glob(pattern))
+        if not files:
+            pattern = os.path.join(scan_folder, "pt_*_raw.csv")
+            files = sorted(glob.glob(pattern))
+            log("No corrected files, using raw")
+    else:
+        pattern = os.path.join(scan_folder, "pt_*_raw.csv")
+        files = sorted(glob.glob(pattern))
+
+    if not files:
+        log("No spectral files found!")
+        return None
+
+    spectra = {}
+    for f in files:
+        try:
+            wl, inten = load_spectrum_csv(f)
+            basename = os.path.basename(f)
+            point_name = re.sub(r'_(corrected|raw)\.csv$', '', basename)
+            spectra[basename] = {
+                'wavelength': wl,
+                'intensity': inten,
+                'point_name': point_name,
+            }
+        except Exception as e:
+            log(f"Error loading {f}: {e}")
+
+    log(f"Loaded {len(spectra)} spectra")
+    progress(15)
+
+    # ---- QC Filtering ----
+    filtered = {}
+    rejected_sat = {}
+    rejected_flat = {}
+
+    # Flat check: smoothed signal span vs residual noise, one matrix per
+    # spectrum length
+    names = list(spectra)
+    flat_scores = dict.fromkeys(names, 999.0)
+    by_length = collections.defaultdict(list)
+    for name in names:
+        by_length[len(spectra[name]['intensity'])].append(name)
+    for n_points, group in by_length.items():
+        if n_points < 7:
+            continue
+        sg_w = min(11, n_points)
+        if sg_w % 2 == 0:
+            sg_w -= 1
+        sg_p = min(3, sg_w - 1)
+        try:
+            y = np.array([spectra[name]['intensity'] for name in group], dtype=np.float64)
+            y_sm = SavGolFilter(sg_w, sg_p).filter(y)
+            noise_std = np.std(y - y_sm, axis=1)
+            signal_span = np.percentile(y_sm, 95, axis=1) - np.percentile(y_sm, 5, axis=1)
+            flat_scores.update(zip(group, signal_span / (noise_std + 1e-12)))
+        except Exception:
+            pass
+
+    for name, data in spectra.items():
+        intensity = data['intensity']
+
+        n_sat = np.sum(intensity >= SATURATION_INTENSITY)
+        sat_frac = n_sat / len(intensity)
+        is_saturated = sat_frac > SATURATION_PIXEL_FRACTION
+
+        flat_score = float(flat_scores[name])
+        is_flat = flat_score < FLAT_CV_THRESHOLD
+
+        if is_saturated:
+            rejected_sat[name] = data
+        elif is_flat:
+            rejected_flat[name] = data
+        else:
+            filtered[name] = data
+
+        log(
+            f"  {data['point_name']}: max={np.max(intensity):.0f} "
+            f"sat={sat_frac*100:.1f}% flat={flat_score:.1f} "
+            f"{'SAT' if is_saturated else 'FLAT' if is_flat else 'OK'}"
+        )
+
+    log(
+        f"QC: {len(filtered)} passed, "
+        f"{len(rejected_sat)} saturated, "
+        f"{len(rejected_flat)} flat"
+    )
+
+    if len(filtered) == 0:
+        log("ALL spectra rejected! Aborting analysis.")
+        return None
+
+    progress(25)
+
+    # ---- Wavelength -> Raman shift ----
+    for name, data in filtered.items():
+        data['ramanshift'] = wavelength_to_raman(data['wavelength'], EXCITATION_WAVELENGTH, calib_coeffs_soft)
+
+    # ---- Crop ----
+    for name, data in filtered.items():
+        if CROP_REGION is not None:
+            mask = (data['ramanshift'] >= CROP_REGION[0]) & (data['ramanshift'] <= CROP_REGION[1])
+            data['ramanshift_cropped'] = data['ramanshift'][mask]
+            data['intensity_cropped'] = data['intensity'][mask]
+        else:
+            data['ramanshift_cropped'] = data['ramanshift']
+            data['intensity_cropped'] = data['intensity']
+
+    progress(35)
+
+    # ---- SavGol + ASLS baseline correction + normalization ----
+    # Points sharing a (cropped) axis are processed together as one matrix
+    log("Applying SavGol smoothing and ASLS baseline correction...")
+
+    items = list(filtered.values())
+    for x, rows in group_by_axis([data['ramanshift_cropped'] for data in items]).values():
+        group = [items[i] for i in rows]
+        y = np.array([data['intensity_cropped'] for data in group], dtype=np.float64)
+
+        sg_w, sg_p = validate_savgol(SAVGOL_WINDOW, SAVGOL_POLYORDER, y.shape[1])
+        # Map points are alike, so the solver starts every point from the
+        # converged weights of the group's median spectrum
+        chain = ProcessingChain(x, savgol=(sg_w, sg_p), warm_start=True, **SCAN_BASELINE)
+        y_smooth = chain.smooth(y)
+
+        try:
+            baseline = chain.baseline(y_smooth)
+        except Exception as e:
+            log(f"  ASLS failed for {len(group)} spectra: {e}, using smoothed")
+            baseline = np.zeros_like(y_smooth)
+        corrected = y_smooth - baseline
+
+        y_min = corrected.min(axis=1, keepdims=True)
+        span = corrected.max(axis=1, keepdims=True) - y_min
+        flat = span < 1e-10
+        normalized = np.where(flat, 0.0, (corrected - y_min) / np.where(flat, 1.0, span))
+
+        for data, b, c, nrm in zip(group, baseline, corrected, normalized):
+            data['baseline'] = b
+            data['intensity_corrected'] = c
+            data['intensity_normalized'] = nrm
+
+    progress(65)
+
+    # ---- Build spectral matrix ----
+    all_x = [data['ramanshift_cropped'] for data in filtered.values()]
+    all_y = [data['intensity_normalized'] for data in filtered.values()]
+
+    x_ref = all_x[0]
+    axes_match = all(np.allclose(x, x_ref, atol=0.01) for x in all_x)
+
+    if not axes_match:
+        log("Interpolating to common axis...")
+        common_min = max(x.min() for x in all_x)
+        common_max = min(x.max() for x in all_x)
+        common_x = np.linspace(common_min, common_max, 2000)
+        all_y_interp = []
+        for x, y in zip(all_x, all_y):
+            f = interp1d(x, y, kind='linear', fill_value='extrapolate')
+            all_y_interp.append(f(common_x))
+        spectral_matrix = np.array(all_y_interp)
+        raman_axis = common_x
+    else:
+        spectral_matrix = np.array(all_y)
+        raman_axis = x_ref
+
+    mean_spectrum = np.mean(spectral_matrix, axis=0)
+    std_spectrum = np.std(spectral_matrix, axis=0)
+    median_spectrum = np.median(spectral_matrix, axis=0)
+
+    with np.errstate(divide='ignore', invalid='ignore'):
+        cv_spectrum = np.where(
+            np.abs(mean_spectrum) > 1e-10,
+            std_spectrum / np.abs(mean_spectrum),
+            0
+        )
+
+    progress(75)
+
+    # ---- Peaks ----
+    peaks_idx, props = find_peaks(
+        mean_spectrum,
+        prominence=PEAK_PROMINENCE,
+        width=PEAK_MIN_WIDTH
+    )
+
+    if len(peaks_idx) > 0:
+        peak_positions = raman_axis[peaks_idx]
+        log(f"Peaks: {', '.join(f'{p:.0f}' for p in peak_positions)}")
+    else:
+        peak_positions = np.array([])
+        log("No peaks detected")
+
+    progress(80)
+
+    # ---- Generate plots with matplotlib (saved to files) ----
+    log("Generating analysis plots...")
+
+    axis_label = "Calibrated Raman shift (cm⁻¹)" if calib_coeffs_soft else "Raman shift (cm⁻¹)"
+
+    # Mean spectrum plot
+    try:
+        fig, axes_plt = plt.subplots(3, 1, figsize=(14, 12),
+                                     gridspec_kw={'height_ratios': [3, 1, 1]})
+
+        ax = axes_plt[0]
+        calib_tag = " + calibration" if calib_coeffs_soft else ""
+        ax.set_title(
+            f"Mean SERS — {os.path.basename(scan_folder)} "
+            f"(n={spectral_matrix.shape[0]}, λ={EXCITATION_WAVELENGTH} nm{calib_tag})"
+        )
+
+        for i in range(spectral_matrix.shape[0]):
+            ax.plot(raman_axis, spectral_matrix[i],
+                    color='lightblue', alpha=0.3, linewidth=0.5)
+
+        ax.fill_between(raman_axis,
+                        mean_spectrum - std_spectrum,
+                        mean_spectrum + std_spectrum,
+                        alpha=0.3, color='steelblue', label='Mean ± 1 SD')
+        ax.plot(raman_axis, mean_spectrum, 'b-', linewidth=1.5, label='Mean')
+        ax.plot(raman_axis, median_spectrum, 'g--', linewidth=1, alpha=0.7, label='Median')
+
+        if len(peaks_idx) > 0:
+            ax.plot(peak_positions, mean_spectrum[peaks_idx], 'rv', markersize=6, label='Peaks')
+            for pos, inten in zip(peak_positions, mean_spectrum[peaks_idx]):
+                ax.annotate(f'{pos:.0f}', xy=(pos, inten),
+                            xytext=(0, 10), textcoords='offset points',
+                            fontsize=8, ha='center', color='red')
+
+        ax.set_xlabel(axis_label)
+        ax.set_ylabel("Normalized intensity")
+        ax.legend(loc='upper right')
+        ax.grid(True, alpha=0.3)
+
+        axes_plt[1].set_title("Standard Deviation")
+        axes_plt[1].fill_between(raman_axis, 0, std_spectrum, alpha=0.5, color='orange')
+        axes_plt[1].plot(raman_axis, std_spectrum, 'darkorange', linewidth=0.8)
+        axes_plt[1].set_xlabel(axis_label)
+        axes_plt[1].set_ylabel("SD")
+        axes_plt[1].grid(True, alpha=0.3)
+
+        axes_plt[2].set_title("Coefficient of Variation")
+        axes_plt[2].fill_between(raman_axis, 0, cv_spectrum, alpha=0.5, color='salmon')
+        axes_plt[2].plot(raman_axis, cv_spectrum, 'darkred', linewidth=0.8)
+        axes_plt[2].set_xlabel(axis_label)
+        axes_plt[2].set_ylabel("CV")
+        axes_plt[2].set_ylim(0, min(float(np.percentile(cv_spectrum, 99)), 5.0))
+        axes_plt[2].grid(True, alpha=0.3)
+
+        plt.tight_layout()
+        fig.savefig(os.path.join(scan_folder, "mean_sers_spectrum.png"), dpi=200, bbox_inches='tight')
+        plt.close(fig)
+        log("Saved: mean_sers_spectrum.png")
+    except Exception as e:
+        log(f"Plot generation failed: {e}")
+
+    progress(90)
+
+    # ---- Export CSV ----
+    try:
+        results_df = pd.DataFrame({
+            'raman_shift_cm-1': raman_axis,
+            'mean_intensity': mean_spectrum,
+            'std': std_spectrum,
+            'median_intensity': median_spectrum,
+            'cv': cv_spectrum,
+        })
+        results_df.to_csv(os.path.join(scan_folder, "mean_sers_spectrum_stats.csv"), index=False)
+
+        if len(peaks_idx) > 0:
+            peaks_df = pd.DataFrame({
+                'peak_raman_shift_cm-1': peak_positions,
+                'peak_intensity': mean_spectrum[peaks_idx],
+                'prominence': props.get('prominences', np.full(len(peaks_idx), np.nan)),
+            })
+            peaks_df.to_csv(os.path.join(scan_folder, "mean_sers_peaks.csv"), index=False)
+
+        point_names = [data['point_name'] for data in filtered.values()]
+        matrix_df = pd.DataFrame({'raman_shift_cm-1': raman_axis})
+        for i, pn in enumerate(point_names):
+            matrix_df[pn] = spectral_matrix[i]
+        matrix_df.to_csv(os.path.join(scan_folder, "processed_spectra_matrix.csv"), index=False)
+
+        # QC table
+        qc_rows = []
+        for name, data in spectra.items():
+            status = "PASSED" if name in filtered else (
+                "SATURATED" if name in rejected_sat else "FLAT"
+            )
+            qc_rows.append({
+                'file': name,
+                'point_name': data['point_name'],
+                'intensity_max': float(np.max(data['intensity'])),
+                'status': status,
+            })
+        pd.DataFrame(qc_rows).to_csv(os.path.join(scan_folder, "qc_summary.csv"), index=False)
+
+        # Metadata
+        with open(os.path.join(scan_folder, "postprocessing_parameters.txt"), "w") as f:
+            f.write(f"SCAN_FOLDER={os.path.abspath(scan_folder)}\n")
+            f.write(f"EXCITATION_WAVELENGTH={EXCITATION_WAVELENGTH}\n")
+            f.write(f"USE_CORRECTED={USE_CORRECTED}\n")
+            f.write(f"CROP_REGION={CROP_REGION}\n")
+            f.write(f"SAVGOL_WINDOW={SAVGOL_WINDOW}\n")
+            f.write(f"SAVGOL_POLYORDER={SAVGOL_POLYORDER}\n")
+            f.write(f"USE_SOFTWARE_CALIBRATION={USE_SOFTWARE_CALIBRATION}\n")
+            f.write(f"CALIBRATION_COEFFS={calib_coeffs_soft}\n")
+            f.write(f"N_TOTAL={len(spectra)}\n")
+            f.write(f"N_PASSED={len(filtered)}\n")
+            f.write(f"N_PEAKS={len(peaks_idx)}\n")
+
+        log("All CSV exports saved")
+    except Exception as e:
+        log(f"Export failed: {e}")
+
+    progress(100)
+    return {
+        'raman_axis': raman_axis,
+        'spectral_matrix': spectral_matrix,
+        'mean_spectrum': mean_spectrum,
+        'std_spectrum': std_spectrum,
+        'median_spectrum': median_spectrum,
+        'cv_spectrum': cv_spectrum,
+        'peaks_idx': peaks_idx,
+        'peak_positions': peak_positions,
+        'n_total': len(spectra),
+        'n_passed': len(filtered),
+    }
@@ -0,0 +1,112 @@
+import collections
+import logging
+import logging.handlers
+
+DEBUG = logging.DEBUG
+INFO = logging.INFO
+WARNING = logging.WARNING
+ERROR = logging.ERROR
+
+LEVELS = collections.OrderedDict([('Debug', DEBUG), ('Info', INFO), ('Warning', WARNING), ('Error', ERROR)])
+
+LOGGER_NAME = 'raman'
+
+
+def get_logger():
+    # Application logger; handlers decide what is kept, so it passes everything
+    logger = logging.getLogger(LOGGER_NAME)
+    logger.setLevel(DEBUG)
+    logger.propagate = False
+    return logger
+
+
+class LineFormatter(logging.Formatter):
+    # "[HH:MM:SS] message", with the level name added above INFO
+
+    def __init__(self, datefmt="%H:%M:%S"):
+        super().__init__(datefmt=datefmt)
+
+    def format(self, record):
+        message = record.getMessage()
+        if record.exc_info:
+            message = f"{message}\n{self.formatException(record.exc_info)}"
+        stamp = self.formatTime(record, self.datefmt)
+        if record.levelno > INFO:
+            return f"[{stamp}] {record.levelname}: {message}"
+        if record.levelno < INFO:
+            return f"[{stamp}] debug: {message}"
+        return f"[{stamp}] {message}"
+
+
+class LogRing(logging.Handler):
+    # Bounded in-memory log for the GUI. Keeps the last `capacity` lines and
+    # queues new ones until the widget timer drains them in one batch, so
+    # logging from a tight loop costs a format and two deque appends and
+    # never touches Qt. Lines queued faster than they are drained are
+    # counted in `dropped` instead of growing the queue.
+
+    def __init__(self, capacity=2000, level=INFO):
+        super().__init__(level)
+        self.lines = collections.deque(maxlen=capacity)
+        self._pending = collections.deque(maxlen=capacity)
+        self.dropped = 0
+        self.setFormatter(LineFormatter())
+
+    @property
+    def capacity(self):
+        return self.lines.maxlen
+
+    def set_capacity(self, capacity):
+        self.acquire()
+        try:
+            self.lines = collections.deque(self.lines, maxlen=capacity)
+            self._pending = collections.deque(self._pending, maxlen=capacity)
+        finally:
+            self.release()
+
+    def emit(self, record):
+        try:
+            line = self.format(record)
+        except Exception:
+            self.handleError(record)
+            return
+        # handle() already holds the handler lock
+        if len(self._pending) == self._pending.maxlen:
+            self.dropped += 1
+        self.lines.append(line)
+        self._pending.append(line)
+
+    def drain(self):
+        # Lines added since the last call and how many were lost before it
+        self.acquire()
+        try:
+            lines = list(self._pending)
+            self._pending.clear()
+            dropped, self.dropped = self.dropped, 0
+        finally:
+            self.release()
+        return lines, dropped
+
+    def text(self):
+        self.acquire()
+        try:
+            return "\n".join(self.lines)
+        finally:
+            self.release()
+
+
+def set_file_sink(logger, path, max_bytes=1_000_000, backup_count=3, level=DEBUG):
+    # Replaces any rotating file handler on `logger`; path None just removes it
+    for handler in list(logger.handlers):
+        if isinstance(handler, logging.handlers.RotatingFileHandler):
+            logger.removeHandler(handler)
+            handler.close()
+    if not path:
+        return None
+    handler = logging.handlers.RotatingFileHandler(
+        path, maxBytes=max_bytes, backupCount=backup_count, encoding='utf-8'
+    )
+    handler.setLevel(level)
+    handler.setFormatter(LineFormatter(datefmt="%Y-%m-%d %H:%M:%S"))
+    logger.addHandler(handler)
+    return handler
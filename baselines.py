@@ -0,0 +1,151 @@
+import functools
+
+import numpy as np
+
+METHODS = ('asls', 'arpls')
+
+# pybaselines / ramanspy defaults
+DEFAULT_LAM = {'asls': 1e6, 'arpls': 1e5}
+
+_EPS = np.finfo(np.float64).eps
+
+
+@functools.lru_cache(maxsize=32)
+def penalty_bands(n, lam, diff_order=2):
+    # lam * D'D for the difference matrix D of `diff_order`, in the upper
+    # banded layout of scipy.linalg.solveh_banded (last row = diagonal).
+    # Cached per (n, lam, diff_order) and read-only, so every chain and
+    # every call on the same axis length shares one copy.
+    c = np.diff(np.r_[np.zeros(diff_order), 1.0, np.zeros(diff_order)], diff_order)
+    bands = np.zeros((diff_order + 1, n))
+    rows = n - diff_order
+    for k in range(diff_order + 1):
+        band = np.zeros(n - k)
+        for m in range(diff_order + 1 - k):
+            # D[i, i+m] * D[i, i+m+k] contributes to (D'D)[j, j+k] at j = i+m
+            band[m:m + rows] += c[m] * c[m + k]
+        bands[diff_order - k, k:] = lam * band
+    bands.setflags(write=False)
+    return bands
+
+
+# Weight updates return (new weights, rows that must stop now)
+
+def _asls_weights(y, z, p):
+    return np.where(y > z, p, 1.0 - p), np.zeros(len(y), dtype=bool)
+
+
+def _arpls_weights(y, z, p):
+    # Logistic weights from the negative residuals, per row (pybaselines
+    # arpls). A row with fewer than two negative residuals stops with its
+    # current fit, as pybaselines does.
+    from scipy.special import expit
+    residual = y - z
+    neg = residual < 0
+    count = neg.sum(axis=1)
+    done = count < 2
+    safe = np.maximum(count, 2)
+    masked = np.where(neg, residual, 0.0)
+    mean = masked.sum(axis=1) / safe
+    var = (np.where(neg, residual - mean[:, None], 0.0) ** 2).sum(axis=1) / (safe - 1)
+    std = np.sqrt(var)
+    std[std == 0] = _EPS
+    weights = expit(-(2.0 / std[:, None]) * (residual - (2.0 * std - mean)[:, None]))
+    return weights, done
+
+
+class WhittakerBaseline:
+    # ASLS or arPLS baseline (pybaselines' asls / arpls) for spectra of
+    # `n_points`. lam*D'D comes from the penalty_bands cache. Rows are
+    # solved `batch_rows` at a time: the block-diagonal system of a stack is
+    # still banded (the tiled penalty has zeros where blocks meet), so one
+    # banded Cholesky per iteration solves every row that has not converged
+    # yet, and each row stops on its own tolerance.
+    # With warm_start, iterations start from the weights the previous call
+    # converged with instead of all ones; a first stack without history
+    # starts from the weights of its median spectrum. For one spectrum at a
+    # time (live frames) the last Cholesky factor is kept as well, so a
+    # frame whose weights do not change costs a single back-substitution.
+    # Warm-started ASLS converges to the same weights as from a cold start
+    # on all but borderline pixels; arPLS weights are continuous and land
+    # within its tolerance of the cold-start result.
+
+    def __init__(self, n_points, method='asls', lam=None, p=1e-2, max_iter=50, tol=1e-3,
+                 batch_rows=256, warm_start=False):
+        if method not in METHODS:
+            raise ValueError(f"Unknown baseline method {method!r}")
+        self.n_points = n_points
+        self.method = method
+        self.lam = DEFAULT_LAM[method] if lam is None else float(lam)
+        self.p = p
+        self.max_iter = max_iter
+        self.tol = tol
+        self.batch_rows = batch_rows
+        self.warm_start = warm_start
+        self.penalty = penalty_bands(n_points, self.lam)
+        self._update = _asls_weights if method == 'asls' else _arpls_weights
+        self.iterations = 0
+        self.reset()
+
+    def reset(self):
+        self.weights = None
+        self._factor = None
+
+    def fit(self, y):
+        # Baseline of one spectrum or of each row of a stack
+        y = np.asarray(y, dtype=np.float64)
+        rows = np.atleast_2d(y)
+        if rows.shape[1] != self.n_points:
+            raise ValueError(f"Expected {self.n_points} points, got {rows.shape[1]}")
+        factor = None
+        if not self.warm_start:
+            weights = np.ones_like(rows)
+        elif self.weights is not None:
+            weights = np.array(np.broadcast_to(self.weights, rows.shape))
+            factor = self._factor
+        elif len(rows) > 1:
+            self.fit(np.median(rows, axis=0))
+            weights = np.array(np.broadcast_to(self.weights, rows.shape))
+        else:
+            weights = np.ones_like(rows)
+        baseline = np.empty_like(rows)
+        self.iterations = 0
+        for start in range(0, len(rows), self.batch_rows):
+            block = slice(start, start + self.batch_rows)
+            iterations, last_factor = self._solve_block(rows[block], weights[block], baseline[block],
+                                                        factor if len(rows) == 1 else None)
+            self.iterations = max(self.iterations, iterations)
+        if self.warm_start:
+            # A stack hands on its median weights; only a single spectrum's
+            # factor matches them
+            self.weights = weights[0] if len(rows) == 1 else np.median(weights, axis=0)
+            self._factor = last_factor if len(rows) == 1 else None
+        return baseline.reshape(y.shape)
+
+    def _solve_block(self, y, weights, baseline, factor=None):
+        # Iterates on one block in place: `weights` ends as the weights each
+        # row converged with and `baseline` as its fit. Returns the number
+        # of solves and the last factor.
+        from scipy.linalg import cholesky_banded, cho_solve_banded
+        m, n = y.shape
+        active = np.arange(m)
+        iteration = 0
+        for iteration in range(1, self.max_iter + 2):
+            w = weights[active]
+            ya = y[active]
+            if factor is None:
+                ab = np.tile(self.penalty, len(active))
+                ab[-1] += w.ravel()
+                factor = cholesky_banded(ab, overwrite_ab=True, check_finite=False)
+            z = cho_solve_banded((factor, False), (w * ya).ravel(), overwrite_b=True,
+                                 check_finite=False).reshape(len(active), n)
+            baseline[active] = z
+            new_weights, done = self._update(ya, z, self.p)
+            change = np.linalg.norm(w - new_weights, axis=1) / np.maximum(np.linalg.norm(w, axis=1), _EPS)
+            going = (change >= self.tol) & ~done
+            if not going.any():
+                break
+            active = active[going]
+            weights[active] = new_weights[going]
+            factor = None
+        return iteration, factor
@@ -0,0 +1,342 @@
+import argparse
+import json
+import os
+import sys
+import time
+
+import numpy as np
+
+
+# Headless entry point: drives acquisition, processing, database search and
+# scan analysis without Qt. Heavy modules are imported by the subcommand that
+# needs them, so `acquire` and --help start quickly.
+#
+#   python cli.py acquire --port sim://spectrometer --inttime 200 --frames 10 -o dark.csv
+#   python cli.py process spectrum.csv --crop 200 3200 --savgol 7 3 --asls --peaks -o processed.csv
+#   python cli.py search spectrum.csv --db rbase_specdictcur.pkl --metric sad --top 5
+#   python cli.py analyze-scan run01 --config scan.json
+#
+# Every option can also come from a JSON file given with --config (keys are
+# the option names with '_' instead of '-'); flags on the command line win.
+
+
+N_PIXELS = 2048
+DEFAULT_DB = "rbase_specdictcur.pkl"
+DEFAULT_CALIBRATION = "calibration_cur.csv"
+
+
+def log(message):
+    print(f"[{time.strftime('%H:%M:%S')}] {message}", file=sys.stderr)
+
+
+# ---- acquire ----
+
+def cmd_acquire(args):
+    from acquisition import FrameRecorder, GapDetector
+    from devices import Spectrometer
+    from processing import SpectrumAccumulator, SpikeFilter
+
+    dev = Spectrometer('cli', args.port, baudrate=args.baudrate, wavelength_range=args.wavelength_range)
+    if args.background:
+        from analysis import load_spectrum_csv
+        dev.background = load_spectrum_csv(args.background)[1]
+
+    dev.open()
+    reader = dev.reader
+    recorder = None
+    try:
+        inttime = dev.configure(args.inttime, args.average)
+        if args.inttime is not None and inttime != args.inttime:
+            log(f"Integration time readback {inttime}, requested {args.inttime}")
+        log(f"Connected to {args.port}, integration time {inttime} ms, average {dev.average}")
+        if args.output.endswith('.rec'):
+            recorder = FrameRecorder(args.output)
+        streaming = args.continuous or args.trigger
+        spikes = SpikeFilter(temporal=streaming) if args.spikes else None
+        acc = SpectrumAccumulator(N_PIXELS, target_frames=0)
+        frames = []
+        gaps = None
+        if args.trigger:
+            dev.commands.send(0x07, args.trigger, 0)
+            period = args.trigger_period / 1000.0 if args.trigger_period else None
+            gaps = GapDetector(period=period)
+            log(f"Armed external trigger mode {args.trigger}")
+        if streaming:
+            dev.start_continuous()
+        t0 = time.time()
+        failures = 0
+        crc_reported = False
+        try:
+            while len(frames) < args.frames:
+                if not streaming:
+                    dev.commands.send(0x01)
+                data, error = reader.read(dev.port)
+                if data is None:
+                    if gaps is not None and reader.buffered() == 0:
+                        log("Waiting for trigger...")
+                        continue
+                    log(error)
+                    failures += 1
+                    if failures > args.max_retries:
+                        log(f"Giving up after {failures} failed reads "
+                            f"({len(frames)} of {args.frames} frames acquired)")
+                        return 1
+                    continue
+                failures = 0
+                if reader.crc_auto_disabled and not crc_reported:
+                    crc_reported = True
+                    log("WARNING: frame checksum never matched on consecutive clean frames, "
+                        "checksum verification is OFF")
+                if gaps is not None:
+                    missed = gaps.update(reader.header_time)
+                    if missed > 0:
+                        log(f"Frame {len(frames)}: {missed} frame(s) missed before it")
+                    elif missed < 0:
+                        log(f"Frame {len(frames)}: previous gap was a late delivery "
+                            f"({-missed} frame(s) recovered)")
+                if recorder is not None:
+                    recorder.append(data, reader.header_time, (inttime or 0, 0, 0, dev.average, 0))
+                y = data.astype(np.float64)
+                if dev.background is not None:
+                    y -= dev.background
+                if spikes is not None:
+                    y, replaced = spikes.filter(y, out=y)
+                    if len(replaced):
+                        log(f"Frame {len(frames)}: replaced {len(replaced)} spike pixel(s)")
+                acc.add(y)
+                frames.append(y)
+        finally:
+            # Also on Ctrl-C or a failed read: leave the device idle
+            if streaming:
+                dev.stop_continuous()
+            if args.trigger:
+                dev.commands.send(0x07, 0, 0)
+        elapsed = time.time() - t0
+        log(f"Acquired {len(frames)} frames in {elapsed:.2f} s "
+            f"(corrupt {reader.corrupt_frames}, resyncs {reader.resyncs})")
+        if gaps is not None:
+            g = gaps.summary()
+            log(f"Trigger period {g['period_ms']:.3f} ms, jitter {g['jitter_ms']:.3f} ms, "
+                f"{g['gaps']} gaps, {g['missed']} frames missed, {g['late']} late deliveries")
+    finally:
+        if recorder is not None:
+            recorder.close()
+        dev.close()
+
+    if recorder is not None:
+        log(f"Raw frames recorded to {args.output}")
+        return 0
+    if args.all_frames:
+        data = np.column_stack([dev.wavelengths] + frames)
+        header = 'wavelength,' + ','.join(f'frame_{i:04d}' for i in range(len(frames)))
+    else:
+        data = np.column_stack((dev.wavelengths, acc.mean))
+        header = 'wavelength,intensity'
+    np.savetxt(args.output, data, delimiter=',', header=header, comments='')
+    log(f"Saved {args.output}")
+    return 0
+
+
+# ---- process / search ----
+
+def load_axis_and_spectrum(args):
+    import analysis
+    x, y = analysis.load_spectrum_csv(args.input)
+    if args.axis == 'wavelength':
+        coeffs = None
+        if args.calibration and os.path.exists(args.calibration):
+            coeffs = analysis.load_calibration(args.calibration)
+            log(f"Calibration {args.calibration}: {coeffs}")
+        x = analysis.wavelength_to_raman(x, args.excitation, coeffs)
+    return x, y
+
+
+def process_input(args):
+    import analysis
+    x, y = load_axis_and_spectrum(args)
+    savgol = None
+    if args.savgol:
+        savgol = tuple(args.savgol) + ((args.deriv,) if args.deriv else ())
+    params = {
+        'crop': tuple(args.crop) if args.crop else None,
+        'savgol': savgol,
+        'baseline_method': args.baseline or ('asls' if args.asls else None),
+        'normalize': args.normalize,
+    }
+    robj = analysis.process_spectrum(y, x, params)
+    return robj, params
+
+
+def cmd_process(args):
+    import analysis
+    robj, _ = process_input(args)
+    axis = robj.spectral_axis
+    spectrum = robj.spectral_data[0]
+    if args.peaks:
+        peaks, shifts = analysis.spectrum_peaks(robj, args.prominence, args.width)
+        log(f"Peaks found: {', '.join(f'{s:.1f}' for s in shifts) or 'none'}")
+        if args.peaks_output:
+            np.savetxt(args.peaks_output, np.column_stack((shifts, spectrum[peaks])),
+                       delimiter=',', header='raman_shift,intensity', comments='')
+    if args.output:
+        np.savetxt(args.output, np.column_stack((axis, spectrum)),
+                   delimiter=',', header='raman_shift,intensity', comments='')
+        log(f"Saved {args.output}")
+    return 0
+
+
+def cmd_search(args):
+    import analysis
+    robj, processing = process_input(args)
+    specdict = analysis.load_database(args.db)
+    log(f"Database {args.db}: {len(specdict)} entries")
+    params = {
+        'min_overlap': args.min_overlap,
+        'peak_prominence': args.prominence,
+        'peak_width': args.width,
+        'iur_prominence': args.iur_prominence,
+        'iur_width': args.iur_width,
+        'iur_tol': args.iur_tol,
+        'process_db': args.process_db,
+    }
+    results = analysis.search_database(
+        robj, specdict, nleads=args.top, metric=args.metric, params=params,
+        processing=processing, log=log
+    )
+    if results.empty:
+        return 1
+    table = results.drop(['aligned_intensity_comp', 'spectral_axis_comp'], axis=1)
+    print(table[['component', 'distance_score', 'identifier', 'url']].to_string(index=False))
+    if args.output:
+        table.to_csv(args.output, index=False)
+        log(f"Saved {args.output}")
+    return 0
+
+
+# ---- analyze-scan ----
+
+def cmd_analyze_scan(args):
+    import analysis
+    if not os.path.isdir(args.folder):
+        log(f"Not a scan folder: {args.folder}")
+        return 2
+    params = {key: getattr(args, key) for key in analysis.SCAN_DEFAULTS}
+    coeffs = None
+    if params['use_calibration'] and args.calibration and os.path.exists(args.calibration):
+        coeffs = analysis.load_calibration(args.calibration)
+    log(f"=== Starting scan post-processing: {args.folder} ===")
+    result = analysis.analyze_scan(args.folder, params, calib_coeffs=coeffs, log=log)
+    if result is None:
+        return 1
+    log(f"=== Post-processing COMPLETE: {args.folder} ({result['n_passed']}/{result['n_total']} passed) ===")
+    return 0
+
+
+# ---- argument parsing ----
+
+def add_processing_args(p):
+    p.add_argument('input', help="two-column spectrum CSV (x, intensity) with a header row")
+    p.add_argument('--axis', choices=['wavelength', 'raman'], default='wavelength',
+                   help="unit of the first column; wavelengths are converted to Raman shift")
+    p.add_argument('--excitation', type=float, default=785)
+    p.add_argument('--calibration', default=DEFAULT_CALIBRATION,
+                   help="software calibration CSV (a, b, c); ignored if missing")
+    p.add_argument('--crop', type=float, nargs=2, metavar=('MIN', 'MAX'))
+    p.add_argument('--savgol', type=int, nargs=2, metavar=('WINDOW', 'POLYORDER'))
+    p.add_argument('--deriv', type=int, choices=[1, 2],
+                   help="output the SavGol first or second derivative instead of the smoothed spectrum")
+    p.add_argument('--baseline', choices=['asls', 'arpls'], help="baseline correction method")
+    p.add_argument('--asls', action='store_true', help="same as --baseline asls")
+    p.add_argument('--normalize', choices=['MinMax', 'Vector'])
+    p.add_argument('--prominence', type=float, default=0.1)
+    p.add_argument('--width', type=float, default=2)
+    p.add_argument('-o', '--output')
+
+
+def build_parser():
+    # --config is accepted before or after the subcommand; parse_args reads
+    # it beforehand, so neither parser needs to store it
+    common = argparse.ArgumentParser(add_help=False)
+    common.add_argument('--config', default=argparse.SUPPRESS, help="JSON file with option defaults")
+    parser = argparse.ArgumentParser(prog='cli.py', description="Headless Raman spectrometer tools",
+                                     parents=[common])
+    sub = parser.add_subparsers(dest='command', required=True)
+
+    p = sub.add_parser('acquire', parents=[common], help="acquire frames from a spectrometer")
+    p.add_argument('--port', required=True, help="serial port or sim://spectrometer")
+    p.add_argument('--baudrate', type=int, default=19200)
+    p.add_argument('--inttime', type=int, help="integration time in ms (default: keep device setting)")
+    p.add_argument('--average', type=int, default=1, help="hardware average count")
+    p.add_argument('--frames', type=int, default=1)
+    p.add_argument('--continuous', action='store_true', help="stream frames instead of soft triggers")
+    p.add_argument('--trigger', type=int, choices=[1, 2],
+                   help="arm external trigger mode 1 (continuous) or 2 (monopulse) and drain frames")
+    p.add_argument('--trigger-period', type=float, default=0,
+                   help="expected trigger period in ms for gap detection (default: estimate)")
+    p.add_argument('--background', help="spectrum CSV to subtract")
+    p.add_argument('--max-retries', type=int, default=5,
+                   help="consecutive failed reads before giving up (waiting for a trigger does not count)")
+    p.add_argument('--spikes', action='store_true', help="remove cosmic-ray spikes")
+    p.add_argument('--all-frames', action='store_true', help="write every frame instead of the mean")
+    p.add_argument('--wavelength-range', type=float, nargs=2, default=(796, 1119), metavar=('MIN', 'MAX'))
+    p.add_argument('-o', '--output', required=True, help=".csv spectrum or .rec raw frame recording")
+    p.set_defaults(func=cmd_acquire)
+
+    p = sub.add_parser('process', parents=[common], help="preprocess a spectrum")
+    add_processing_args(p)
+    p.add_argument('--peaks', action='store_true')
+    p.add_argument('--peaks-output')
+    p.set_defaults(func=cmd_process)
+
+    p = sub.add_parser('search', parents=[common], help="preprocess a spectrum and search a database")
+    add_processing_args(p)
+    p.add_argument('--db', default=DEFAULT_DB)
+    p.add_argument('--metric', choices=['sad', 'sid', 'mae', 'mse', 'iur'], default='sad')
+    p.add_argument('--top', type=int, default=5)
+    p.add_argument('--min-overlap', type=float, default=3000)
+    p.add_argument('--iur-prominence', type=float, default=0.1)
+    p.add_argument('--iur-width', type=float, default=2)
+    p.add_argument('--iur-tol', type=float, default=30)
+    p.add_argument('--no-process-db', dest='process_db', action='store_false',
+                   help="compare against raw database spectra")
+    p.set_defaults(func=cmd_search)
+
+    p = sub.add_parser('analyze-scan', parents=[common], help="QC, preprocess and summarize a scan folder")
+    p.add_argument('folder')
+    p.add_argument('--calibration', default=DEFAULT_CALIBRATION)
+    p.add_argument('--excitation', type=float, default=785)
+    p.add_argument('--no-calibration', dest='use_calibration', action='store_false')
+    p.add_argument('--raw', dest='use_corrected', action='store_false', help="use *_raw.csv files")
+    p.add_argument('--crop-min', type=float, default=200)
+    p.add_argument('--crop-max', type=float, default=3200)
+    p.add_argument('--savgol-window', type=int, default=7)
+    p.add_argument('--savgol-polyorder', type=int, default=3)
+    p.add_argument('--saturation', type=float, default=60000)
+    p.add_argument('--saturation-fraction', type=float, default=0.05)
+    p.add_argument('--flat-threshold', type=float, default=2.0)
+    p.add_argument('--peak-prominence', type=float, default=0.05)
+    p.add_argument('--peak-min-width', type=float, default=2)
+    p.set_defaults(func=cmd_analyze_scan)
+    return parser, sub
+
+
+def parse_args(argv=None):
+    parser, sub = build_parser()
+    pre = argparse.ArgumentParser(add_help=False)
+    pre.add_argument('--config')
+    known, _ = pre.parse_known_args(argv)
+    if known.config:
+        with open(known.config) as f:
+            config = json.load(f)
+        for subparser in sub.choices.values():
+            subparser.set_defaults(**config)
+    return parser.parse_args(argv)
+
+
+def main(argv=None):
+    args = parse_args(argv)
+    return args.func(args)
+
+
+if __name__ == "__main__":
+    sys.exit(main())
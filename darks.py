@@ -0,0 +1,106 @@
+import collections
+import os
+import time
+
+import numpy as np
+
+DarkEntry = collections.namedtuple('DarkEntry', 'key data timestamp n_frames')
+
+DarkMatch = collections.namedtuple('DarkMatch', 'data kind keys')
+
+
+def dark_key(integration_time, gain, offset, average):
+    return (int(integration_time), int(gain), int(offset), int(average))
+
+
+class DarkLibrary:
+    # Dark frames indexed by (integration time ms, gain, offset, average).
+    # For an exact key the stored frame is returned; otherwise, among fresh
+    # entries with the same gain, offset and average, the two nearest
+    # integration times on either side are linearly interpolated per pixel
+    # (dark = bias + dark current * time). There is no extrapolation.
+    # Entries older than max_age_s are ignored and dropped on save, since
+    # dark current follows sensor temperature. Persisted as one .npz file.
+
+    def __init__(self, path=None, max_age_s=4 * 3600.0, max_entries=128):
+        self.path = path
+        self.max_age_s = max_age_s
+        self.max_entries = max_entries
+        self.entries = collections.OrderedDict()
+
+    def __len__(self):
+        return len(self.entries)
+
+    def add(self, data, integration_time, gain, offset, average, n_frames=1, timestamp=None):
+        key = dark_key(integration_time, gain, offset, average)
+        data = np.array(data, dtype=np.float64)
+        data.setflags(write=False)
+        self.entries.pop(key, None)
+        self.entries[key] = DarkEntry(key, data, time.time() if timestamp is None else timestamp, n_frames)
+        while len(self.entries) > self.max_entries:
+            self.entries.popitem(last=False)
+        return key
+
+    def is_fresh(self, entry, now=None):
+        if self.max_age_s is None:
+            return True
+        return (time.time() if now is None else now) - entry.timestamp <= self.max_age_s
+
+    def lookup(self, integration_time, gain, offset, average, now=None):
+        # DarkMatch with kind 'exact' or 'interpolated', or None
+        key = dark_key(integration_time, gain, offset, average)
+        entry = self.entries.get(key)
+        if entry is not None and self.is_fresh(entry, now):
+            return DarkMatch(entry.data, 'exact', (key,))
+        below = above = None
+        for entry in self.entries.values():
+            if entry.key[1:] != key[1:] or not self.is_fresh(entry, now):
+                continue
+            t = entry.key[0]
+            if t < key[0] and (below is None or t > below.key[0]):
+                below = entry
+            elif t > key[0] and (above is None or t < above.key[0]):
+                above = entry
+        if below is None or above is None:
+            return None
+        w = (key[0] - below.key[0]) / (above.key[0] - below.key[0])
+        data = below.data * (1.0 - w) + above.data * w
+        data.setflags(write=False)
+        return DarkMatch(data, 'interpolated', (below.key, above.key))
+
+    def expire(self, now=None):
+        stale = [key for key, entry in self.entries.items() if not self.is_fresh(entry, now)]
+        for key in stale:
+            del self.entries[key]
+        return len(stale)
+
+    def clear(self):
+        self.entries.clear()
+
+    def save(self, path=None):
+        path = path or self.path
+        self.expire()
+        entries = list(self.entries.values())
+        n = len(entries)
+        # Written next to the target and renamed, so a crash never leaves
+        # a truncated library behind
+        tmp = f"{path}.tmp"
+        with open(tmp, 'wb') as f:
+            np.savez(
+                f,
+                keys=np.array([e.key for e in entries], dtype=np.int64).reshape(n, 4),
+                timestamps=np.array([e.timestamp for e in entries], dtype=np.float64),
+                n_frames=np.array([e.n_frames for e in entries], dtype=np.int64),
+                data=np.array([e.data for e in entries], dtype=np.float64).reshape(n, -1),
+            )
+        os.replace(tmp, path)
+
+    def load(self, path=None):
+        path = path or self.path
+        with np.load(path) as f:
+            keys, timestamps, n_frames, data = f['keys'], f['timestamps'], f['n_frames'], f['data']
+        self.entries.clear()
+        for key, ts, n, row in sorted(zip(keys.tolist(), timestamps.tolist(), n_frames.tolist(), data),
+                                      key=lambda item: item[1]):
+            self.add(row, *key, n_frames=n, timestamp=ts)
+        return self.expire()
@@ -0,0 +1,321 @@
+import collections
+import csv
+import os
+import threading
+import time
+
+import numpy as np
+
+from acquisition import N_PIXELS, CommandChannel, FrameReader, FrameRingBuffer, FrameRecorder
+from virtual_device import is_virtual_port, open_virtual_port
+
+
+class Spectrometer:
+    # One detector and the state that belongs to it: port, command channel,
+    # frame reader and ring for its acquisition worker, plus its own
+    # background, wavelength range, excitation and software calibration.
+    # Everything here runs on the caller's thread except the ring, which the
+    # worker fills.
+
+    def __init__(self, name, port_name, baudrate=19200, wavelength_range=(796, 1119),
+                 excitation=785.0, ring_capacity=64, verify_crc=True):
+        self.name = name
+        self.port_name = port_name
+        self.baudrate = baudrate
+        self.port = None
+        self.commands = None
+        self.ring = FrameRingBuffer(capacity=ring_capacity)
+        # Pool must outlive every frame the ring can still hold
+        self.reader = FrameReader(pool_size=ring_capacity + 4, verify_crc=verify_crc)
+        self.integration_time = None
+        self.average = 1
+        self.excitation = excitation
+        self.calib_coeffs = None
+        self.background = None
+        self.frames = 0
+        self.last_timestamp = None
+        self._axis_cache = {}
+        self.set_wavelength_range(*wavelength_range)
+
+    @property
+    def is_open(self):
+        return self.port is not None and self.port.is_open
+
+    def open(self, timeout=10):
+        if self.is_open:
+            return
+        if is_virtual_port(self.port_name):
+            self.port = open_virtual_port(self.port_name, baudrate=self.baudrate, timeout=timeout)
+        else:
+            import serial
+            self.port = serial.Serial(self.port_name, baudrate=self.baudrate, timeout=timeout)
+        self.commands = CommandChannel(self.port)
+        self.reader.reset()
+
+    def close(self):
+        if self.port is not None:
+            try:
+                self.port.close()
+            finally:
+                self.port = None
+                self.commands = None
+
+    def configure(self, integration_time=None, average=None):
+        # Stops streaming, sets trigger mode 0, hardware average and (ms)
+        # integration time; returns the time read back from the device
+        commands = self.commands
+        commands.send(0x06)
+        self.port.reset_input_buffer()
+        commands.reset()
+        self.reader.reset()
+        commands.send(0x07, 0, 0)
+        if average is not None:
+            self.average = max(1, min(255, int(average)))
+        commands.send(0x0C, self.average, 0)
+        if integration_time is None:
+            reply = commands.request(0x0A)
+        else:
+            t = int(integration_time)
+            _, _, reply = commands.pipeline([
+                (0x11, 0x00, 0x00, None),
+                (0x03, (t >> 8) & 0xFF, t & 0xFF, None),
+                (0x0A, 0x00, 0x00, 0x02),
+            ])
+        if reply is not None:
+            self.integration_time = (reply[2] << 8) | reply[3]
+        # A frame can take the whole exposure plus transfer time
+        self.port.timeout = (self.integration_time or 1000) * self.average / 1000.0 + 10.0
+        return self.integration_time
+
+    def start_continuous(self):
+        self.ring.clear()
+        self.commands.send(0x02)
+
+    def stop_continuous(self):
+        self.commands.send(0x06)
+
+    def read_frame(self):
+        # Soft-triggered single frame as float64, or None on timeout
+        self.commands.send(0x01)
+        data, error = self.reader.read(self.port)
+        if data is None:
+            return None
+        return data.astype(np.float64)
+
+    def acquire_background(self, n_frames=1):
+        frames = [self.read_frame() for _ in range(n_frames)]
+        frames = [f for f in frames if f is not None]
+        if not frames:
+            return None
+        self.background = np.mean(frames, axis=0)
+        return self.background
+
+    def set_wavelength_range(self, wl_min, wl_max):
+        self.wavelength_min = wl_min
+        self.wavelength_max = wl_max
+        self.wavelengths = np.linspace(wl_min, wl_max, N_PIXELS)
+        self.wavelengths.setflags(write=False)
+        self._axis_cache.clear()
+
+    def set_calibration(self, coeffs):
+        self.calib_coeffs = list(coeffs)[:3] if coeffs else None
+        self._axis_cache.clear()
+
+    def set_excitation(self, excitation):
+        self.excitation = excitation
+        self._axis_cache.clear()
+
+    def axis(self, raman=False):
+        # Read-only and shared between frames; copy before modifying
+        if not raman:
+            return self.wavelengths
+        axis = self._axis_cache.get('raman')
+        if axis is None:
+            import analysis
+            axis = analysis.wavelength_to_raman(self.wavelengths, self.excitation, self.calib_coeffs)
+            axis.setflags(write=False)
+            self._axis_cache['raman'] = axis
+        return axis
+
+    def correct(self, data):
+        # Float copy with this device's background removed (clipped at 0)
+        out = np.asarray(data, dtype=np.float64).copy()
+        if self.background is not None:
+            np.subtract(out, self.background, out=out)
+            np.maximum(out, 0, out=out)
+        return out
+
+
+AlignedFrame = collections.namedtuple('AlignedFrame', 'index timestamp frames')
+
+
+class FrameAligner:
+    # Merges per-device frame streams onto a common host timeline. The
+    # earliest pending frame opens a set; every other device contributes
+    # its earliest frame within `tolerance_s` of it. A set is released once
+    # all devices have something pending, or when its opening frame is
+    # older than `max_wait_s` (a stalled or slower device then shows up as
+    # None in the set). Frames are (timestamp, data) pairs.
+
+    def __init__(self, names, tolerance_s=0.05, max_wait_s=1.0, max_pending=256):
+        self.names = list(names)
+        self.tolerance_s = tolerance_s
+        self.max_wait_s = max_wait_s
+        self.pending = {name: collections.deque(maxlen=max_pending) for name in self.names}
+        self.reset_stats()
+
+    def reset_stats(self):
+        self.sets = 0
+        self.incomplete = 0
+        self.max_skew = 0.0
+
+    def push(self, name, timestamp, data):
+        self.pending[name].append((timestamp, data))
+
+    def pop_ready(self, now=None):
+        if now is None:
+            now = time.time()
+        out = []
+        while True:
+            heads = {name: q[0] for name, q in self.pending.items() if q}
+            if not heads:
+                break
+            t0 = min(ts for ts, _ in heads.values())
+            if len(heads) < len(self.names) and now - t0 < self.max_wait_s:
+                break
+            frames = {}
+            latest = t0
+            for name in self.names:
+                head = heads.get(name)
+                if head is not None and head[0] - t0 <= self.tolerance_s:
+                    frames[name] = self.pending[name].popleft()
+                    latest = max(latest, head[0])
+                else:
+                    frames[name] = None
+            if any(f is None for f in frames.values()):
+                self.incomplete += 1
+            self.max_skew = max(self.max_skew, latest - t0)
+            out.append(AlignedFrame(self.sets, t0, frames))
+            self.sets += 1
+        return out
+
+    def clear(self):
+        for q in self.pending.values():
+            q.clear()
+
+
+class MultiRecorder:
+    # One raw .rec file per device and a CSV timeline that ties them
+    # together: one row per aligned set with its host timestamp and each
+    # device's frame number in its own file (empty when the device had no
+    # frame in that set). Workers write through sink(name); the GUI thread
+    # calls write_set() for every aligned set.
+
+    def __init__(self, base_path, names, max_unmatched=4096):
+        root, ext = os.path.splitext(base_path)
+        self.recorders = collections.OrderedDict(
+            (name, FrameRecorder(f"{root}_{name}{ext or '.rec'}")) for name in names
+        )
+        self.max_unmatched = max_unmatched
+        self._numbers = {name: collections.OrderedDict() for name in names}
+        self._lock = threading.Lock()
+        self.timeline_path = f"{root}_timeline.csv"
+        self._timeline = open(self.timeline_path, 'w', newline='')
+        self._writer = csv.writer(self._timeline)
+        self._writer.writerow(['set', 'timestamp'] + list(self.recorders))
+        self.sets = 0
+
+    def sink(self, name):
+        return _RecorderSink(self, name)
+
+    def _append(self, name, data, timestamp, params):
+        recorder = self.recorders[name]
+        if not recorder.append(data, timestamp, params):
+            return False
+        with self._lock:
+            numbers = self._numbers[name]
+            numbers[timestamp] = recorder.n_frames - 1
+            # Frames overwritten in the ring never reach an aligned set
+            while len(numbers) > self.max_unmatched:
+                numbers.popitem(last=False)
+        return True
+
+    def write_set(self, aligned):
+        with self._lock:
+            if self._timeline is None:
+                return
+            row = [aligned.index, f"{aligned.timestamp:.6f}"]
+            for name in self.recorders:
+                entry = aligned.frames.get(name)
+                number = None if entry is None else self._numbers[name].pop(entry[0], None)
+                row.append('' if number is None else number)
+            self._writer.writerow(row)
+            self.sets += 1
+
+    def close(self):
+        with self._lock:
+            for recorder in self.recorders.values():
+                recorder.close()
+            if self._timeline is not None:
+                self._timeline.close()
+                self._timeline = None
+
+
+class _RecorderSink:
+    # FrameRecorder-compatible append() for one device of a MultiRecorder
+
+    def __init__(self, owner, name):
+        self.owner = owner
+        self.name = name
+
+    def append(self, data, timestamp, params):
+        return self.owner._append(self.name, data, timestamp, params)
+
+
+class DeviceManager:
+    # Ordered set of named spectrometers. Names are unique and used for
+    # file names, plot legends and aligned frame sets.
+
+    def __init__(self):
+        self.devices = collections.OrderedDict()
+
+    def __len__(self):
+        return len(self.devices)
+
+    def __iter__(self):
+        return iter(self.devices.values())
+
+    def __contains__(self, name):
+        return name in self.devices
+
+    def get(self, name):
+        return self.devices.get(name)
+
+    def names(self):
+        return list(self.devices)
+
+    def add(self, name, port_name, **kwargs):
+        if name in self.devices:
+            raise ValueError(f"Device name '{name}' already in use")
+        for dev in self.devices.values():
+            if dev.port_name == port_name and not is_virtual_port(port_name):
+                raise ValueError(f"Port {port_name} already used by '{dev.name}'")
+        dev = Spectrometer(name, port_name, **kwargs)
+        self.devices[name] = dev
+        return dev
+
+    def remove(self, name):
+        dev = self.devices.pop(name, None)
+        if dev is not None:
+            dev.close()
+        return dev
+
+    def open_devices(self):
+        return [dev for dev in self.devices.values() if dev.is_open]
+
+    def close_all(self):
+        for dev in self.devices.values():
+            dev.close()
+
+    def aligner(self, tolerance_s=0.05, max_wait_s=1.0):
+        return FrameAligner([dev.name for dev in self.open_devices()], tolerance_s, max_wait_s)
@@ -0,0 +1,130 @@
+import csv
+import json
+import math
+import time
+
+
+class LatencyHistogram:
+    # Fixed log-spaced bins from min_s to max_s; recording is a log10 and a
+    # list increment, percentiles are read back from the cumulative counts
+    # (accurate to one bin, ~12% with the default 20 bins per decade).
+
+    def __init__(self, min_s=1e-6, max_s=100.0, bins_per_decade=20):
+        self.min_s = min_s
+        self.bins_per_decade = bins_per_decade
+        self._log_min = math.log10(min_s)
+        self.n_bins = int(math.ceil((math.log10(max_s) - self._log_min) * bins_per_decade)) + 1
+        self.reset()
+
+    def reset(self):
+        self.counts = [0] * self.n_bins
+        self.count = 0
+        self.total = 0.0
+        self.max = 0.0
+
+    def record(self, seconds):
+        if seconds <= self.min_s:
+            i = 0
+        else:
+            i = min(self.n_bins - 1, int((math.log10(seconds) - self._log_min) * self.bins_per_decade))
+        self.counts[i] += 1
+        self.count += 1
+        self.total += seconds
+        if seconds > self.max:
+            self.max = seconds
+
+    def _bin_value(self, i):
+        # Geometric centre of bin i
+        return 10 ** (self._log_min + (i + 0.5) / self.bins_per_decade)
+
+    def percentile(self, q):
+        if self.count == 0:
+            return 0.0
+        target = q / 100.0 * self.count
+        running = 0
+        for i, c in enumerate(self.counts):
+            running += c
+            if running >= target and c:
+                return min(self._bin_value(i), self.max)
+        return self.max
+
+    def summary(self):
+        return {
+            'count': self.count,
+            'mean_ms': 1000.0 * self.total / self.count if self.count else 0.0,
+            'p50_ms': 1000.0 * self.percentile(50),
+            'p95_ms': 1000.0 * self.percentile(95),
+            'p99_ms': 1000.0 * self.percentile(99),
+            'max_ms': 1000.0 * self.max,
+        }
+
+
+class LatencyMonitor:
+    STAGES = (
+        'command_send',
+        'header_wait',
+        'payload_read',
+        'decode',
+        'dispatch',
+        'background',
+        'live_processing',
+        'axis',
+        'update_plot',
+        'process_events',
+    )
+
+    def __init__(self, stages=STAGES):
+        self.enabled = True
+        self.histograms = {name: LatencyHistogram() for name in stages}
+        self.started = time.time()
+
+    def record(self, stage, seconds):
+        if self.enabled:
+            self.histograms[stage].record(seconds)
+
+    def reset(self):
+        for h in self.histograms.values():
+            h.reset()
+        self.started = time.time()
+
+    def summary(self):
+        return {name: h.summary() for name, h in self.histograms.items()}
+
+    def dump(self, path):
+        rows = self.summary()
+        if path.lower().endswith('.json'):
+            with open(path, 'w') as f:
+                json.dump({'started': self.started, 'dumped': time.time(), 'stages': rows}, f, indent=2)
+        else:
+            with open(path, 'w', newline='') as f:
+                writer = csv.writer(f)
+                writer.writerow(['stage', 'count', 'mean_ms', 'p50_ms', 'p95_ms', 'p99_ms', 'max_ms'])
+                for name, r in rows.items():
+                    writer.writerow([name, r['count']] + [f"{r[k]:.4f}" for k in
+                                                          ('mean_ms', 'p50_ms', 'p95_ms', 'p99_ms', 'max_ms')])
+
+
+class StartupProfile:
+    # Wall-clock breakdown of application start. mark() closes the stage
+    # that began at the previous mark; add() records a stage timed on its
+    # own, e.g. a load running on a background thread.
+
+    def __init__(self, t0=None):
+        self.t0 = time.perf_counter() if t0 is None else t0
+        self._last = self.t0
+        self.stages = []
+
+    def mark(self, name):
+        now = time.perf_counter()
+        self.stages.append((name, now - self._last))
+        self._last = now
+        return now - self.t0
+
+    def add(self, name, seconds):
+        self.stages.append((name, seconds))
+
+    def elapsed(self):
+        return time.perf_counter() - self.t0
+
+    def report(self):
+        return [f"{name:<28} {1000.0 * s:8.1f} ms" for name, s in self.stages]
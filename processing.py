@@ -0,0 +1,593 @@
+import collections
+import functools
+import math
+import time
+
+import numpy as np
+
+from baselines import WhittakerBaseline
+from resultcache import content_key
+
+
+class SpectrumAccumulator:
+    # Running per-pixel mean / variance / min / max (Welford) over a block of
+    # frames. A block ends after `target_frames` frames or `window_s` seconds,
+    # whichever comes first (0 disables that limit). Memory is a handful of
+    # arrays of n_points, independent of the number of frames accumulated.
+
+    def __init__(self, n_points, target_frames=10, window_s=0.0, dtype=np.float64):
+        self.n_points = n_points
+        self.target_frames = target_frames
+        self.window_s = window_s
+        self.dtype = dtype
+        self.mean = np.zeros(n_points, dtype=dtype)
+        self._m2 = np.zeros(n_points, dtype=dtype)
+        self.min = np.empty(n_points, dtype=dtype)
+        self.max = np.empty(n_points, dtype=dtype)
+        self._delta = np.empty(n_points, dtype=dtype)
+        self._tmp = np.empty(n_points, dtype=dtype)
+        self.reset()
+
+    def reset(self):
+        self.count = 0
+        self.started = None
+        self.mean.fill(0)
+        self._m2.fill(0)
+        self.min.fill(np.inf)
+        self.max.fill(-np.inf)
+
+    def add(self, frame):
+        if self.started is None:
+            self.started = time.time()
+        self.count += 1
+        delta = self._delta
+        np.subtract(frame, self.mean, out=delta)
+        np.multiply(delta, 1.0 / self.count, out=self._tmp)
+        self.mean += self._tmp
+        np.subtract(frame, self.mean, out=self._tmp)
+        self._tmp *= delta
+        self._m2 += self._tmp
+        np.minimum(self.min, frame, out=self.min)
+        np.maximum(self.max, frame, out=self.max)
+
+    def is_complete(self):
+        if self.count == 0:
+            return False
+        if self.target_frames and self.count >= self.target_frames:
+            return True
+        if self.window_s and time.time() - self.started >= self.window_s:
+            return True
+        return False
+
+    def variance(self):
+        if self.count < 2:
+            return np.zeros(self.n_points, dtype=self.dtype)
+        return self._m2 / (self.count - 1)
+
+    def std(self):
+        return np.sqrt(self.variance())
+
+    def sem(self):
+        # Standard error of the accumulated mean
+        if self.count < 2:
+            return np.zeros(self.n_points, dtype=self.dtype)
+        return np.sqrt(self._m2 / ((self.count - 1) * self.count))
+
+    def snr(self):
+        # Per-pixel SNR of the accumulated mean (mean / standard error)
+        sem = self.sem()
+        with np.errstate(divide='ignore', invalid='ignore'):
+            return np.where(sem > 0, self.mean / sem, 0.0)
+
+
+AutoExposureResult = collections.namedtuple(
+    "AutoExposureResult", ["integration_time", "peak", "converged", "probes"]
+)
+
+
+class AutoExposure:
+    # Searches the integration time at which the brightest pixels reach
+    # `target_fill` of the saturation level. Signal above the dark level is
+    # taken to grow linearly with exposure: unsaturated probes fit
+    # peak = dark + slope * t (the first one estimates dark from the low end
+    # of the frame), saturated probes cap the search from above, and the next
+    # probe is the model prediction kept inside the [unsaturated, saturated]
+    # bracket, falling back to bisection (geometric mean) when the model
+    # points outside it. Stops after `max_probes` frames.
+
+    def __init__(self, saturation=60000, target_fill=0.7, tolerance=0.1,
+                 min_time=1, max_time=10000, max_probes=6, peak_pixels=3):
+        self.saturation = saturation
+        self.target_fill = target_fill
+        self.tolerance = tolerance
+        self.min_time = min_time
+        self.max_time = max_time
+        self.max_probes = max_probes
+        self.peak_pixels = peak_pixels
+
+    def peak_level(self, frame):
+        # k-th brightest pixel, so a single hot pixel or spike does not count
+        k = min(self.peak_pixels, len(frame))
+        return float(np.partition(frame, -k)[-k])
+
+    def dark_level(self, frame):
+        k = len(frame) // 100
+        return float(np.partition(frame, k)[k])
+
+    def _clip(self, t):
+        return int(min(self.max_time, max(self.min_time, round(t))))
+
+    def run(self, probe, start_time):
+        # probe(t) acquires one frame at integration time t (or returns None)
+        target = self.target_fill * self.saturation
+        lo = hi = None
+        unsaturated = []
+        probes = []
+        t = self._clip(start_time)
+        converged = False
+        for _ in range(self.max_probes):
+            frame = probe(t)
+            if frame is None:
+                break
+            peak = self.peak_level(frame)
+            saturated = peak >= self.saturation
+            probes.append((t, peak, saturated))
+            if saturated:
+                hi = t if hi is None else min(hi, t)
+            else:
+                lo = t if lo is None else max(lo, t)
+                unsaturated.append((t, peak, self.dark_level(frame)))
+                if abs(peak - target) <= self.tolerance * target:
+                    converged = True
+                    break
+
+            if saturated:
+                next_t = math.sqrt(lo * hi) if lo is not None else t / 4.0
+            else:
+                (t1, p1, dark), t2 = unsaturated[-1], None
+                for t0, p0, _ in reversed(unsaturated[:-1]):
+                    if t0 != t1:
+                        t2, p2 = t0, p0
+                        break
+                if t2 is not None and p1 != p2:
+                    slope = (p1 - p2) / (t1 - t2)
+                    dark = p1 - slope * t1
+                else:
+                    slope = (p1 - dark) / t1
+                next_t = (target - dark) / slope if slope > 0 else t * 4.0
+                if hi is not None and next_t >= hi:
+                    next_t = math.sqrt(lo * hi)
+            next_t = self._clip(next_t)
+            if next_t == t or (hi is not None and next_t >= hi):
+                break
+            t = next_t
+
+        if converged:
+            return AutoExposureResult(t, probes[-1][1], True, probes)
+        if unsaturated:
+            best = min(unsaturated, key=lambda u: abs(u[1] - target))
+            return AutoExposureResult(best[0], best[1], False, probes)
+        return AutoExposureResult(self.min_time, None, False, probes)
+
+
+class SpikeFilter:
+    # Cosmic-ray / spike removal. A single frame is compared with its running
+    # median; pixels more than `threshold` noise sigmas above it are
+    # spike candidates. Real peaks are wider than the median window and
+    # leave only a fraction of their height in the residual, so a candidate
+    # must also carry at least `sharpness` of its height above the local
+    # minimum and belong to a run of at most `max_width` pixels. Narrow
+    # Raman lines (1-2 px) can pass both tests, so a run is also kept when
+    # both neighbours of its highest pixel stand at least `shoulder` of its
+    # height above the local minimum: a cosmic ray drops to the baseline on
+    # at least one side, a line shape falls off on both. A symmetric
+    # three-pixel spike is kept too; lines narrower than ~0.8 px sigma can
+    # still be clipped. Spikes are replaced by linear interpolation.
+    # In temporal mode the last `history` frames are kept and a pixel is a
+    # spike when it exceeds its per-pixel temporal median by `threshold`
+    # sigmas; it is replaced by that median. Indices of the replaced pixels
+    # are kept in `last_spikes` and, per frame, in `log`.
+
+    def __init__(self, threshold=6.0, window=7, max_width=3, sharpness=0.5, shoulder=0.25, history=5,
+                 temporal=False):
+        self.threshold = threshold
+        self.window = window
+        self.sharpness = sharpness
+        self.max_width = max_width
+        self.shoulder = shoulder
+        self.history = history
+        self.temporal = temporal
+        self.log = collections.deque(maxlen=1000)
+        self.reset()
+
+    def reset(self):
+        self._stack = None
+        self._filled = 0
+        self._next = 0
+        self.frames = 0
+        self.spikes = 0
+        self.last_spikes = np.zeros(0, dtype=np.intp)
+
+    @staticmethod
+    def noise_sigma(frame):
+        # Robust noise estimate from second differences, blind to slopes
+        d2 = frame[:-2] - 2.0 * frame[1:-1] + frame[2:]
+        return 1.4826 * np.median(np.abs(d2)) / np.sqrt(6.0)
+
+    def _narrow_runs(self, mask, height):
+        # Keep only runs of True no longer than max_width whose highest
+        # pixel lacks a shoulder on at least one side
+        edges = np.diff(np.concatenate(([0], mask.view(np.int8), [0])))
+        starts = np.flatnonzero(edges == 1)
+        ends = np.flatnonzero(edges == -1)
+        keep = (ends - starts) <= self.max_width
+        if self.shoulder > 0:
+            for k in np.flatnonzero(keep):
+                top = starts[k] + np.argmax(height[starts[k]:ends[k]])
+                left = height[top - 1] if top > 0 else 0.0
+                right = height[top + 1] if top + 1 < len(height) else 0.0
+                if min(left, right) >= self.shoulder * height[top]:
+                    keep[k] = False
+        out = np.zeros_like(mask)
+        if keep.any():
+            idx = np.concatenate([np.arange(a, b) for a, b in zip(starts[keep], ends[keep])])
+            out[idx] = True
+        return out
+
+    def spike_mask(self, frame):
+        # scipy.ndimage takes ~0.4 s to import; only pay for it once the
+        # filter is actually used
+        from scipy.ndimage import median_filter, minimum_filter
+        frame = np.asarray(frame, dtype=np.float64)
+        residual = frame - median_filter(frame, size=self.window, mode='nearest')
+        sigma = self.noise_sigma(frame)
+        if sigma <= 0:
+            sigma = 1.0
+        mask = residual > self.threshold * sigma
+        if not mask.any():
+            return mask
+        height = frame - minimum_filter(frame, size=4 * self.window + 1, mode='nearest')
+        mask &= residual > self.sharpness * height
+        return self._narrow_runs(mask, height)
+
+    def temporal_mask(self, frames):
+        # frames: (n, points); returns the spike mask and the temporal median
+        med = np.median(frames, axis=0)
+        sigma = 1.4826 * np.median(np.abs(frames - med), axis=0)
+        # Pixels whose few samples happen to agree must not get a tiny sigma
+        np.maximum(sigma, np.median(sigma), out=sigma)
+        sigma[sigma <= 0] = 1.0
+        return frames - med > self.threshold * sigma, med
+
+    def filter(self, frame, out=None, temporal=None):
+        # Returns (cleaned float64 frame, indices of replaced pixels); pass
+        # temporal=False to test a frame on its own, e.g. scan points
+        frame = np.asarray(frame, dtype=np.float64)
+        if out is None:
+            out = frame.copy()
+        elif out is not frame:
+            np.copyto(out, frame)
+        if temporal is None:
+            temporal = self.temporal
+        if temporal:
+            spikes = self._filter_temporal(frame, out)
+        else:
+            mask = self.spike_mask(frame)
+            spikes = np.flatnonzero(mask)
+            if len(spikes) and len(spikes) < len(frame):
+                good = np.flatnonzero(~mask)
+                out[spikes] = np.interp(spikes, good, frame[good])
+        self.frames += 1
+        self.spikes += len(spikes)
+        self.last_spikes = spikes
+        if len(spikes):
+            self.log.append((time.time(), spikes))
+        return out, spikes
+
+    def _filter_temporal(self, frame, out):
+        n = len(frame)
+        if self._stack is None or self._stack.shape[1] != n or len(self._stack) != self.history:
+            self._stack = np.empty((self.history, n), dtype=np.float64)
+            self._filled = 0
+            self._next = 0
+        self._stack[self._next] = frame
+        self._next = (self._next + 1) % self.history
+        self._filled = min(self._filled + 1, self.history)
+        if self._filled < 3:
+            # Not enough history yet: single-frame test
+            mask = self.spike_mask(frame)
+            spikes = np.flatnonzero(mask)
+            if len(spikes) and len(spikes) < n:
+                good = np.flatnonzero(~mask)
+                out[spikes] = np.interp(spikes, good, frame[good])
+            return spikes
+        mask, med = self.temporal_mask(self._stack[:self._filled])
+        # Only the newest frame is corrected; a spike stays in the stack but
+        # cannot move the median of the other frames
+        newest = mask[(self._next - 1) % self.history]
+        spikes = np.flatnonzero(newest)
+        out[spikes] = med[spikes]
+        return spikes
+
+    def filter_stack(self, frames):
+        # Batch temporal filtering of an (n, points) stack, e.g. a recording
+        frames = np.asarray(frames, dtype=np.float64)
+        mask, med = self.temporal_mask(frames)
+        cleaned = np.where(mask, med[None, :], frames)
+        return cleaned, mask
+
+
+@functools.lru_cache(maxsize=64)
+def savgol_kernels(window, polyorder, deriv=0):
+    # Savitzky-Golay weights for derivative order `deriv` (per sample):
+    # the correlation kernel of the interior and the matrices mapping the
+    # first / last window to that derivative of its least-squares
+    # polynomial at the edge samples, as savgol_filter(mode='interp')
+    # fits per call. Cached and read-only.
+    from scipy.signal import savgol_coeffs
+    if window % 2 == 0 or window <= polyorder:
+        raise ValueError(f"SavGol window {window} must be odd and greater than poly order {polyorder}")
+    if deriv > polyorder:
+        raise ValueError(f"SavGol derivative {deriv} is above poly order {polyorder}")
+    kernel = savgol_coeffs(window, polyorder, deriv=deriv, use='dot')
+    t = np.arange(window, dtype=np.float64)
+    powers = np.arange(polyorder, -1, -1)
+    vander = t[:, None] ** powers
+    # d^deriv/dt^deriv of each column t**k: k!/(k-deriv)! t**(k-deriv)
+    falling = np.array([math.perm(k, deriv) for k in powers], dtype=np.float64)
+    dvander = falling * t[:, None] ** np.maximum(powers - deriv, 0)
+    fit = dvander @ np.linalg.pinv(vander)
+    half = window // 2
+    left = np.ascontiguousarray(fit[:half].T)
+    right = np.ascontiguousarray(fit[window - half:].T)
+    for a in (kernel, left, right):
+        a.setflags(write=False)
+    return kernel, left, right
+
+
+class SavGolFilter:
+    # savgol_filter(mode='interp') along the last axis of one spectrum or an
+    # (n_spectra, n_points) stack: one correlation over the whole matrix
+    # plus two small matrix products for the edges, with the kernels taken
+    # from the savgol_kernels cache. derivatives() gives the smoothed
+    # spectrum and its derivatives together; with a spectral axis they are
+    # per axis unit, including non-uniform axes (chain rule on the
+    # pixel-index derivatives of the axis).
+
+    def __init__(self, window, polyorder):
+        self.window = window
+        self.polyorder = polyorder
+        savgol_kernels(window, polyorder)
+
+    def filter(self, y, deriv=0):
+        # Smoothed spectrum (deriv=0) or its derivative per sample
+        from scipy.ndimage import correlate1d
+        y = np.asarray(y, dtype=np.float64)
+        if y.shape[-1] < self.window:
+            raise ValueError(f"SavGol window {self.window} is longer than the spectrum ({y.shape[-1]} points)")
+        kernel, left, right = savgol_kernels(self.window, self.polyorder, deriv)
+        out = correlate1d(y, kernel, axis=-1, mode='constant')
+        window, half = self.window, self.window // 2
+        out[..., :half] = y[..., :window] @ left
+        out[..., -half:] = y[..., -window:] @ right
+        return out
+
+    def derivatives(self, y, axis=None, order=2):
+        # [smoothed, d1, ..., d_order]; per axis unit when `axis` is given
+        # (order up to 2)
+        out = [self.filter(y, d) for d in range(order + 1)]
+        if axis is None or order == 0:
+            return out
+        if order > 2:
+            raise ValueError("Derivatives along an axis are available up to order 2")
+        x1, x2 = self.axis_derivatives(axis)
+        if order == 2:
+            # d2y/dx2 = (y'' - y' x''/x') / x'^2 with ' = d/d(index)
+            out[2] = (out[2] - out[1] * (x2 / x1)) / (x1 * x1)
+        out[1] = out[1] / x1
+        return out
+
+    def axis_derivatives(self, axis):
+        # First and second pixel-index derivatives of the axis
+        axis = np.asarray(axis, dtype=np.float64)
+        return self.filter(axis, 1), self.filter(axis, 2)
+
+
+class ProcessingChain:
+    # Crop / Savitzky-Golay / ASLS or arPLS baseline / normalization compiled
+    # once for a fixed spectral axis; same results as the equivalent ramanspy
+    # pipeline (Cropper, SavGol, ASLS/ARPLS, MinMax/Vector) without
+    # rebuilding it per spectrum. Crop is a slice; SavGol is a SavGolFilter
+    # (cached kernels and scipy 'interp' edge fits), optionally giving the
+    # first or second derivative spectrum instead of the smoothed one;
+    # the baseline is a WhittakerBaseline on the cached banded lam*D'D
+    # (warm_start carries its weights from one call to the next, e.g.
+    # between live frames). Every step works on one spectrum or on an
+    # (n_spectra, n_points) stack along the last axis, so a whole batch on
+    # a shared axis is processed with array operations.
+
+    def __init__(self, axis, crop=None, savgol=None, baseline_method=None, normalize=None,
+                 baseline_lam=None, baseline_p=1e-2, baseline_max_iter=50, baseline_tol=1e-3,
+                 warm_start=False, batch_rows=256):
+        self.source_axis = axis
+        self.params = {'crop': crop, 'savgol': savgol, 'baseline_method': baseline_method, 'normalize': normalize}
+        axis = np.asarray(axis, dtype=np.float64)
+        if crop is not None:
+            lo, hi = sorted(crop)
+            keep = np.flatnonzero((axis >= lo) & (axis <= hi))
+            if keep.size == 0:
+                raise ValueError(f"Crop region {lo}-{hi} does not overlap the spectral axis")
+            # A monotonic axis keeps one contiguous run, so cropping is a view
+            contiguous = keep[-1] - keep[0] + 1 == keep.size
+            self.crop = slice(keep[0], keep[-1] + 1) if contiguous else keep
+        else:
+            self.crop = slice(None)
+        self.axis = axis[self.crop]
+        self.axis.setflags(write=False)
+        n = len(self.axis)
+
+        self.savgol = savgol
+        if savgol is not None:
+            # (window, polyorder) smooths; a third item 1 or 2 outputs that
+            # derivative per axis unit instead
+            window, poly, *deriv = savgol
+            self.savgol_deriv = deriv[0] if deriv else 0
+            if self.savgol_deriv not in (0, 1, 2):
+                raise ValueError(f"SavGol derivative must be 0, 1 or 2, not {self.savgol_deriv}")
+            savgol_kernels(window, poly, self.savgol_deriv)
+            if window > n:
+                raise ValueError(f"SavGol window {window} is longer than the spectrum ({n} points)")
+            self.savgol_filter = SavGolFilter(window, poly)
+
+        self.baseline_method = baseline_method
+        if baseline_method is not None:
+            self.baseline_solver = WhittakerBaseline(
+                n, baseline_method, lam=baseline_lam, p=baseline_p, max_iter=baseline_max_iter,
+                tol=baseline_tol, batch_rows=batch_rows, warm_start=warm_start
+            )
+        if normalize not in (None, 'MinMax', 'Vector'):
+            raise ValueError(f"Unknown normalization {normalize!r}")
+        self.normalize = normalize
+
+    def apply(self, spectra):
+        y = self.cropped(spectra)
+        if self.savgol is not None:
+            y = self.derivative(y) if self.savgol_deriv else self.smooth(y)
+        if self.baseline_method is not None:
+            y = y - self.baseline(y)
+        if self.normalize is not None:
+            y = self.normalized(y)
+        return y
+
+    def cropped(self, spectra):
+        return np.asarray(spectra, dtype=np.float64)[..., self.crop]
+
+    def smooth(self, y):
+        return self.savgol_filter.filter(y)
+
+    def derivative(self, y):
+        return self.savgol_filter.derivatives(y, self.axis, self.savgol_deriv)[-1]
+
+    def normalized(self, y):
+        if self.normalize == 'MinMax':
+            lo = y.min(axis=-1, keepdims=True)
+            return (y - lo) / (y.max(axis=-1, keepdims=True) - lo)
+        return y / np.linalg.norm(y, axis=-1, keepdims=True)
+
+    def baseline(self, y):
+        return self.baseline_solver.fit(y)
+
+
+class StageGraph:
+    # Processing as named stages, each a function of its own parameters and
+    # of the outputs of the stages it depends on. Outputs are memoized with
+    # the parameters they were computed from: set_params() with different
+    # content (compared by content_key, or by an explicit token for
+    # objects too large to hash) invalidates that stage and everything
+    # downstream, and get() reruns only invalid stages on the way to the one
+    # asked for. A stage without a function is a source whose output is
+    # its parameters. `last_run` lists the stages computed by the last get().
+
+    def __init__(self):
+        self.stages = collections.OrderedDict()
+        self.last_run = []
+
+    def add_stage(self, name, func=None, deps=()):
+        # func(params, *outputs of deps); deps must already exist
+        for dep in deps:
+            if dep not in self.stages:
+                raise KeyError(f"Unknown stage {dep!r}")
+        self.stages[name] = {'func': func, 'deps': tuple(deps), 'params': None, 'key': None,
+                             'value': None, 'valid': False}
+
+    def downstream(self, name):
+        # `name` and every stage depending on it, in insertion (topological) order
+        found = [name]
+        for other, stage in self.stages.items():
+            if any(dep in found for dep in stage['deps']):
+                found.append(other)
+        return found
+
+    def set_params(self, name, params, token=None):
+        # Returns True when the parameters changed
+        stage = self.stages[name]
+        key = content_key(params) if token is None else ('token', token)
+        if stage['key'] == key:
+            return False
+        stage['params'] = params
+        stage['key'] = key
+        self.invalidate(name)
+        return True
+
+    def invalidate(self, name):
+        for other in self.downstream(name):
+            stage = self.stages[other]
+            stage['valid'] = False
+            stage['value'] = None
+
+    def get(self, name):
+        self.last_run = []
+        return self._get(name)
+
+    def _get(self, name):
+        stage = self.stages[name]
+        if not stage['valid']:
+            if stage['func'] is None:
+                value = stage['params']
+            else:
+                inputs = [self._get(dep) for dep in stage['deps']]
+                value = stage['func'](stage['params'], *inputs)
+                self.last_run.append(name)
+            stage['value'] = value
+            stage['valid'] = True
+        return stage['value']
+
+
+# Stages of a ProcessingChain as a StageGraph: 'source' is (axis, spectra)
+# and each step passes (axis, spectra) on, so a changed setting reruns only
+# its own step and the ones after it
+SPECTRUM_STAGES = ('crop', 'savgol', 'baseline', 'normalize')
+
+
+def _crop_stage(crop, source):
+    chain = ProcessingChain(source[0], crop=crop)
+    return chain.axis, chain.cropped(source[1])
+
+
+def _savgol_stage(savgol, data):
+    if savgol is None:
+        return data
+    return data[0], ProcessingChain(data[0], savgol=savgol).apply(data[1])
+
+
+def _baseline_stage(params, data):
+    if params['baseline_method'] is None:
+        return data
+    return data[0], ProcessingChain(data[0], **params).apply(data[1])
+
+
+def _normalize_stage(normalize, data):
+    if normalize is None:
+        return data
+    return data[0], ProcessingChain(data[0], normalize=normalize).apply(data[1])
+
+
+def spectrum_graph():
+    graph = StageGraph()
+    graph.add_stage('source')
+    graph.add_stage('crop', _crop_stage, ('source',))
+    graph.add_stage('savgol', _savgol_stage, ('crop',))
+    graph.add_stage('baseline', _baseline_stage, ('savgol',))
+    graph.add_stage('normalize', _normalize_stage, ('baseline',))
+    return graph
+
+
+def set_spectrum_params(graph, params):
+    # Spreads ProcessingChain keyword arguments over the spectrum stages
+    params = dict(params)
+    graph.set_params('crop', params.pop('crop', None))
+    graph.set_params('savgol', params.pop('savgol', None))
+    normalize = params.pop('normalize', None)
+    params.setdefault('baseline_method', None)
+    graph.set_params('baseline', params)
+    graph.set_params('normalize', normalize)
@@ -0,0 +1,138 @@
+import collections
+import hashlib
+import sys
+
+import numpy as np
+
+
+def content_key(*parts):
+    # Hex digest over the content of `parts`: arrays by dtype, shape and
+    # bytes, dicts by sorted items, sequences item by item, anything else
+    # by repr (exact for floats). Equal spectra and settings give the same
+    # key whatever object holds them.
+    h = hashlib.blake2b(digest_size=16)
+    for part in parts:
+        _feed(h, part)
+    return h.hexdigest()
+
+
+def _feed(h, value):
+    if isinstance(value, np.ndarray):
+        h.update(f"a{value.dtype.str}{value.shape}".encode())
+        h.update(np.ascontiguousarray(value).tobytes())
+    elif isinstance(value, dict):
+        h.update(f"d{len(value)}".encode())
+        for k in sorted(value, key=repr):
+            _feed(h, k)
+            _feed(h, value[k])
+    elif isinstance(value, (list, tuple)):
+        h.update(f"s{len(value)}".encode())
+        for item in value:
+            _feed(h, item)
+    else:
+        h.update(f"v{value!r};".encode())
+
+
+def sizeof(value):
+    # Approximate bytes held by a cached value
+    if isinstance(value, np.ndarray):
+        return value.nbytes
+    if isinstance(value, (list, tuple)):
+        return sys.getsizeof(value) + sum(sizeof(v) for v in value)
+    if isinstance(value, dict):
+        return sys.getsizeof(value) + sum(sizeof(v) for v in value.values())
+    if hasattr(value, 'memory_usage') and hasattr(value, 'select_dtypes'):
+        # DataFrame: object columns hold arrays (often views, which
+        # memory_usage(deep=True) counts as a bare header) and strings
+        size = int(value.memory_usage().sum())
+        for column in value.select_dtypes(include='object'):
+            size += sum(sizeof(v) for v in value[column])
+        return size
+    return sys.getsizeof(value)
+
+
+def _freeze(value):
+    # Cached arrays are shared by every hit, so nobody may write to them
+    if isinstance(value, np.ndarray):
+        value.setflags(write=False)
+    elif isinstance(value, (list, tuple)):
+        for v in value:
+            _freeze(v)
+    return value
+
+
+class ResultCache:
+    # Bounded LRU of processing results keyed by content_key(). Evicts the
+    # least recently used entries once either max_bytes (sizeof estimate)
+    # or max_entries is exceeded; a value larger than max_bytes is not
+    # stored at all. Arrays in stored values are made read-only.
+
+    def __init__(self, max_bytes=256 * 1024 * 1024, max_entries=512):
+        self.max_bytes = max_bytes
+        self.max_entries = max_entries
+        self.entries = collections.OrderedDict()
+        self.nbytes = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def __len__(self):
+        return len(self.entries)
+
+    def __contains__(self, key):
+        return key in self.entries
+
+    def get(self, key, default=None):
+        entry = self.entries.get(key)
+        if entry is None:
+            self.misses += 1
+            return default
+        self.entries.move_to_end(key)
+        self.hits += 1
+        return entry[0]
+
+    def put(self, key, value):
+        size = sizeof(value)
+        self.discard(key)
+        if size > self.max_bytes:
+            return value
+        self.entries[key] = (_freeze(value), size)
+        self.nbytes += size
+        self._evict()
+        return value
+
+    def discard(self, key):
+        entry = self.entries.pop(key, None)
+        if entry is not None:
+            self.nbytes -= entry[1]
+
+    def resize(self, max_bytes=None, max_entries=None):
+        if max_bytes is not None:
+            self.max_bytes = max_bytes
+        if max_entries is not None:
+            self.max_entries = max_entries
+        self._evict()
+
+    def _evict(self):
+        while self.entries and (self.nbytes > self.max_bytes or len(self.entries) > self.max_entries):
+            _, (_, size) = self.entries.popitem(last=False)
+            self.nbytes -= size
+            self.evictions += 1
+
+    def clear(self):
+        self.entries.clear()
+        self.nbytes = 0
+
+    def reset_stats(self):
+        self.hits = self.misses = self.evictions = 0
+
+    def summary(self):
+        lookups = self.hits + self.misses
+        return {
+            'entries': len(self.entries),
+            'bytes': self.nbytes,
+            'hits': self.hits,
+            'misses': self.misses,
+            'hit_rate': self.hits / lookups if lookups else 0.0,
+            'evictions': self.evictions,
+        }
@@ -0,0 +1,420 @@
+import argparse
+import heapq
+import os
+import sys
+import threading
+import time
+
+import numpy as np
+from serial.serialutil import SerialBase, PortNotOpenError
+
+from acquisition import N_PIXELS, FrameReader, frame_checksum
+
+
+VIRTUAL_PORT_PREFIX = "sim://"
+
+
+def _packet(cmd, d1=0, d2=0):
+    pkt = bytearray([0x81, cmd, d1 & 0xFF, d2 & 0xFF])
+    pkt.append(sum(pkt) & 0xFF)
+    return bytes(pkt)
+
+
+class VirtualSpectrometer(SerialBase):
+    # Software stand-in for the spectrometer that speaks the same binary
+    # protocol over a pyserial-compatible interface. Frames are synthesized
+    # from a dark level, a broad fluorescence background, Gaussian Raman
+    # peaks and shot/read noise; latency, corrupt bytes and stray bytes can
+    # be injected to exercise the parser.
+    #
+    # In trigger mode 1 or 2 a start command (0x02) arms the detector and a
+    # simulated external source fires every trigger_period seconds (plus
+    # Gaussian jitter); a trigger that arrives while the previous exposure
+    # is still running is missed, as are trigger_drop_prob of the pulses.
+    #
+    # Open it through the normal port path with a "sim://" port name, or
+    # expose it as a real tty with serve_pty().
+
+    def __init__(self, *args, integration_time=100, noise=20.0, dark_level=800.0,
+                 peaks=((420, 12000.0, 4.0), (760, 6000.0, 6.0), (1310, 9000.0, 5.0)),
+                 fluorescence=4000.0, latency=0.002, corrupt_prob=0.0, garbage_prob=0.0,
+                 trigger_period=0.01, trigger_jitter=0.0, trigger_drop_prob=0.0,
+                 realtime=True, seed=None, **kwargs):
+        self.integration_time = integration_time
+        self.integration_unit = 0x00
+        self.noise = noise
+        self.dark_level = dark_level
+        self.peaks = list(peaks)
+        self.fluorescence = fluorescence
+        self.latency = latency
+        self.corrupt_prob = corrupt_prob
+        self.garbage_prob = garbage_prob
+        self.realtime = realtime
+        self.trigger_period = trigger_period
+        self.trigger_jitter = trigger_jitter
+        self.trigger_drop_prob = trigger_drop_prob
+        self.triggers_missed = 0
+        self._busy_until = 0.0
+        self._next_trigger = 0.0
+        self.average = 1
+        self.gain = 128
+        self.offset = 0
+        self.laser_mv = 0
+        self.trigger_out = 0
+        self.trigger_mode = 0
+        self.smoothing = 6
+        self.calib = {g: bytes(64) for g in (1, 2, 3)}
+        self.commands_received = 0
+        self.frames_sent = 0
+        self._rng = np.random.default_rng(seed)
+        self._pixels = np.arange(N_PIXELS, dtype=np.float64)
+        self._rx = bytearray()
+        self._tx = bytearray()
+        self._cond = threading.Condition()
+        self._events = []
+        self._event_seq = 0
+        self._continuous = False
+        self._cancel = False
+        self._thread = None
+        super().__init__(*args, **kwargs)
+
+    # ---- pyserial interface ----
+
+    def open(self):
+        if self.is_open:
+            return
+        self.is_open = True
+        self._thread = threading.Thread(target=self._run, daemon=True)
+        self._thread.start()
+
+    def close(self):
+        with self._cond:
+            self.is_open = False
+            self._continuous = False
+            self._events = []
+            self._cond.notify_all()
+        if self._thread is not None:
+            self._thread.join(timeout=1)
+            self._thread = None
+
+    def _reconfigure_port(self):
+        pass
+
+    @property
+    def in_waiting(self):
+        with self._cond:
+            return len(self._rx)
+
+    def read(self, size=1):
+        if not self.is_open:
+            raise PortNotOpenError()
+        deadline = None if self._timeout is None else time.time() + self._timeout
+        with self._cond:
+            while len(self._rx) < size and not self._cancel and self.is_open:
+                remaining = None if deadline is None else deadline - time.time()
+                if remaining is not None and remaining <= 0:
+                    break
+                self._cond.wait(remaining)
+            self._cancel = False
+            n = min(size, len(self._rx))
+            data = bytes(self._rx[:n])
+            del self._rx[:n]
+        return data
+
+    def write(self, data):
+        if not self.is_open:
+            raise PortNotOpenError()
+        with self._cond:
+            self._tx += data
+            self._parse_commands()
+            self._cond.notify_all()
+        return len(data)
+
+    def cancel_read(self):
+        with self._cond:
+            self._cancel = True
+            self._cond.notify_all()
+
+    def reset_input_buffer(self):
+        with self._cond:
+            self._rx.clear()
+
+    def reset_output_buffer(self):
+        pass
+
+    def flush(self):
+        pass
+
+    # ---- device side ----
+
+    def frame_period(self):
+        exposure = self.integration_time / (1000.0 if self.integration_unit == 0x00 else 1e6)
+        return exposure * max(1, self.average)
+
+    def _schedule(self, delay, payload):
+        # Called with self._cond held; payload is bytes or a callable returning bytes
+        self._event_seq += 1
+        due = time.time() + (delay if self.realtime else 0.0)
+        heapq.heappush(self._events, (due, self._event_seq, payload))
+        self._cond.notify_all()
+
+    def _reply(self, pkt):
+        self._schedule(self.latency, pkt)
+
+    def _parse_commands(self):
+        tx = self._tx
+        while tx:
+            if tx[0] != 0x81:
+                del tx[0]
+                continue
+            if len(tx) < 5:
+                return
+            if tx[1] == 0x28:
+                if len(tx) < 70:
+                    return
+                group = tx[2]
+                if group in self.calib:
+                    self.calib[group] = bytes(tx[5:69])
+                del tx[:70]
+                self.commands_received += 1
+                continue
+            if (tx[0] + tx[1] + tx[2] + tx[3]) & 0xFF != tx[4]:
+                del tx[0]
+                continue
+            cmd, d1, d2 = tx[1], tx[2], tx[3]
+            del tx[:5]
+            self.commands_received += 1
+            self._handle(cmd, d1, d2)
+
+    def _handle(self, cmd, d1, d2):
+        if cmd == 0x01:
+            self._schedule(self.latency + self.frame_period(), self._frame)
+        elif cmd == 0x02:
+            if not self._continuous:
+                self._continuous = True
+                if self.trigger_mode:
+                    self._busy_until = 0.0
+                    self._next_trigger = time.time()
+                    self._schedule_trigger()
+                else:
+                    self._schedule(self.latency + self.frame_period(), self._continuous_frame)
+        elif cmd == 0x06:
+            self._continuous = False
+            self._events = [e for e in self._events
+                            if e[2] != self._continuous_frame and e[2] != self._triggered_frame]
+            heapq.heapify(self._events)
+        elif cmd == 0x03:
+            self.integration_time = max(1, (d1 << 8) | d2)
+        elif cmd == 0x0A:
+            self._reply(_packet(0x02, self.integration_time >> 8, self.integration_time))
+        elif cmd == 0x11:
+            self.integration_unit = d1
+        elif cmd == 0x12:
+            self._reply(_packet(0x12, self.integration_unit, 0))
+        elif cmd == 0x04:
+            self.gain = d1
+        elif cmd == 0x05:
+            self.offset = d1 if d2 == 0x01 else -d1
+        elif cmd == 0x07:
+            self.trigger_mode = d1
+        elif cmd == 0x0C:
+            self.average = max(1, d1)
+        elif cmd == 0x0D:
+            self.laser_mv = (d1 << 8) | d2
+        elif cmd == 0x10:
+            self.trigger_out = d1
+        elif cmd == 0x23:
+            self._reply(_packet(0x23, self.gain, 0))
+        elif cmd == 0x24:
+            self._reply(_packet(0x24, abs(self.offset), 0x01 if self.offset >= 0 else 0x00))
+        elif cmd == 0x25:
+            if d1:
+                self.smoothing = d1
+            else:
+                self._reply(_packet(0x25, self.smoothing, 0))
+        elif cmd == 0x29:
+            if d1 in self.calib:
+                head = bytearray([0x81, 0x29, d1, 0x40])
+                head.append(sum(head) & 0xFF)
+                body = head + self.calib[d1]
+                self._reply(bytes(body) + bytes([sum(body) & 0xFF, 0x00]))
+
+    def spectrum(self):
+        exposure_scale = self.frame_period() / max(1, self.average) / 0.1
+        gain_scale = self.gain / 128.0
+        x = self._pixels
+        signal = self.fluorescence * np.exp(-0.5 * ((x - 900.0) / 700.0) ** 2)
+        if self.peaks:
+            p = np.asarray(self.peaks, dtype=np.float64)
+            signal = signal + np.sum(
+                p[:, 1:2] * np.exp(-0.5 * ((x[None, :] - p[:, 0:1]) / p[:, 2:3]) ** 2), axis=0
+            )
+        signal *= exposure_scale * gain_scale
+        noise = self.noise / np.sqrt(max(1, self.average))
+        y = self.dark_level + self.offset + signal + self._rng.normal(0.0, noise, N_PIXELS)
+        return np.clip(y, 0, 65535).astype('>u2')
+
+    def _frame(self):
+        payload = self.spectrum().tobytes()
+        crc = frame_checksum(payload)
+        frame = bytearray([0x81, 0x01, len(payload) >> 8, len(payload) & 0xFF, 0x00])
+        frame += payload
+        frame += bytes([crc >> 8, crc & 0xFF])
+        if self.corrupt_prob and self._rng.random() < self.corrupt_prob:
+            i = int(self._rng.integers(0, len(frame)))
+            frame[i] ^= 0xFF
+        if self.garbage_prob and self._rng.random() < self.garbage_prob:
+            frame[:0] = self._rng.integers(0, 256, int(self._rng.integers(1, 16)), dtype=np.uint8).tobytes()
+        self.frames_sent += 1
+        return bytes(frame)
+
+    def _continuous_frame(self):
+        if self._continuous:
+            self._schedule(self.frame_period(), self._continuous_frame)
+        return self._frame()
+
+    def _schedule_trigger(self):
+        # The trigger source keeps its own phase: late delivery of one pulse
+        # does not shift the following ones
+        self._next_trigger += self.trigger_period
+        due = self._next_trigger
+        if self.trigger_jitter:
+            due += self._rng.normal(0.0, self.trigger_jitter)
+        self._schedule(max(0.0, due - time.time()), self._triggered_frame)
+
+    def _triggered_frame(self):
+        # One external trigger edge: expose and send a frame unless the
+        # detector is still busy with the previous one or the pulse is lost
+        if not self._continuous:
+            return b''
+        self._schedule_trigger()
+        now = time.time()
+        if now < self._busy_until or (self.trigger_drop_prob and self._rng.random() < self.trigger_drop_prob):
+            self.triggers_missed += 1
+            return b''
+        self._busy_until = now + self.frame_period()
+        if self.realtime:
+            self._schedule(self.latency + self.frame_period(), self._frame)
+            return b''
+        return self._frame()
+
+    def _run(self):
+        while True:
+            with self._cond:
+                if not self.is_open:
+                    return
+                if not self._events:
+                    self._cond.wait()
+                    continue
+                due, _, payload = self._events[0]
+                wait = due - time.time()
+                if wait > 0:
+                    self._cond.wait(wait)
+                    continue
+                heapq.heappop(self._events)
+                self._rx += payload() if callable(payload) else payload
+                self._cond.notify_all()
+
+
+def is_virtual_port(port):
+    return bool(port) and port.startswith(VIRTUAL_PORT_PREFIX)
+
+
+def open_virtual_port(port=VIRTUAL_PORT_PREFIX + "spectrometer", baudrate=19200, timeout=10, **kwargs):
+    dev = VirtualSpectrometer(baudrate=baudrate, timeout=timeout, **kwargs)
+    dev.port = port
+    dev.open()
+    return dev
+
+
+def serve_pty(device):
+    # Bridges the virtual device to a pseudo-terminal (POSIX only) so any
+    # program can open it as a regular serial port. Returns the tty path.
+    import pty
+    import tty
+    master, slave = pty.openpty()
+    tty.setraw(slave)
+    path = os.ttyname(slave)
+
+    def host_to_device():
+        while device.is_open:
+            try:
+                data = os.read(master, 4096)
+            except OSError:
+                return
+            if data:
+                device.write(data)
+
+    def device_to_host():
+        device.timeout = 0.05
+        while device.is_open:
+            data = device.read(max(1, device.in_waiting))
+            if data:
+                try:
+                    os.write(master, data)
+                except OSError:
+                    return
+
+    threading.Thread(target=host_to_device, daemon=True).start()
+    threading.Thread(target=device_to_host, daemon=True).start()
+    return path
+
+
+def benchmark(port, n_frames=200, continuous=True):
+    # Frame throughput of the FrameReader over `port` (any pyserial-like object)
+    reader = FrameReader()
+    port.reset_input_buffer()
+    port.write(_packet(0x02 if continuous else 0x01))
+    start = time.perf_counter()
+    ok = 0
+    for _ in range(n_frames):
+        if not continuous and ok:
+            port.write(_packet(0x01))
+        data, error = reader.read(port)
+        if data is not None:
+            ok += 1
+    elapsed = time.perf_counter() - start
+    if continuous:
+        port.write(_packet(0x06))
+    return {
+        'frames': ok,
+        'seconds': elapsed,
+        'fps': ok / elapsed if elapsed > 0 else 0.0,
+        'corrupt_frames': reader.corrupt_frames,
+        'resyncs': reader.resyncs,
+        'bytes_discarded': reader.bytes_discarded,
+    }
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Virtual spectrometer for benchmarking without hardware")
+    parser.add_argument("--pty", action="store_true", help="serve the device on a pseudo-terminal until Ctrl+C")
+    parser.add_argument("--bench", type=int, default=0, metavar="N", help="read N frames and report throughput")
+    parser.add_argument("--single", action="store_true", help="benchmark soft-trigger round trips instead of continuous mode")
+    parser.add_argument("--inttime", type=int, default=1, help="integration time (ms)")
+    parser.add_argument("--noise", type=float, default=20.0)
+    parser.add_argument("--latency", type=float, default=0.0, help="reply latency (s)")
+    parser.add_argument("--corrupt", type=float, default=0.0, help="probability of a corrupted frame")
+    parser.add_argument("--garbage", type=float, default=0.0, help="probability of stray bytes before a frame")
+    parser.add_argument("--no-realtime", action="store_true", help="deliver frames as fast as possible")
+    args = parser.parse_args()
+
+    device = open_virtual_port(
+        integration_time=args.inttime, noise=args.noise, latency=args.latency,
+        corrupt_prob=args.corrupt, garbage_prob=args.garbage, realtime=not args.no_realtime,
+    )
+    if args.pty:
+        print(serve_pty(device), flush=True)
+        try:
+            while True:
+                time.sleep(1)
+        except KeyboardInterrupt:
+            pass
+    elif args.bench:
+        result = benchmark(device, args.bench, continuous=not args.single)
+        for k, v in result.items():
+            print(f"{k}: {v:.3f}" if isinstance(v, float) else f"{k}: {v}")
+    else:
+        parser.print_help()
+    device.close()
+    sys.exit(0)